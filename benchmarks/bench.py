@@ -0,0 +1,225 @@
+"""
+Benchmarks for building and serializing large synthetic state machines.
+
+Usage:
+    python benchmarks/bench.py --size 10000 --output bench.json
+    python benchmarks/bench.py --size 10000 --compare bench.json
+
+Each shape is timed for construction (next/add_state), build and to_json, and
+peak memory is recorded in a separate pass under tracemalloc so it does not skew the timings.
+"""
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from steppygraph.machine import StateMachine, Branch, Parallel  # noqa: E402
+from steppygraph.states import Task, Resource, ResourceType, Pass, Wait, Succeed, Choice, ChoiceCase, \
+    Comparison, ComparisonType, Retrier, Catcher, ErrorType  # noqa: E402
+
+
+def lambda_task(name: str) -> Task:
+    return Task(name, resource=Resource(name, type=ResourceType.LAMBDA), retry=[Retrier()])
+
+
+def linear(size: int) -> StateMachine:
+    """A single chain of tasks wired up with next()"""
+    s = StateMachine(region='eu-west-1', account='123456789012')
+    for i in range(size):
+        s.next(lambda_task(f"task-{i}"))
+    return s
+
+
+def interleaved(size: int) -> StateMachine:
+    """next() mixed with out of sequence add_state() calls and catchers pointing back at them"""
+    s = StateMachine(region='eu-west-1', account='123456789012')
+    handler = Pass("handler")
+    s.add_state(handler)
+    for i in range(size - 1):
+        if i % 3 == 0:
+            s.add_state(Wait(f"wait-{i}", seconds=1))
+        else:
+            t = lambda_task(f"task-{i}")
+            t.Catch = [Catcher([ErrorType.ALL], next=handler)]
+            s.next(t)
+    return s
+
+
+def wide_parallel(size: int, states_per_branch: int = 5) -> StateMachine:
+    """One Parallel state with size / states_per_branch branches"""
+    branches = []
+    for b in range(max(1, size // states_per_branch)):
+        branch = Branch(region='eu-west-1', account='123456789012')
+        for i in range(states_per_branch):
+            branch.next(lambda_task(f"branch-{b}-task-{i}"))
+        branches.append(branch)
+    s = StateMachine(region='eu-west-1', account='123456789012')
+    s.next(Parallel("fan-out", branches=branches))
+    s.next(Succeed("done"))
+    return s
+
+
+def deep(size: int, width: int = 2, leaf_states: int = 4) -> StateMachine:
+    """Parallel states nested inside each other's branches until about size states exist"""
+    counter = [0]
+
+    def make(depth: int) -> List[Branch]:
+        branches = []
+        for _ in range(width):
+            b = Branch()
+            for _ in range(leaf_states):
+                counter[0] += 1
+                b.next(Pass(f"pass-{counter[0]}"))
+            if depth > 0:
+                counter[0] += 1
+                b.next(Parallel(f"parallel-{counter[0]}", branches=make(depth - 1)))
+            branches.append(b)
+        return branches
+
+    depth = 0
+    while (width ** (depth + 2)) * (leaf_states + 1) < size:
+        depth += 1
+    s = StateMachine()
+    s.next(Parallel("root", branches=make(depth)))
+    return s
+
+
+def choice_fan_out(size: int) -> StateMachine:
+    """A Choice state with one case per target state"""
+    s = StateMachine()
+    targets = [Pass(f"target-{i}") for i in range(size)]
+    cases = [ChoiceCase("$.value", Comparison(ComparisonType.NUMERIC_EQ, i), next=t) for i, t in enumerate(targets)]
+    s.next(Choice("router", choices=cases, default=targets[0]))
+    for t in targets:
+        s.add_state(t)
+    return s
+
+
+SHAPES: Dict[str, Callable[[int], StateMachine]] = {
+    'linear': linear,
+    'interleaved': interleaved,
+    'wide_parallel': wide_parallel,
+    'deep': deep,
+    'choice_fan_out': choice_fan_out,
+}
+
+
+def timed(fn: Callable[[], object]) -> float:
+    gc.collect()
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run_shape(name: str, size: int, repeat: int) -> Dict[str, float]:
+    factory = SHAPES[name]
+    construct, build, to_json, rebuild = [], [], [], []
+    out_bytes = 0
+    for _ in range(repeat):
+        machines: List[StateMachine] = []
+        construct.append(timed(lambda: machines.append(factory(size))))
+        m = machines[0]
+        build.append(timed(m.build))
+        rebuild.append(timed(m.build))
+        out: List[str] = []
+        to_json.append(timed(lambda: out.append(m.to_json())))
+        out_bytes = len(out[0])
+
+    tracemalloc.start()
+    m = factory(size)
+    m.build()
+    m.to_json()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'construct_s': min(construct),
+        'build_s': min(build),
+        'rebuild_s': min(rebuild),
+        'to_json_s': min(to_json),
+        'peak_mb': peak / 1e6,
+        'output_bytes': out_bytes,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=Path(__file__).resolve().parent,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, previous: dict, threshold: float) -> List[str]:
+    """
+    Prints each metric next to its previous value and returns the ones which got slower
+    or bigger by more than threshold (a ratio)
+    """
+    regressions = []
+    for shape, metrics in current['results'].items():
+        before = previous.get('results', {}).get(shape)
+        if not before:
+            continue
+        for metric, value in metrics.items():
+            old = before.get(metric)
+            # sub-millisecond timings are mostly noise
+            if metric == 'output_bytes' or not old or (metric.endswith('_s') and old < 1e-3):
+                continue
+            ratio = value / old
+            marker = ''
+            if ratio > 1 + threshold:
+                marker = '  REGRESSION'
+                regressions.append(f"{shape}.{metric}")
+            print(f"{shape:16} {metric:12} {old:10.4f} -> {value:10.4f} ({ratio:5.2f}x){marker}")
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=10000, help='approximate number of states per machine')
+    parser.add_argument('--repeat', type=int, default=3, help='timings keep the best of this many runs')
+    parser.add_argument('--shapes', nargs='+', choices=sorted(SHAPES), default=list(SHAPES))
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='compare against a previous results file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for shape in args.shapes:
+        results[shape] = run_shape(shape, args.size, args.repeat)
+        r = results[shape]
+        print(f"{shape:16} construct {r['construct_s']:.4f}s  build {r['build_s']:.4f}s  "
+              f"rebuild {r['rebuild_s']:.4f}s  to_json {r['to_json_s']:.4f}s  peak {r['peak_mb']:.1f}MB")
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'size': args.size,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous.get('size') != args.size:
+            print(f"warning: comparing size {args.size} against size {previous.get('size')}")
+        if compare(report, previous, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Builds and serializes many independent state machines across a pool of worker processes.
+"""
+import os
+import traceback
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from steppygraph.machine import StateMachine
+from steppygraph.serialize import JSON_INDENT, Indent, Separators, Profile, dumps, get_profile
+
+MachineSource = Union[StateMachine, Callable[[], StateMachine]]
+# sort_keys, indent and separators
+Options = Tuple[bool, Indent, Separators]
+
+# chunks queued per worker, enough to keep every process busy without materializing the whole input
+PENDING_PER_WORKER = 4
+
+
+class RenderResult:
+    """
+    The outcome of rendering one machine. index is the position of the machine in the input,
+    exactly one of json and error is set. error holds the formatted traceback from the worker.
+    """
+    __slots__ = ('index', 'json', 'error')
+
+    def __init__(self, index: int, json: Optional[str] = None, error: Optional[str] = None) -> None:
+        self.index = index
+        self.json = json
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        return f"RenderResult({self.index}, {'ok' if self.ok else 'error'})"
+
+
+def render(source: MachineSource, sort_keys: bool = True, indent: Indent = JSON_INDENT,
+           separators: Separators = None) -> str:
+    """
+    Builds and serializes a machine, calling source first if it is a factory
+    """
+    m = source if isinstance(source, StateMachine) else source()
+    return dumps(m.build(), sort_keys=sort_keys, indent=indent, separators=separators)
+
+
+def _render_chunk(chunk: List[Tuple[int, MachineSource]], options: Options) -> List[RenderResult]:
+    results = []
+    for index, source in chunk:
+        try:
+            results.append(RenderResult(index, json=render(source, *options)))
+        except Exception:
+            results.append(RenderResult(index, error=traceback.format_exc()))
+    return results
+
+
+def _chunks(sources: Iterable[MachineSource], size: int) -> Iterator[List[Tuple[int, MachineSource]]]:
+    chunk: List[Tuple[int, MachineSource]] = []
+    for item in enumerate(sources):
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _collect(future: Future, chunk: List[Tuple[int, MachineSource]]) -> List[RenderResult]:
+    try:
+        return future.result()
+    except Exception:
+        # the chunk never ran, e.g. a factory could not be pickled or a worker died
+        error = traceback.format_exc()
+        return [RenderResult(index, error=error) for index, _ in chunk]
+
+
+def _submit(pool: Executor, chunk: List[Tuple[int, MachineSource]], options: Options) -> Future:
+    try:
+        return pool.submit(_render_chunk, chunk, options)
+    except Exception as e:
+        # e.g. BrokenProcessPool once a worker has died, reported for each machine of the chunk by _collect
+        f: Future = Future()
+        f.set_exception(e)
+        return f
+
+
+def render_many(sources: Iterable[MachineSource],
+                workers: Optional[int] = None,
+                ordered: bool = True,
+                chunk_size: int = 1,
+                sort_keys: bool = True,
+                indent: Indent = JSON_INDENT,
+                executor: Optional[Executor] = None,
+                separators: Separators = None,
+                profile: Union[str, Profile] = None) -> Iterator[RenderResult]:
+    """
+    Renders machines in worker processes, yielding a RenderResult per machine.
+
+    Sources may be StateMachine objects, which are pickled to the workers, or picklable factories
+    (module level functions, functools.partial) which build the machine inside the worker.
+    A machine which fails to build or serialize, or which cannot be handed to a worker because the pool is
+    broken, is reported in its result without stopping the batch.
+
+    :param workers: number of processes, defaults to the CPU count
+    :param ordered: yield results in input order, otherwise as soon as they complete
+    :param chunk_size: machines sent to a worker at a time, raise it for many small machines
+    :param executor: use this executor instead of starting a process pool
+    :param profile: a serialization profile, see steppygraph.serialize, replacing sort_keys, indent and separators
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    if profile is not None:
+        p = get_profile(profile)
+        sort_keys, indent, separators = p.sort_keys, p.indent, p.separators
+    options: Options = (sort_keys, indent, separators)
+    own = executor is None
+    pool = ProcessPoolExecutor(workers) if executor is None else executor
+    window = (workers or os.cpu_count() or 1) * PENDING_PER_WORKER
+    chunks = _chunks(sources, chunk_size)
+    try:
+        if ordered:
+            queue: Deque[Tuple[Future, List[Tuple[int, MachineSource]]]] = deque()
+            for chunk in chunks:
+                queue.append((_submit(pool, chunk, options), chunk))
+                if len(queue) >= window:
+                    yield from _collect(*queue.popleft())
+            while queue:
+                yield from _collect(*queue.popleft())
+        else:
+            pending: Set[Future] = set()
+            submitted = {}
+            for chunk in chunks:
+                f = _submit(pool, chunk, options)
+                pending.add(f)
+                submitted[f] = chunk
+                if len(pending) >= window:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        yield from _collect(f, submitted.pop(f))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    yield from _collect(f, submitted.pop(f))
+    finally:
+        if own:
+            pool.shutdown(cancel_futures=True)
@@ -0,0 +1,129 @@
+"""
+A content-addressed on-disk cache of rendered machine definitions, keyed by the machine's structural hash and
+the output options.
+
+The hash is recomputed from the machine's current content on every lookup, see hashing.content_digest, so values
+changed in place, such as a Retrier or a Parameters dict, never get the JSON rendered before the change.
+"""
+import hashlib
+import os
+import tempfile
+from typing import Dict, Optional, Tuple, Union
+
+from steppygraph.hashing import content_hash
+from steppygraph.machine import StateMachine
+from steppygraph.serialize import JSON_INDENT, Indent, Separators, Profile, dumps, get_profile
+
+# bump when the rendered output of unchanged machines changes, so stale entries are never served
+CACHE_VERSION = 2
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_SUFFIX = '.json'
+
+
+class DefinitionCache:
+    """
+    Stores rendered JSON in one file per key under directory. Reads refresh a file's modification time
+    and the least recently used files are deleted once the total size exceeds max_bytes.
+
+    :param directory: created if it does not exist
+    :param max_bytes: upper bound on the total size of cached files
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        # key to (last used, size), loaded from the directory on first write
+        self._entries: Optional[Dict[str, Tuple[float, int]]] = None
+
+    def key(self, machine: StateMachine, sort_keys: bool = True, indent: Indent = JSON_INDENT,
+            separators: Separators = None) -> str:
+        options = repr((sort_keys, indent, None if separators is None else tuple(separators)))
+        return f"{content_hash(machine)}-{CACHE_VERSION}-{hashlib.blake2b(options.encode(), digest_size=8).hexdigest()}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        if self._entries is not None and key in self._entries:
+            self._entries[key] = (os.path.getmtime(path), self._entries[key][1])
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        data = text.encode('utf-8')
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        entries = self._load()
+        entries[key] = (os.path.getmtime(self._path(key)), len(data))
+        self._evict()
+
+    def _load(self) -> Dict[str, Tuple[float, int]]:
+        if self._entries is None:
+            self._entries = {}
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(_SUFFIX):
+                    st = entry.stat()
+                    self._entries[entry.name[:-len(_SUFFIX)]] = (st.st_mtime, st.st_size)
+        return self._entries
+
+    def size(self) -> int:
+        return sum(size for _, size in self._load().values())
+
+    def _evict(self) -> None:
+        entries = self._load()
+        total = sum(size for _, size in entries.values())
+        if total <= self.max_bytes:
+            return
+        for key, (_, size) in sorted(entries.items(), key=lambda kv: kv[1][0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+            del entries[key]
+            total -= size
+
+    def clear(self) -> None:
+        for key in list(self._load()):
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+        self._entries = {}
+
+    def render(self, machine: StateMachine, sort_keys: bool = True, indent: Indent = JSON_INDENT,
+               separators: Separators = None, profile: Union[str, Profile] = None) -> str:
+        """
+        Returns the machine's JSON, from the cache if an identical machine was rendered before with the same
+        options. profile, if given, replaces sort_keys, indent and separators, see StateMachine.to_json.
+        On a hit the machine is neither built nor serialized.
+        """
+        if profile is not None:
+            p = get_profile(profile)
+            sort_keys, indent, separators = p.sort_keys, p.indent, p.separators
+        key = self.key(machine, sort_keys, indent, separators)
+        text = self.get(key)
+        if text is not None:
+            self.hits += 1
+            return text
+        self.misses += 1
+        text = dumps(machine.build(), sort_keys=sort_keys, indent=indent, separators=separators)
+        self.put(key, text)
+        return text
@@ -0,0 +1,138 @@
+"""
+Structural diff of two machines. Machines and branches with equal digests (see steppygraph.hashing) are skipped
+without being walked. Within machines which differ every state is matched by name and its digest compared, which
+is linear in the number of states, but digests are cached so only the fields of the states which changed, and of
+the branches leading to them, are compared and rendered.
+"""
+from typing import Any, Dict, List, Tuple, Union
+
+from steppygraph.hashing import machine_digest, rendered_fields, state_digest
+from steppygraph.machine import StateMachine
+from steppygraph.serialize import encode
+from steppygraph.states import State
+
+# a state's location: the names of the Parallel states and branch indexes leading to it, then its own name
+StatePath = Tuple[Union[str, int], ...]
+
+MACHINE_FIELDS = ('StartAt', 'TimeoutSeconds', 'End', 'Comment', 'Version')
+
+
+class StateChange:
+    """
+    A state present in both machines whose rendered fields differ.
+    fields maps each changed field to its old and new value, transitions does the same for the names
+    of the states the Next, Default, Catch and Choices fields lead to.
+    """
+    __slots__ = ('path', 'fields', 'transitions')
+
+    def __init__(self, path: StatePath) -> None:
+        self.path = path
+        self.fields: Dict[str, Tuple[Any, Any]] = {}
+        self.transitions: Dict[str, Tuple[Any, Any]] = {}
+
+    def __repr__(self) -> str:
+        return f"StateChange({self.path}, fields={sorted(self.fields)}, transitions={sorted(self.transitions)})"
+
+
+class MachineDiff:
+    """
+    The differences between two machines. added and removed hold the paths of states, or of whole
+    branches as (parallel name, branch index), found in only one of them.
+    """
+
+    def __init__(self) -> None:
+        self.added: List[StatePath] = []
+        self.removed: List[StatePath] = []
+        self.modified: List[StateChange] = []
+        self.fields: Dict[StatePath, Dict[str, Tuple[Any, Any]]] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.modified or self.fields)
+
+    def __repr__(self) -> str:
+        return f"MachineDiff(added={self.added}, removed={self.removed}, modified={self.modified}, " \
+               f"fields={self.fields})"
+
+
+def _targets(field: str, value: Any) -> Any:
+    if field in ('Next', 'Default'):
+        return value
+    if field in ('Catch', 'Choices'):
+        return [c.get('Next') for c in value]
+    return None
+
+
+def _machine_fields(m: StateMachine) -> Dict[str, Any]:
+    states = m.get_states()
+    d = {f: getattr(m, f, None) for f in MACHINE_FIELDS}
+    d['StartAt'] = states[0].name() if states else None
+    return d
+
+
+def _diff_state(old: State, old_last: bool, new: State, new_last: bool, path: StatePath, result: MachineDiff) -> None:
+    before = rendered_fields(old, old_last)
+    after = rendered_fields(new, new_last)
+    change = StateChange(path)
+    for f in sorted(set(before) | set(after)):
+        a, b = before.get(f), after.get(f)
+        if f == 'Branches':
+            _diff_branches(a or [], b or [], path, result)
+            continue
+        if f == 'Iterator' and a is not None and b is not None:
+            # a Map state's iterator is compared like a Parallel state's only branch
+            _diff_machines(a, b, path + (0,), result)
+            continue
+        a, b = encode(a), encode(b)
+        if a == b:
+            continue
+        change.fields[f] = (a, b)
+        ta, tb = _targets(f, a or []), _targets(f, b or [])
+        if ta != tb:
+            change.transitions[f] = (ta, tb)
+    if change.fields:
+        result.modified.append(change)
+
+
+def _diff_branches(old: List[StateMachine], new: List[StateMachine], path: StatePath, result: MachineDiff) -> None:
+    for i in range(max(len(old), len(new))):
+        if i >= len(new):
+            result.removed.append(path + (i,))
+        elif i >= len(old):
+            result.added.append(path + (i,))
+        else:
+            _diff_machines(old[i], new[i], path + (i,), result)
+
+
+def _diff_machines(old: StateMachine, new: StateMachine, path: StatePath, result: MachineDiff) -> None:
+    if machine_digest(old) == machine_digest(new):
+        return
+    before, after = _machine_fields(old), _machine_fields(new)
+    changed = {f: (before[f], after[f]) for f in MACHINE_FIELDS if before[f] != after[f]}
+    if changed:
+        result.fields[path] = changed
+
+    old_states, new_states = old.get_states(), new.get_states()
+    old_last, new_last = len(old_states) - 1, len(new_states) - 1
+    for i, s in enumerate(old_states):
+        j = new.idx(s.name())
+        if j is None:
+            result.removed.append(path + (s.name(),))
+            continue
+        n = new_states[j]
+        if state_digest(s, i == old_last) != state_digest(n, j == new_last):
+            _diff_state(s, i == old_last, n, j == new_last, path + (s.name(),), result)
+    for s in new_states:
+        if old.idx(s.name()) is None:
+            result.added.append(path + (s.name(),))
+
+
+def diff(old: StateMachine, new: StateMachine) -> MachineDiff:
+    """
+    Compares two machines or branches state by state, matching states by name.
+    An empty (falsy) result means both render the same JSON.
+    Takes time linear in the number of states of each machine or branch whose digest differs, and constant time
+    for those which are the same once their digests are cached.
+    """
+    result = MachineDiff()
+    _diff_machines(old, new, (), result)
+    return result
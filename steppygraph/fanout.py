@@ -0,0 +1,202 @@
+"""
+Parallel states with many branches which differ only in a few values, for example one branch per shard.
+
+The branch is written once as a prototype with param() markers where the values differ, plus one row of values
+per branch. The prototype is rendered to plain values once and each branch is stamped out of that skeleton when
+the state is serialized: only the parts containing markers are rebuilt, the rest is shared between branches.
+No Branch, State or Resource objects are created per row unless the branches are iterated, which loads real
+Branch objects for the local runner, the validator and the like, once until the prototype changes.
+"""
+import json
+import re
+from copy import deepcopy
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional
+
+from steppygraph.hashing import machine_digest
+from steppygraph.loader import from_dict
+from steppygraph.machine import Branch, Parallel
+from steppygraph.serialize import encode, to_serializable
+from steppygraph.states import State, StateType, Catcher, ComparisonType
+
+# private use characters around a parameter name
+_OPEN, _CLOSE = '\ue000', '\ue001'
+_MARKER = re.compile(f'{_OPEN}([^{_CLOSE}]*){_CLOSE}')
+
+Row = Mapping[str, Any]
+# builds a value for one row, None stands for a value without markers which is shared as it is
+Stamp = Optional[Callable[[Row], Any]]
+
+# fields which must be strings, a marker standing for a whole one is replaced by the row's value as JSON text
+_TEXT_FIELDS = frozenset(('StartAt', 'Next', 'Default', 'Type', 'Resource', 'Comment', 'Version', 'InputPath',
+                          'OutputPath', 'ResultPath', 'ItemsPath', 'SecondsPath', 'Timestamp', 'TimestampPath',
+                          'Variable', 'ErrorEquals', 'Cause', 'Error')) | \
+    frozenset(c.value for c in ComparisonType if c.value.startswith(('String', 'Timestamp')))
+# fields holding the execution's data rather than definition objects
+_DATA_FIELDS = frozenset(('Parameters', 'Result'))
+
+
+def param(name: str) -> str:
+    """
+    Returns a marker for the value of name in each row. Anywhere in a string it is replaced by the row's value
+    as JSON text, true rather than True, so the value must be a scalar. A string which is only the marker is
+    replaced by the value itself, which may be any JSON value, except in fields which must be strings such as
+    StartAt and Next.
+    """
+    return f"{_OPEN}{name}{_CLOSE}"
+
+
+def _compile_str(s: str, whole: bool) -> Stamp:
+    pieces = _MARKER.split(s)
+    if len(pieces) == 1:
+        return None
+    if whole and len(pieces) == 3 and pieces[0] == pieces[2] == '':
+        name = pieces[1]
+        return lambda row: encode(row[name])
+    texts, names = pieces[0::2], pieces[1::2]
+
+    def fill(row: Row) -> str:
+        parts = [texts[0]]
+        for n, t in zip(names, texts[1:]):
+            parts.append(_text(n, row[n]))
+            parts.append(t)
+        return ''.join(parts)
+    return fill
+
+
+def _text(name: str, value: Any) -> str:
+    """
+    Returns a value as it reads in JSON, without quotes for strings
+    """
+    if isinstance(value, str):
+        return value
+    if value is None or isinstance(value, (bool, int, float)):
+        return json.dumps(value)
+    raise ValueError(f"Parameter '{name}' is part of a string, its value must be a string, number, boolean or "
+                     f"null, not {type(value).__name__}")
+
+
+def _compile(v: Any, text: bool = False, fields: bool = True) -> Stamp:
+    """
+    text is True for values which must be strings, fields for dicts whose keys are definition fields
+    rather than parts of the execution's data
+    """
+    if isinstance(v, str):
+        return _compile_str(v, not text)
+    if isinstance(v, list):
+        stamps = [_compile(i, text, fields) for i in v]
+        if not any(stamps):
+            return None
+        items = list(zip(v, stamps))
+        return lambda row: [i if f is None else f(row) for i, f in items]
+    if isinstance(v, dict):
+        entries = [(k, _compile_str(k, False), i,
+                    _compile(i, fields and k in _TEXT_FIELDS, fields and k not in _DATA_FIELDS))
+                   for k, i in v.items()]
+        if not any(kf or f for _, kf, _, f in entries):
+            return None
+        return lambda row: {k if kf is None else kf(row): i if f is None else f(row) for k, kf, i, f in entries}
+    return None
+
+
+class BranchTable:
+    """
+    The branches of a FanOut state: a prototype Branch and one row of parameter values per branch.
+    Indexing or iterating loads Branch objects, which are kept until the prototype changes, serializing only
+    stamps out plain values.
+    """
+    __slots__ = ('prototype', 'rows', '_skeleton', '_stamp', '_key', '_branches')
+
+    def __init__(self, prototype: Branch, rows: Iterable[Row]) -> None:
+        self.prototype = prototype
+        self.rows = tuple(rows)
+        self._skeleton: Any = None
+        self._stamp: Stamp = None
+        self._key: Optional[bytes] = None
+        self._branches: List[Optional[Branch]] = []
+
+    def _compiled(self) -> Stamp:
+        # recompiled whenever the prototype has changed, which its digest tells cheaply
+        key = machine_digest(self.prototype)
+        if key != self._key:
+            self._skeleton = encode(self.prototype.build())
+            self._stamp = _compile(self._skeleton)
+            self._key = key
+            self._branches = [None] * len(self.rows)
+        return self._stamp
+
+    def stamp(self, i: int) -> Dict[str, Any]:
+        """
+        Returns branch i as plain values. Parts without parameters are shared with the other branches.
+        """
+        stamp = self._compiled()
+        if stamp is None:
+            return self._skeleton
+        try:
+            return stamp(self.rows[i])
+        except KeyError as e:
+            raise ValueError(f"Row {i} has no value for parameter {e}")
+        except ValueError as e:
+            raise ValueError(f"Row {i}: {e}")
+
+    def stamped(self) -> List[Dict[str, Any]]:
+        return [self.stamp(i) for i in range(len(self.rows))]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, i: int) -> Branch:
+        if not -len(self.rows) <= i < len(self.rows):
+            raise IndexError(i)
+        self._compiled()
+        b = self._branches[i]
+        if b is None:
+            b = from_dict(deepcopy(self.stamp(i)), branch=True)
+            # the loaded tasks keep the timeouts and integration patterns the prototype rendered
+            b._workflow_type = self.prototype.workflow_type
+            b = self._branches[i] = b.build()  # type: ignore
+        return b
+
+    def __iter__(self) -> Iterator[Branch]:
+        for i in range(len(self.rows)):
+            yield self[i]
+
+
+@to_serializable.register(BranchTable)
+def branch_table_to_json(val: BranchTable) -> List[Dict[str, Any]]:
+    return val.stamped()
+
+
+class FanOut(Parallel):
+    """
+    A Parallel state running one copy of prototype per row, with the param() markers in it replaced by the
+    row's values. Changing the prototype afterwards changes every branch.
+    """
+    __slots__ = ()
+
+    def __init__(self,
+                 name: str,
+                 prototype: Branch,
+                 rows: Iterable[Row],
+                 comment: str = None,
+                 catch: List[Catcher] = None
+                 ) -> None:
+        State.__init__(self, type=StateType.PARALLEL, name=name, comment=comment)
+        self._catch = catch
+        self.Branches = BranchTable(prototype, rows)  # type: ignore
+
+    def __copy__(self) -> 'FanOut':
+        other = State.__copy__(self)
+        other.Branches.prototype.add_parent(other)
+        return other  # type: ignore
+
+    def __setattr__(self, key: str, value: Any) -> None:
+        State.__setattr__(self, key, value)
+        if key == 'Branches':
+            value.prototype.add_parent(self)
+
+    def build(self) -> object:
+        if self._dirty:
+            if self._catch:
+                self.Catch = self._catch
+            self._dirty = False
+        return self
@@ -0,0 +1,211 @@
+"""
+Stable structural hashes of states and machines, computed from the same fields the JSON output is made of
+but without building or serializing the machine.
+
+Digests are cached like a Merkle tree: on each state until it is marked dirty, and on each machine until one of
+its states changes or a state is added. A change inside a branch marks the Parallel state holding it dirty, which
+invalidates the enclosing machine in turn, so rehashing only touches the changed path. Call mark_dirty() after
+changing a nested object such as a Retrier in place, as for the cached JSON fragment, or use content_digest,
+which trusts no cached digest and marks the states it finds changed dirty.
+"""
+import hashlib
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Tuple
+
+from steppygraph.machine import StateMachine
+from steppygraph.serialize import _converter, fields_of, plan_for
+from steppygraph.states import State, OptionalField
+
+DIGEST_SIZE = 16
+
+_MACHINE_FIELDS = ('TimeoutSeconds', 'End', 'Comment', 'Version')
+
+# False while content_digest walks a machine, digests are then recomputed rather than read from the caches
+_memoized: ContextVar[bool] = ContextVar('memoized', default=True)
+
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def _canonical(v: Any) -> Any:
+    """
+    Reduces a field value to nested tuples of scalars whose repr is stable, in the same order as the output.
+    Branch machines become their digests.
+    """
+    t = type(v)
+    if t in _SCALARS:
+        return v
+    try:
+        return _reducers[t](v)
+    except KeyError:
+        return _reducer(t)(v)
+
+
+def _reduce_list(v: Any) -> tuple:
+    return tuple([i if type(i) in _SCALARS else _canonical(i) for i in v])
+
+
+def _reduce_dict(v: Any) -> tuple:
+    return ('{',) + tuple(sorted((str(k), _canonical(i)) for k, i in v.items()))
+
+
+def _reducer(cls: type) -> Callable[[Any], Any]:
+    """
+    Returns the function reducing instances of cls, chosen once per class
+    """
+    if issubclass(cls, StateMachine):
+        fn: Callable[[Any], Any] = machine_digest
+    elif issubclass(cls, (list, tuple)):
+        fn = _reduce_list
+    elif issubclass(cls, dict):
+        fn = _reduce_dict
+    elif plan_for(cls) is not None:
+        plan = plan_for(cls)
+        assert plan is not None
+        fields = plan.fields
+        name = cls.__name__
+
+        def fn(v: Any) -> tuple:
+            if plan.build:
+                v.build()
+            return (name,) + _reduce_list([getattr(v, f, None) for f in
+                                           (fields_of(v, plan) if plan.extras else fields)])
+    else:
+        convert = _converter(cls)
+
+        def fn(v: Any) -> Any:
+            r = convert(v)
+            return r if type(r) in _SCALARS else _canonical(r)
+    _reducers[cls] = fn
+    return fn
+
+
+_reducers: Dict[type, Callable[[Any], Any]] = {list: _reduce_list, tuple: _reduce_list, dict: _reduce_dict}
+
+
+def _digest(data: Any) -> bytes:
+    return hashlib.blake2b(repr(data).encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+
+_layouts: Dict[type, Tuple[str, ...]] = {}
+
+
+def _layout(cls: type) -> Tuple[str, ...]:
+    """
+    The fields of a state class kept in slots, optional fields are read from the state's _extra dict instead
+    """
+    try:
+        return _layouts[cls]
+    except KeyError:
+        plan = plan_for(cls)
+        assert plan is not None
+        _layouts[cls] = fields = tuple(f for f in plan.fields if not isinstance(getattr(cls, f, None), OptionalField))
+        return fields
+
+
+def _state_data(state: State, last: bool) -> tuple:
+    cls = type(state)
+    d = [getattr(state, f, None) for f in _layout(cls)]
+    extra = dict(state._extra) if state._extra else {}
+    # what build() would fill in
+    if state._next and state._builds_next:
+        # Next is the last field of every state
+        d[-1] = state._next
+    catch = getattr(state, '_catch', None)
+    if catch:
+        extra['Catch'] = catch
+    if last:
+        extra['End'] = True
+    return (cls.__name__,) + _reduce_list(d) + _reduce_dict(extra)
+
+
+def rendered_fields(state: State, last: bool = False) -> Dict[str, Any]:
+    """
+    Returns the fields a state would be rendered with, filling in what build() would set
+    """
+    plan = plan_for(type(state))
+    assert plan is not None
+    d = {f: getattr(state, f, None) for f in fields_of(state, plan)}
+    if state._next and state._builds_next:
+        d['Next'] = state._next
+    catch = getattr(state, '_catch', None)
+    if catch:
+        d['Catch'] = catch
+    if last:
+        d['End'] = True
+    return {f: v for f, v in d.items() if v is not None}
+
+
+def state_digest(state: State, last: bool = False) -> bytes:
+    """
+    Returns the digest of a state's rendered fields. last is True for the final state of a machine,
+    which the machine's build marks as the end state.
+    """
+    if not _memoized.get():
+        _refresh(state)
+    if last and state.End is not True:
+        return _digest(_state_data(state, True))
+    d = state._digest
+    if d is None:
+        d = state._digest = _digest(_state_data(state, False))
+    return d
+
+
+def _refresh(state: State) -> None:
+    """
+    Recomputes a state's digest. A state whose digest changed, or which has a cached fragment but no digest to
+    tell, was changed in place and is marked dirty so that its fragment is rebuilt too.
+    """
+    old = state._digest
+    stale = state._fragment is not None
+    d = _digest(_state_data(state, False))
+    if d != old and (old is not None or stale):
+        state.mark_dirty()
+    state._digest = d
+
+
+def machine_digest(machine: StateMachine) -> bytes:
+    """
+    Returns a digest covering the machine's own fields and the name, position and digest of every state.
+    Two machines with the same digest render the same JSON.
+    """
+    d = machine._digest
+    if d is None or not _memoized.get():
+        h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        states = machine.get_states()
+        last = len(states) - 1
+        for i, s in enumerate(states):
+            name = s.name().encode('utf-8')
+            h.update(len(name).to_bytes(4, 'big'))
+            h.update(name)
+            h.update(state_digest(s, i == last))
+        d = machine._digest = h.digest()
+    h = hashlib.blake2b(d, digest_size=DIGEST_SIZE)
+    h.update(repr(_reduce_list([getattr(machine, f, None) for f in _MACHINE_FIELDS])).encode('utf-8'))
+    return h.digest()
+
+
+def machine_hash(machine: StateMachine) -> str:
+    """
+    The machine digest as a hex string, for use as a cache key
+    """
+    return machine_digest(machine).hex()
+
+
+def content_digest(machine: StateMachine) -> bytes:
+    """
+    Returns the machine digest computed from the machine as it is now, walking every state and branch instead of
+    trusting cached digests, so that nested values changed in place without mark_dirty() are taken into account.
+    States found changed are marked dirty, the next build and render pick the changes up.
+    """
+    token = _memoized.set(False)
+    try:
+        return machine_digest(machine)
+    finally:
+        _memoized.reset(token)
+
+
+def content_hash(machine: StateMachine) -> str:
+    """
+    content_digest as a hex string, for use as a cache key
+    """
+    return content_digest(machine).hex()
@@ -0,0 +1,187 @@
+"""
+Opt-in counters, timings and hooks around the operations machines spend their time in: next, add_state,
+last_orphan, set_resource_attrs and build on machines, build on states, rendering, the serialization of each
+machine, state and other value with a field plan, and the to_serializable conversions of values without one.
+Serialization is timed wherever an object is written in one piece, machines and states holding branches that
+dump() and iter_json() walk state by state are not.
+
+enable() swaps instrumented wrappers in for those methods and disable() puts the originals back, so nothing is
+checked or counted while instrumentation is off. State classes defined after enable() is called are not
+instrumented until it is called again.
+"""
+import functools
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from steppygraph import serialize
+from steppygraph.machine import StateMachine
+from steppygraph.states import State
+
+# operation name and the class of the state or value it ran on, None for the operation's totals
+Key = Tuple[str, Optional[str]]
+
+
+class Timing:
+    """
+    How many times an operation ran and the wall time it took in seconds, nested calls included
+    """
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self, count: int = 0, seconds: float = 0.0) -> None:
+        self.count = count
+        self.seconds = seconds
+
+    def __repr__(self) -> str:
+        return f"Timing({self.count}, {self.seconds:.6f})"
+
+
+class Hook:
+    """
+    Called around every instrumented operation. target is the state or value operated on, None if there is none.
+    """
+
+    def begin(self, operation: str, target: Any) -> None:
+        pass
+
+    def end(self, operation: str, target: Any, seconds: float) -> None:
+        pass
+
+
+# operation name, class, method and the position of the argument it runs on, 0 for self
+_METHODS = (
+    ('StateMachine.next', StateMachine, 'next', 1),
+    ('StateMachine.add_state', StateMachine, 'add_state', 1),
+    ('StateMachine.last_orphan', StateMachine, 'last_orphan', None),
+    ('StateMachine.set_resource_attrs', StateMachine, 'set_resource_attrs', 1),
+    ('StateMachine.build', StateMachine, 'build', None),
+    ('StateMachine.to_json', StateMachine, 'to_json', None),
+    ('StateMachine.dump', StateMachine, 'dump', None),
+    ('State.to_json', State, 'to_json', 0),
+)
+
+_stats: Dict[Key, Timing] = {}
+_hooks: List[Hook] = []
+# (owner, attribute, original value) of everything replaced by enable()
+_patched: List[Tuple[Any, str, Any]] = []
+_converters: Dict[type, Callable[[Any], Any]] = {}
+
+
+def _record(operation: str, target: Any, seconds: float) -> None:
+    keys: Tuple[Key, ...] = ((operation, None),) if target is None else \
+        ((operation, None), (operation, type(target).__name__))
+    for key in keys:
+        t = _stats.get(key)
+        if t is None:
+            t = _stats[key] = Timing()
+        t.count += 1
+        t.seconds += seconds
+
+
+def _wrap(operation: str, fn: Callable, arg: Optional[int]) -> Callable:
+    perf = time.perf_counter
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        target = args[arg] if arg is not None and arg < len(args) else None
+        for h in _hooks:
+            h.begin(operation, target)
+        start = perf()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            seconds = perf() - start
+            _record(operation, target, seconds)
+            for h in _hooks:
+                h.end(operation, target, seconds)
+    return wrapper
+
+
+def _state_classes() -> Iterator[type]:
+    todo = [State]
+    while todo:
+        cls = todo.pop()
+        yield cls
+        todo.extend(cls.__subclasses__())
+
+
+def _patch(owner: Any, name: str, value: Any) -> None:
+    _patched.append((owner, name, owner.__dict__[name]))
+    setattr(owner, name, value)
+
+
+_original_converter = serialize._converter
+
+
+def _converter(cls: type) -> Callable[[Any], Any]:
+    try:
+        return _converters[cls]
+    except KeyError:
+        _converters[cls] = fn = _wrap('to_serializable', _original_converter(cls), 0)
+        return fn
+
+
+def _object_writer(write_obj: Callable) -> Callable:
+    return _wrap('serialize', write_obj, 0)
+
+
+def enable() -> None:
+    """
+    Starts counting. Counts carry on from where they were, see reset().
+    """
+    if _patched:
+        return
+    for operation, cls, name, arg in _METHODS:
+        _patch(cls, name, _wrap(operation, cls.__dict__[name], arg))
+    for cls in _state_classes():
+        if 'build' in cls.__dict__:
+            _patch(cls, 'build', _wrap('State.build', cls.__dict__['build'], 0))
+    _patch(serialize, '_converter', _converter)
+    _patch(serialize, '_encode_obj', _wrap('serialize', serialize._encode_obj, 0))
+    _patch(serialize, '_object_writer', _object_writer)
+
+
+def disable() -> None:
+    """
+    Stops counting and restores the original methods. Counts are kept until reset().
+    """
+    while _patched:
+        owner, name, value = _patched.pop()
+        setattr(owner, name, value)
+    _converters.clear()
+
+
+def is_enabled() -> bool:
+    return bool(_patched)
+
+
+@contextmanager
+def enabled() -> Iterator[None]:
+    """
+    Instruments the body of a with statement
+    """
+    enable()
+    try:
+        yield
+    finally:
+        disable()
+
+
+def snapshot() -> Dict[Key, Timing]:
+    """
+    Returns a copy of the counts so far, keyed by (operation, None) for each operation's totals and by
+    (operation, class name) for the states or values it ran on
+    """
+    return {k: Timing(t.count, t.seconds) for k, t in _stats.items()}
+
+
+def reset() -> None:
+    _stats.clear()
+
+
+def add_hook(hook: Hook) -> None:
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Hook) -> None:
+    _hooks.remove(hook)
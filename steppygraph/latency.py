@@ -0,0 +1,271 @@
+"""
+Static bounds on how long executions of a machine can take, for sizing timeouts and SLAs.
+
+Each state is costed from its own settings: Wait states from Seconds, or from given durations when they wait
+on a path or timestamp, with no worst case bound without them, tasks from TimeoutSeconds per attempt
+(or from given durations) times the attempts their Retriers allow plus the backoff intervals, Parallel states
+from their slowest branch and Map states from their iterator, once per wave of MaxConcurrency items. Leaving a
+state through a Catcher is costed as failing after every retry. The best case is the cheapest way from StartAt
+to the end of the execution and the worst case the most expensive one, both found in one pass over the strongly
+connected components of the graph in topological order. A loop has no worst case bound unless max_iterations is
+given. The machine's own TimeoutSeconds is not applied.
+"""
+import heapq
+import math
+from typing import Dict, List, Mapping, Optional, Tuple, Union
+
+from steppygraph.machine import StateMachine, Map
+from steppygraph.states import State, Task, Wait, Retrier, ErrorType
+from steppygraph.validate import _components, _ends, _transitions
+
+# the names of the Parallel states and branch indexes leading to a state, then its own name
+StatePath = Tuple[Union[str, int], ...]
+# best and worst seconds of a single task attempt, or of a Wait state
+Durations = Mapping[str, Tuple[float, float]]
+# number of items of a Map state
+Items = Mapping[str, int]
+
+# what Step Functions uses for Retrier fields left unset
+RETRY_MAX_ATTEMPTS = 3
+RETRY_INTERVAL_SECONDS = 1
+RETRY_BACKOFF_RATE = 2.0
+
+
+class Step:
+    """
+    A state on the critical path and the seconds it takes there. Parallel states are followed by the steps of
+    their slowest branch and Map states by those of one iteration, with container True since their time is the
+    branch's.
+    """
+    __slots__ = ('path', 'best', 'worst', 'container')
+
+    def __init__(self, path: StatePath, best: float, worst: float, container: bool = False) -> None:
+        self.path = path
+        self.best = best
+        self.worst = worst
+        self.container = container
+
+    def __repr__(self) -> str:
+        return f"Step({self.path}, {self.best}, {self.worst})"
+
+
+class Analysis:
+    """
+    best and worst are in seconds, worst is math.inf when unbounded. critical_path is the worst case path.
+    """
+
+    def __init__(self, best: float, worst: float, critical_path: List[Step]) -> None:
+        self.best = best
+        self.worst = worst
+        self.critical_path = critical_path
+
+    def dominant(self, top: int = 5) -> List[Step]:
+        """
+        Returns the states taking the most time on the critical path, slowest first
+        """
+        return heapq.nlargest(top, (s for s in self.critical_path if not s.container), key=lambda s: s.worst)
+
+    def __repr__(self) -> str:
+        return f"Analysis(best={self.best}, worst={self.worst}, steps={len(self.critical_path)})"
+
+
+class _Cost:
+    """
+    A state's best and worst seconds when it succeeds and when it fails into a Catcher
+    """
+    __slots__ = ('best_ok', 'worst_ok', 'best_fail', 'worst_fail', 'branch')
+
+    def __init__(self, best_ok: float, worst_ok: float, best_fail: float, worst_fail: float,
+                 branch: Optional[Analysis] = None) -> None:
+        self.best_ok = best_ok
+        self.worst_ok = worst_ok
+        self.best_fail = best_fail
+        self.worst_fail = worst_fail
+        self.branch = branch
+
+
+def _backoff(r: Retrier) -> Tuple[int, float]:
+    """
+    Returns the retries a Retrier allows and the seconds it waits over all of them
+    """
+    attempts = r.MaxAttempts if r.MaxAttempts is not None else RETRY_MAX_ATTEMPTS
+    interval = r.IntervalSeconds if r.IntervalSeconds is not None else RETRY_INTERVAL_SECONDS
+    rate = r.BackoffRate if r.BackoffRate is not None else RETRY_BACKOFF_RATE
+    return attempts, sum(interval * rate ** n for n in range(attempts))
+
+
+def _retry_cost(retry: List[Retrier]) -> Tuple[int, float, float]:
+    """
+    Returns the retries a state's Retriers allow in all, the seconds they wait over all of them and the least
+    backoff before failing for good
+    """
+    retries = 0
+    waits = 0.0
+    # failing for good takes at least the backoff of the cheapest Retrier an error can end up in,
+    # nothing if some error matches none
+    least: float = math.inf
+    for r in retry:
+        n, w = _backoff(r)
+        retries += n
+        waits += w
+        least = min(least, w)
+        if any(str(e) == ErrorType.ALL.value for e in r.ErrorEquals):
+            break
+    else:
+        least = 0.0
+    return retries, waits, least
+
+
+def _task_cost(task: Task, durations: Durations) -> _Cost:
+    timeout = task.TimeoutSeconds if task.TimeoutSeconds is not None else math.inf
+    best, worst = durations.get(task.name(), (0, timeout))
+    retries, waits, least = _retry_cost(task.Retry or [])
+    slowest = (retries + 1) * worst + waits
+    return _Cost(best, slowest, least, slowest)
+
+
+def _map_cost(state: Map, path: StatePath, durations: Durations, items: Items, max_iterations: Optional[int]) \
+        -> _Cost:
+    a = _analyze(state.Iterator, path + (0,), durations, items, max_iterations)
+    n = items.get(state.name(), 1)
+    waves = math.ceil(n / state.MaxConcurrency) if state.MaxConcurrency and n else min(n, 1)
+    retries, waits, least = _retry_cost(state.Retry or [])
+    slowest = (retries + 1) * waves * a.worst + waits
+    return _Cost(waves * a.best, slowest, least, slowest, a)
+
+
+def _cost(state: State, path: StatePath, durations: Durations, items: Items, max_iterations: Optional[int]) \
+        -> _Cost:
+    if isinstance(state, Task):
+        return _task_cost(state, durations)
+    if isinstance(state, Map):
+        return _map_cost(state, path, durations, items, max_iterations)
+    if isinstance(state, Wait):
+        if state.Seconds is not None:
+            return _Cost(state.Seconds, state.Seconds, 0, 0)
+        # SecondsPath, Timestamp and TimestampPath are only known once the execution runs
+        best, worst = durations.get(state.name(), (0, math.inf))
+        return _Cost(best, worst, 0, 0)
+    branches = getattr(state, 'Branches', None)
+    if branches:
+        analyses = [_analyze(b, path + (i,), durations, items, max_iterations) for i, b in enumerate(branches)]
+        slowest = max(analyses, key=lambda a: a.worst)
+        return _Cost(max(a.best for a in analyses), slowest.worst, 0, slowest.worst, slowest)
+    return _Cost(0, 0, 0, 0)
+
+
+def _best_in(component: List[int], k: int, component_of: List[int], edges: List[List[Tuple[int, float, float]]],
+             ends: List[bool], costs: List[_Cost], best: List[float]) -> None:
+    """
+    Sets the least time from each state of a component to the end, the components it leads to being done already.
+    Within a loop the times are spread from the ways out against the transitions, cheapest first.
+    """
+    inside: List[Tuple[int, int, float]] = []
+    for v in component:
+        t = costs[v].best_ok if ends[v] or not edges[v] else math.inf
+        for w, b, _ in edges[v]:
+            if component_of[w] != k:
+                t = min(t, b + best[w])
+            else:
+                inside.append((v, w, b))
+        best[v] = t
+    if not inside:
+        return
+    into: Dict[int, List[Tuple[int, float]]] = {}
+    for v, w, b in inside:
+        into.setdefault(w, []).append((v, b))
+    heap = [(best[v], v) for v in component if best[v] < math.inf]
+    heapq.heapify(heap)
+    while heap:
+        t, w = heapq.heappop(heap)
+        if t > best[w]:
+            continue
+        for v, b in into.get(w, ()):
+            if t + b < best[v]:
+                best[v] = t + b
+                heapq.heappush(heap, (t + b, v))
+
+
+def _analyze(machine: StateMachine, path: StatePath, durations: Durations, items: Items,
+             max_iterations: Optional[int]) -> Analysis:
+    states = machine.get_states()
+    n = len(states)
+    if not n:
+        return Analysis(0, 0, [])
+    costs = [_cost(s, path + (s.name(),), durations, items, max_iterations) for s in states]
+    ends = [_ends(s, i == n - 1) for i, s in enumerate(states)]
+    # (target, best, worst) per state, the weights being the source state's time when leaving that way
+    edges: List[List[Tuple[int, float, float]]] = []
+    for s, c in zip(states, costs):
+        out = []
+        for field, target in _transitions(s):
+            j = machine.idx(target)
+            if j is not None:
+                out.append((j, c.best_fail, c.worst_fail) if field == 'Catch' else (j, c.best_ok, c.worst_ok))
+        edges.append(out)
+
+    # best and worst case: shortest and longest path to the end over the components, which come sinks first
+    best = [math.inf] * n
+    worst = [0.0] * n
+    # the state each state leaves for on the worst case path, None where it ends, and the time it takes
+    choice: List[Optional[int]] = [None] * n
+    taken = [(c.best_ok, c.worst_ok) for c in costs]
+    components = _components([[w for w, _, _ in out] for out in edges])
+    component_of = [0] * n
+    for k, component in enumerate(components):
+        for v in component:
+            component_of[v] = k
+    looping = [False] * n
+    for k, component in enumerate(components):
+        _best_in(component, k, component_of, edges, ends, costs, best)
+        first = component[0]
+        if len(component) == 1 and all(w != first for w, _, _ in edges[first]):
+            worst[first] = costs[first].worst_ok if ends[first] or not edges[first] else -math.inf
+            for w, b, wt in edges[first]:
+                if wt + worst[w] > worst[first]:
+                    worst[first], choice[first], taken[first] = wt + worst[w], w, (b, wt)
+            continue
+        # every state in a loop is counted max_iterations times, then the most expensive way out
+        loop = 0.0
+        for v in component:
+            looping[v] = True
+            c = costs[v]
+            taken[v] = (c.best_ok, math.inf if max_iterations is None else
+                        max_iterations * max(c.worst_ok, c.worst_fail))
+            loop += taken[v][1]
+        out_worst = 0.0 if any(ends[v] for v in component) else -math.inf
+        out_to = None
+        for v in component:
+            for w, _, _ in edges[v]:
+                if component_of[w] != k and worst[w] > out_worst:
+                    out_worst, out_to = worst[w], w
+        for v in component:
+            # a loop nothing leaves never ends
+            worst[v] = loop + out_worst if out_worst > -math.inf else math.inf
+            choice[v] = out_to
+
+    steps: List[Step] = []
+    at: Optional[int] = 0
+    while at is not None:
+        on_path = sorted(components[component_of[at]]) if looping[at] else [at]
+        for u in on_path:
+            branch = costs[u].branch
+            steps.append(Step(path + (states[u].name(),), taken[u][0], taken[u][1], branch is not None))
+            if branch is not None:
+                steps.extend(branch.critical_path)
+        at = choice[at]
+    return Analysis(best[0], worst[0], steps)
+
+
+def analyze(machine: StateMachine, durations: Durations = None, max_iterations: int = None, items: Items = None) \
+        -> Analysis:
+    """
+    Returns the best and worst case duration of the machine and its critical path.
+
+    :param durations: task state name to the best and worst seconds of one attempt, tasks not listed take
+        from 0 seconds up to their TimeoutSeconds. Wait states without Seconds can be given one too, those
+        not listed take from 0 seconds with no upper bound.
+    :param max_iterations: how many times each state in a loop may run, loops are unbounded without it
+    :param items: Map state name to the number of items it iterates over, 1 for Map states not listed
+    """
+    return _analyze(machine, (), durations or {}, items or {}, max_iterations)
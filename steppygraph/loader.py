@@ -0,0 +1,257 @@
+"""
+Loads Amazon States Language definitions into steppygraph objects, so existing machines can be analyzed,
+diffed and transformed with the same model they would have been written in.
+
+Definitions written by to_json() load back into machines which render the same text. Fields the model cannot
+represent raise LoadError rather than being dropped.
+"""
+import json
+from typing import Any, Dict, IO, List, Optional, Tuple, Type, Union
+
+from steppygraph.machine import StateMachine, Branch, Parallel, Map
+from steppygraph.states import State, Task, BatchJob, EcsTask, Pass, Wait, Choice, ChoiceCase, Comparison, \
+    ComparisonType, Succeed, Fail, Retrier, Catcher, Resource, ResourceType, ErrorType, StateType, StartExecution
+
+_ERRORS = {e.value: e for e in ErrorType}
+_COMPARISONS = {c.value: c for c in ComparisonType}
+# resource type to the task class it is loaded as
+_TASK_CLASSES: Dict[ResourceType, Type[Task]] = {ResourceType.BATCH: BatchJob, ResourceType.ECS: EcsTask,
+                                                  ResourceType.EXECUTION: StartExecution}
+# the resource type and integration pattern of each service integration ARN
+_INTEGRATIONS = {
+    'batch:submitJob.sync': (ResourceType.BATCH, True),
+    'batch:submitJob': (ResourceType.BATCH, False),
+    'ecs:runTask.sync': (ResourceType.ECS, True),
+    'ecs:runTask': (ResourceType.ECS, False),
+    'states:startExecution.sync:2': (ResourceType.EXECUTION, True),
+    'states:startExecution': (ResourceType.EXECUTION, False),
+}
+
+
+# fields built from other objects, which _state converts itself
+_BUILT_FIELDS = ('Type', 'Resource', 'Choices', 'Branches', 'Iterator', 'Next')
+
+
+class LoadError(ValueError):
+    pass
+
+
+class _Ref:
+    """
+    Stands in for the target of a Catcher or Choice until the state it names has been loaded
+    """
+    __slots__ = ('_name',)
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+
+    def name(self) -> str:
+        return self._name
+
+
+def parse_resource(arn: str, state_name: str) -> Resource:
+    """
+    Parses a resource ARN as rendered by Resource. Batch, ECS and execution ARNs do not carry a name,
+    the state's is used. Their integration pattern is kept whatever the machine's workflow type.
+    """
+    parts = arn.split(':', 6)
+    if len(parts) < 6 or parts[0] != 'arn':
+        raise LoadError(f"State '{state_name}': '{arn}' is not an ARN")
+    service, region, account, rest = parts[2], parts[3], parts[4], ':'.join(parts[5:])
+    if service == 'lambda' and rest.startswith('function:'):
+        res = Resource(rest[len('function:'):], type=ResourceType.LAMBDA, region=region, aws_ac=account)
+    elif service == 'states' and rest in _INTEGRATIONS:
+        resource_type, sync = _INTEGRATIONS[rest]
+        res = Resource(state_name, type=resource_type, region=region, aws_ac=account, sync=sync)
+    elif service == 'states' and rest.startswith('activity:'):
+        res = Resource(rest[len('activity:'):], type=ResourceType.ACTIVITY, region=region, aws_ac=account)
+    else:
+        raise LoadError(f"State '{state_name}': unsupported resource '{arn}'")
+    if str(res) != arn:
+        raise LoadError(f"State '{state_name}': unsupported resource '{arn}'")
+    return res
+
+
+def _error(name: str) -> Union[ErrorType, str]:
+    return _ERRORS.get(name, name)
+
+
+def _retrier(d: Dict[str, Any]) -> Retrier:
+    r = Retrier(max_attempts=d.pop('MaxAttempts', None),
+                backoff_rate=d.pop('BackoffRate', None),
+                interval_seconds=d.pop('IntervalSeconds', None),
+                error_equals=[_error(e) for e in d.pop('ErrorEquals', [])])
+    _check_empty(d, 'Retrier')
+    return r
+
+
+def _catcher(d: Dict[str, Any]) -> Catcher:
+    c = Catcher([_error(e) for e in d.pop('ErrorEquals', [])], next=_Ref(d.pop('Next')))  # type: ignore
+    _check_empty(d, 'Catcher')
+    return c
+
+
+def _choice_case(d: Dict[str, Any], state_name: str) -> ChoiceCase:
+    variable = d.pop('Variable', None)
+    target = d.pop('Next', None)
+    if variable is None or target is None or len(d) != 1:
+        raise LoadError(f"State '{state_name}': only single comparisons with a Variable and Next are supported, "
+                        f"got keys {sorted(d)}")
+    op, value = d.popitem()
+    if op not in _COMPARISONS:
+        raise LoadError(f"State '{state_name}': unsupported comparison '{op}'")
+    return ChoiceCase(variable, Comparison(_COMPARISONS[op], value), next=_Ref(target))  # type: ignore
+
+
+def _check_empty(d: Dict[str, Any], where: str) -> None:
+    if d:
+        raise LoadError(f"{where}: unsupported fields {sorted(d)}")
+
+
+def _task(name: str, d: Dict[str, Any]) -> Task:
+    res = parse_resource(d.pop('Resource'), name)
+    task = Task.__new__(_TASK_CLASSES.get(res.resource_type, Task))
+    Task.__init__(task, name, resource=res, timeout_seconds=None)
+    return task
+
+
+def _choice(name: str, d: Dict[str, Any]) -> Choice:
+    state = Choice.__new__(Choice)
+    State.__init__(state, name=name, type=StateType.CHOICE)
+    state.Choices = [_choice_case(c, name) for c in d.pop('Choices', [])]
+    state.Default = None
+    return state
+
+
+def _fields(state: State, d: Dict[str, Any]) -> None:
+    """
+    Sets the fields the state's class renders from the definition, leaving those it does not in d
+    """
+    for f in type(state)._json_fields:
+        if f in _BUILT_FIELDS or f not in d:
+            continue
+        value = d.pop(f)
+        if f == 'Retry':
+            value = [_retrier(r) for r in value]
+        elif f == 'Catch':
+            value = [_catcher(c) for c in value]
+        setattr(state, f, value)
+
+
+def _state(name: str, d: Dict[str, Any]) -> State:
+    t = d.pop('Type', None)
+    state: State
+    if t == 'Task':
+        state = _task(name, d)
+    elif t == 'Pass':
+        state = Pass(name)
+    elif t == 'Wait':
+        state = Wait(name, seconds=None)  # type: ignore
+    elif t == 'Choice':
+        state = _choice(name, d)
+    elif t == 'Parallel':
+        state = Parallel(name, branches=[from_dict(b, branch=True) for b in d.pop('Branches', [])])
+    elif t == 'Map':
+        state = Map(name, iterator=from_dict(d.pop('Iterator', {}), branch=True))  # type: ignore
+    elif t == 'Succeed':
+        state = Succeed(name)
+    elif t == 'Fail':
+        state = Fail(name, cause=None, error=None)  # type: ignore
+    else:
+        raise LoadError(f"State '{name}': unsupported type {t!r}")
+    _fields(state, d)
+    if 'Next' in d:
+        state.set_next(d.pop('Next'))
+        if not state._builds_next:
+            # Parallel states never render the Next set through set_next, keep the loaded one
+            state.Next = state.get_next()
+    if d:
+        raise LoadError(f"State '{name}': unsupported fields {sorted(d)}")
+    return state
+
+
+def _order(start: Optional[str], states: Dict[str, Dict[str, Any]]) -> List[str]:
+    """
+    Orders state names so that the machine's build reproduces the definition: the start state first,
+    and last a state which already ends the machine, since build marks the last state as the end.
+    Raises LoadError if there is no such state, rather than letting build add an End the definition does not have.
+    """
+    names = list(states)
+    last = None
+    for n in names:
+        if n != start and _ends(states[n]):
+            last = n
+    order = [start] if start in states else []
+    order += [n for n in names if n != start and n != last]
+    if last is not None:
+        order.append(last)
+    if order and not _ends(states[order[-1]]):
+        raise LoadError(f"No state other than the start state ends the machine, "
+                        f"loading it would make '{order[-1]}' the end")
+    return order
+
+
+def _ends(d: Dict[str, Any]) -> bool:
+    return d.get('End') is True or d.get('Type') in ('Succeed', 'Fail')
+
+
+def _resolve(machine: StateMachine) -> None:
+    """
+    Points Catchers at the loaded states they name, targets missing from the machine stay references
+    """
+    states = machine.get_states()
+    for s in states:
+        for c in getattr(s, 'Catch', None) or getattr(s, '_catch', None) or []:
+            i = machine.idx(c._next.name())
+            if i is not None:
+                c._next = states[i]
+
+
+def _region_account(states: Dict[str, Dict[str, Any]]) -> Tuple[str, str]:
+    for d in states.values():
+        arn = d.get('Resource')
+        if isinstance(arn, str) and arn.count(':') >= 5:
+            parts = arn.split(':')
+            return parts[3], parts[4]
+    return '', ''
+
+
+def from_dict(d: Dict[str, Any], branch: bool = False) -> StateMachine:
+    """
+    Converts a parsed definition into a StateMachine, or a Branch for the branches of Parallel and Map states.
+    The dict is consumed as it is converted so that only one copy of each state is alive at a time.
+    """
+    states = d.pop('States', {})
+    start = d.pop('StartAt', None)
+    region, account = _region_account(states)
+    machine = Branch(region, account) if branch else StateMachine(region, account)
+    if 'TimeoutSeconds' in d or not branch:
+        machine.TimeoutSeconds = d.pop('TimeoutSeconds', None)
+    for f in ('Comment', 'Version'):
+        if f in d:
+            setattr(machine, f, d.pop(f))
+    _check_empty(d, 'Branch' if branch else 'StateMachine')
+
+    for name in _order(start, states):
+        state = _state(name, states.pop(name))
+        res = state.Resource if isinstance(state, Task) else None
+        machine.add_state(state)
+        if res is not None and state.Resource is not res:
+            # add_state gives resources the machine's region and account, keep the ones in the ARN
+            state.Resource = res
+    _resolve(machine)
+    return machine
+
+
+def loads(text: Union[str, bytes]) -> StateMachine:
+    """
+    Loads a machine from a JSON definition
+    """
+    return from_dict(json.loads(text))
+
+
+def load(fp: IO) -> StateMachine:
+    """
+    Loads a machine from a file object. The text is released once parsed, before the states are converted.
+    """
+    return from_dict(json.loads(fp.read()))
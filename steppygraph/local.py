@@ -0,0 +1,448 @@
+"""
+Runs built state machines in process, for testing workflows without deploying them.
+"""
+import asyncio
+import inspect
+import time
+from concurrent.futures import Executor
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from steppygraph.machine import StateMachine, Parallel, Map, nested_machines
+from steppygraph.paths import PathMatchError, compile_path, effective_input, effective_output, with_result, \
+    resolve_parameters
+from steppygraph.serialize import encode
+from steppygraph.states import State, Task, Pass, Wait, Choice, ChoiceCase, Succeed, Fail, ErrorType, \
+    ComparisonType, Retrier
+
+Handler = Callable[[Any], Any]
+
+DEFAULT_MAX_TRANSITIONS = 25000
+
+_MISSING = object()
+
+
+class ExecutionFailed(Exception):
+    """
+    Raised when an execution ends in a Fail state or with an error no Catcher handled
+    """
+
+    def __init__(self, error: str, cause: str = '') -> None:
+        Exception.__init__(self, f"{error}: {cause}" if cause else error)
+        self.error = error
+        self.cause = cause
+
+
+class TaskError(Exception):
+    """
+    Raise from a handler to fail the task with a specific error name, as matched by ErrorEquals.
+    Any other exception fails the task with its class name as the error.
+    """
+
+    def __init__(self, error: str, cause: str = '') -> None:
+        Exception.__init__(self, f"{error}: {cause}" if cause else error)
+        self.error = error
+        self.cause = cause
+
+
+class RealClock:
+    """
+    Sleeps for real. Parallel branches share the one clock.
+    """
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    def time(self) -> float:
+        """
+        Seconds since the epoch, what Wait states compare timestamps with
+        """
+        return time.time()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    def fork(self) -> 'RealClock':
+        return self
+
+    def join(self, children: List['RealClock']) -> None:
+        pass
+
+
+class VirtualClock:
+    """
+    Advances time instantly instead of sleeping, so Wait states and retry intervals cost nothing.
+    Each Parallel branch runs on a fork of the clock and the parent resumes at the latest branch's time.
+    Its time counts seconds since the epoch for Wait states with a timestamp, start the clock at a date to
+    run them.
+    """
+
+    def __init__(self, start: float = 0.0) -> None:
+        self._now = start
+
+    def now(self) -> float:
+        return self._now
+
+    def time(self) -> float:
+        return self._now
+
+    async def sleep(self, seconds: float) -> None:
+        self._now += max(0, seconds)
+
+    def fork(self) -> 'VirtualClock':
+        return VirtualClock(self._now)
+
+    def join(self, children: List['VirtualClock']) -> None:
+        self._now = max([self._now] + [c.now() for c in children])
+
+
+Clock = Union[RealClock, VirtualClock]
+
+
+class Execution:
+    """
+    The outcome of a successful run
+    """
+
+    def __init__(self, output: Any, history: List[str], started: float, stopped: float) -> None:
+        self.output = output
+        self.history = history
+        self.elapsed = stopped - started
+
+    def transitions(self) -> int:
+        return len(self.history)
+
+
+def _error_of(e: BaseException) -> TaskError:
+    if isinstance(e, (TaskError, ExecutionFailed)):
+        return TaskError(e.error, e.cause)
+    if isinstance(e, asyncio.TimeoutError):
+        return TaskError(ErrorType.TIMEOUT.value, 'task timed out')
+    return TaskError(type(e).__name__, str(e))
+
+
+def error_matches(error: str, error_equals: List[Any]) -> bool:
+    """
+    True if an error name is covered by an ErrorEquals list.
+    States.ALL matches everything and States.TaskFailed everything but States.Timeout.
+    """
+    for e in error_equals:
+        name = str(e)
+        if name == ErrorType.ALL.value or name == error:
+            return True
+        if name == ErrorType.TASK_FAILED.value and error != ErrorType.TIMEOUT.value:
+            return True
+    return False
+
+
+def parse_timestamp(v: Any) -> Optional[datetime]:
+    """
+    Parses an ISO 8601 timestamp, treating ones without an offset as UTC. None if v is not a timestamp.
+    """
+    if not isinstance(v, str):
+        return None
+    try:
+        ts = datetime.fromisoformat(v.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo is not None else ts.replace(tzinfo=timezone.utc)
+
+
+def _compare(kind: str, op: str, value: Any, expected: Any) -> bool:
+    if kind == 'Boolean':
+        return isinstance(value, bool) and value == expected
+    if kind == 'Numeric':
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+    elif kind == 'String':
+        if not isinstance(value, str):
+            return False
+    else:
+        value, expected = parse_timestamp(value), parse_timestamp(expected)
+        if value is None or expected is None:
+            return False
+    if op == 'Equals':
+        return value == expected
+    if op == 'LessThan':
+        return value < expected
+    if op == 'GreaterThan':
+        return value > expected
+    if op == 'LessThanEquals':
+        return value <= expected
+    return value >= expected
+
+
+def _split(comparison_type: str) -> Tuple[str, str]:
+    for kind in ('Boolean', 'Numeric', 'String', 'Timestamp'):
+        if comparison_type.startswith(kind):
+            return kind, comparison_type[len(kind):]
+    raise ValueError(f"Unknown comparison {comparison_type}")
+
+
+# comparison type to (kind, operator), e.g. NumericLessThan to ('Numeric', 'LessThan')
+COMPARISONS = {ct.value: _split(ct.value) for ct in ComparisonType}
+
+
+def case_matches(case: ChoiceCase, doc: Any) -> bool:
+    """
+    True if the input document satisfies a choice rule. A missing variable never matches.
+    """
+    value = compile_path(case.Variable).find(doc, _MISSING)
+    if value is _MISSING:
+        return False
+    kind, op = COMPARISONS[case._comparison.type()]
+    return _compare(kind, op, value, case._comparison.value())
+
+
+def _wait_seconds(state: Wait, doc: Any, clock: Clock) -> float:
+    """
+    Returns how long a Wait state waits, from Seconds, SecondsPath in the effective input, or until the time
+    Timestamp or TimestampPath gives by the clock
+    """
+    if state.Seconds is not None:
+        return state.Seconds
+    if state.SecondsPath is not None:
+        seconds = compile_path(state.SecondsPath).get(doc)
+        if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or seconds < 0:
+            raise ExecutionFailed('States.Runtime', f"State '{state.name()}': SecondsPath selected {seconds!r}, "
+                                                    f"not a number of seconds")
+        return seconds
+    if state.Timestamp is not None or state.TimestampPath is not None:
+        value = state.Timestamp if state.Timestamp is not None else compile_path(state.TimestampPath).get(doc)
+        ts = parse_timestamp(value)
+        if ts is None:
+            raise ExecutionFailed('States.Runtime', f"State '{state.name()}': {value!r} is not a timestamp")
+        return max(0.0, ts.timestamp() - clock.time())
+    raise ExecutionFailed('States.Runtime', f"State '{state.name()}' has no Seconds, SecondsPath, Timestamp or "
+                                            f"TimestampPath")
+
+
+def choose(state: Choice, doc: Any) -> str:
+    """
+    Returns the name of the state a Choice routes the input document to
+    """
+    for case in state.Choices:
+        if case_matches(case, doc):
+            return case.Next
+    return state.Default
+
+
+class LocalRunner:
+    """
+    Interprets a StateMachine on asyncio. Task resources are looked up in handlers by resource name
+    or ARN and may be plain or async callables taking the task input and returning its result.
+
+    :param machine: the machine to run, it is built if needed
+    :param handlers: resource name or ARN to callable
+    :param clock: VirtualClock to skip real waiting, defaults to the real clock. Each run gets its own fork of it.
+    :param executor: if given, plain callables are run in it instead of on the event loop
+    :param max_transitions: guards against executions which never terminate
+    """
+
+    def __init__(self,
+                 machine: StateMachine,
+                 handlers: Dict[str, Handler],
+                 clock: Clock = None,
+                 executor: Optional[Executor] = None,
+                 max_transitions: int = DEFAULT_MAX_TRANSITIONS) -> None:
+        self._machine = machine.build()
+        self._handlers = handlers
+        self._clock = clock or RealClock()
+        self._executor = executor
+        self._max_transitions = max_transitions
+        self._check_handlers(self._machine)
+
+    def _check_handlers(self, machine: StateMachine) -> None:
+        for s in machine.get_states():
+            if isinstance(s, Task):
+                self.handler(s)
+            else:
+                for b in nested_machines(s):
+                    self._check_handlers(b)
+
+    def handler(self, task: Task) -> Handler:
+        res = task.Resource
+        fn = self._handlers.get(res.name) or self._handlers.get(str(res))
+        if fn is None:
+            raise ValueError(f"No handler for resource '{res.name}' of task '{task.name()}'")
+        return fn
+
+    async def run(self, input: Any = None) -> Execution:
+        """
+        Runs one execution, raising ExecutionFailed if it fails
+        """
+        history: List[str] = []
+        clock = self._clock.fork()
+        started = clock.now()
+        output = await self._run_machine(self._machine, {} if input is None else input, clock, history)
+        return Execution(output, history, started, clock.now())
+
+    def run_sync(self, input: Any = None) -> Execution:
+        return asyncio.run(self.run(input))
+
+    async def _run_machine(self, machine: StateMachine, doc: Any, clock: Clock, history: List[str]) -> Any:
+        name = machine.StartAt
+        while name is not None:
+            if len(history) >= self._max_transitions:
+                raise ExecutionFailed('States.Runtime', f"exceeded {self._max_transitions} transitions")
+            state = machine.States.get(name)
+            if state is None:
+                raise ExecutionFailed('States.Runtime', f"no state named '{name}'")
+            history.append(name)
+            try:
+                doc, name = await self._run_state(state, doc, clock, history)
+            except TaskError as e:
+                name, doc = self._catch(state, e)
+        return doc
+
+    def _catch(self, state: State, e: TaskError):
+        for catcher in getattr(state, 'Catch', None) or []:
+            if error_matches(e.error, catcher.ErrorEquals):
+                return catcher._next.name(), {'Error': e.error, 'Cause': e.cause}
+        raise ExecutionFailed(e.error, e.cause)
+
+    @staticmethod
+    def _next(state: State) -> Optional[str]:
+        return None if state.End else state.get_next()
+
+    async def _run_state(self, state: State, doc: Any, clock: Clock, history: List[str]):
+        try:
+            return await self._step(state, doc, clock, history)
+        except PathMatchError as e:
+            raise ExecutionFailed('States.Runtime', f"State '{state.name()}': {e}")
+
+    async def _step(self, state: State, doc: Any, clock: Clock, history: List[str]):
+        if isinstance(state, Map):
+            result = await self._run_map(state, doc, clock, history)
+            return effective_output(state, self._with_result(state, doc, result)), self._next(state)
+
+        params = getattr(state, 'Parameters', None)
+        effective = effective_input(state, doc, None if params is None else encode(params))
+
+        if isinstance(state, Task):
+            result = await self._run_task(state, effective, clock)
+            return effective_output(state, self._with_result(state, doc, result)), self._next(state)
+
+        if isinstance(state, Pass):
+            result = effective if state.Result is None else state.Result
+            return effective_output(state, self._with_result(state, doc, result)), self._next(state)
+
+        if isinstance(state, Wait):
+            await clock.sleep(_wait_seconds(state, effective, clock))
+            return effective_output(state, effective), self._next(state)
+
+        if isinstance(state, Choice):
+            return effective_output(state, effective), choose(state, effective)
+
+        if isinstance(state, Parallel):
+            result = await self._retrying(state, lambda: self._run_parallel(state, effective, clock, history), clock)
+            return effective_output(state, self._with_result(state, doc, result)), self._next(state)
+
+        if isinstance(state, Succeed):
+            return effective_output(state, effective), None
+
+        if isinstance(state, Fail):
+            raise ExecutionFailed(state.Error, state.Cause)
+
+        raise ExecutionFailed('States.Runtime', f"cannot run state of type {state.Type}")
+
+    @staticmethod
+    def _with_result(state: State, doc: Any, result: Any) -> Any:
+        try:
+            return with_result(state, doc, result)
+        except PathMatchError as e:
+            raise TaskError('States.ResultPathMatchFailure', str(e))
+
+    async def _run_parallel(self, state: Parallel, doc: Any, clock: Clock, history: List[str]) -> List[Any]:
+        clocks = [clock.fork() for _ in state.Branches]
+        histories: List[List[str]] = [[] for _ in state.Branches]
+        runs = [asyncio.ensure_future(self._run_machine(b, doc, c, h))
+                for b, c, h in zip(state.Branches, clocks, histories)]
+        try:
+            results = await asyncio.gather(*runs)
+        except ExecutionFailed as e:
+            for r in runs:
+                r.cancel()
+            raise TaskError(e.error, e.cause)
+        finally:
+            clock.join(clocks)
+            for h in histories:
+                history.extend(h)
+        return list(results)
+
+    async def _run_map(self, state: Map, doc: Any, clock: Clock, history: List[str]) -> List[Any]:
+        """
+        Runs the iterator over the items on a pool of MaxConcurrency workers, each on its own fork of the clock
+        """
+        effective = effective_input(state, doc)
+        items = effective if state.ItemsPath is None else compile_path(state.ItemsPath).get(effective)
+        if not isinstance(items, list):
+            raise ExecutionFailed('States.Runtime', f"State '{state.name()}': ItemsPath did not select an array")
+        params = None if state.Parameters is None else encode(state.Parameters)
+
+        async def attempt() -> List[Any]:
+            results: List[Any] = [None] * len(items)
+            todo = iter(range(len(items)))
+
+            async def work(c: Clock, h: List[str]) -> None:
+                for i in todo:
+                    value = items[i]
+                    if params is not None:
+                        value = resolve_parameters(params, effective, {'Map': {'Item': {'Index': i, 'Value': value}}})
+                    results[i] = await self._run_machine(state.Iterator, value, c, h)
+
+            workers = min(len(items), state.MaxConcurrency or len(items))
+            clocks = [clock.fork() for _ in range(workers)]
+            histories: List[List[str]] = [[] for _ in range(workers)]
+            runs = [asyncio.ensure_future(work(c, h)) for c, h in zip(clocks, histories)]
+            try:
+                await asyncio.gather(*runs)
+            except ExecutionFailed as e:
+                for r in runs:
+                    r.cancel()
+                raise TaskError(e.error, e.cause)
+            finally:
+                clock.join(clocks)
+                for h in histories:
+                    history.extend(h)
+            return results
+        return await self._retrying(state, attempt, clock)
+
+    async def _run_task(self, task: Task, doc: Any, clock: Clock) -> Any:
+        fn = self.handler(task)
+        return await self._retrying(task, lambda: self._invoke(fn, doc, task.TimeoutSeconds), clock)
+
+    async def _retrying(self, state: State, attempt: Callable[[], Awaitable[Any]], clock: Clock) -> Any:
+        """
+        Calls attempt until it succeeds or fails with an error the state's Retriers give up on
+        """
+        attempts: Dict[int, int] = {}
+        while True:
+            try:
+                return await attempt()
+            except Exception as e:
+                error = _error_of(e)
+            retrier = self._retrier(getattr(state, 'Retry', None) or [], error.error)
+            if retrier is None:
+                raise error
+            n = attempts.get(id(retrier), 0)
+            if n >= retrier.MaxAttempts:
+                raise error
+            attempts[id(retrier)] = n + 1
+            await clock.sleep(retrier.IntervalSeconds * retrier.BackoffRate ** n)
+
+    @staticmethod
+    def _retrier(retry: List[Retrier], error: str) -> Optional[Retrier]:
+        for r in retry:
+            if error_matches(error, r.ErrorEquals):
+                return r
+        return None
+
+    async def _invoke(self, fn: Handler, doc: Any, timeout: Optional[float]) -> Any:
+        if inspect.iscoroutinefunction(fn):
+            call = fn(doc)
+        elif self._executor is not None:
+            call = asyncio.get_running_loop().run_in_executor(self._executor, fn, doc)
+        else:
+            return fn(doc)
+        return await asyncio.wait_for(call, timeout) if timeout else await call
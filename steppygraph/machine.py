@@ -1,48 +1,150 @@
 import json
-from typing import List, Dict, TypeVar, Any, Optional, Tuple
+from typing import List, Dict, TypeVar, Any, Optional, Tuple, IO, Iterator, Union
 
-from steppygraph.states import State, JSON_INDENT, Task, ResourceType, Resource, Wait, Pass, StateType, Catcher
-from steppygraph.utils import filter_props
-from steppygraph.serialize import to_serializable
+from steppygraph.states import State, STATE_FIELDS, OptionalField, JSON_INDENT, Task, ResourceType, Resource, Wait, Pass, StateType, Catcher, \
+    Retrier, WorkflowType, EXPRESS_MAX_DURATION, DEFAULT_TASK_TIMEOUT, state_vars
+from steppygraph.paths import check_state
+from steppygraph.serialize import to_serializable, iter_json, dump, dumps, props, Profile, PRETTY, Separators, \
+    get_profile
 
 TERMINAL_STATES = (StateType.FAIL, StateType.SUCCEED)
+# the TimeoutSeconds machines and tasks get by default in each workflow type
+DEFAULT_TIMEOUTS = {WorkflowType.STANDARD: DEFAULT_TASK_TIMEOUT, WorkflowType.EXPRESS: EXPRESS_MAX_DURATION}
 
 
 class DuplicateStateError(Exception):
     pass
 
 
+def is_orphan(s: State) -> bool:
+    """
+    True if the state is autoconnected, not terminal and has no Next set, i.e. it is waiting to be wired up by next().
+    """
+    return s._autoconnect is True and s.Type not in TERMINAL_STATES and s._next is None
+
+
 class StateMachine:
+    _json_fields = ('TimeoutSeconds', 'States', 'StartAt', 'End', 'Comment', 'Version')
+    _json_stream = True
+    # set to True, on a machine or on the class, to raise ValidationError from build() on graph errors
+    validate_on_build = False
+    # a size in bytes, add_state and build raise DefinitionSizeError once the compact JSON would be larger
+    size_budget: Optional[int] = None
+
     def __init__(self,
                  region: str = '',
                  account: str = '',
-                 name='') -> None:
-        self.TimeoutSeconds = 600
+                 name='',
+                 workflow_type: WorkflowType = WorkflowType.STANDARD) -> None:
+        self.TimeoutSeconds = DEFAULT_TIMEOUTS[workflow_type]
         self.States: Dict[str, State] = {}
         self.StartAt: Optional[str] = None
         self._states: List[State] = []
+        self._index: Dict[str, int] = {}
+        self._orphans: List[int] = []
+        self._built = 0
+        self._changed: Dict[int, State] = {}
+        self._nested: List[State] = []
+        # digest of the states, see hashing.machine_digest, and the Parallel states holding this machine
+        self._digest: Optional[bytes] = None
+        self._parents: Tuple[State, ...] = ()
+        # serialized size of each state counted in _size_total and the states changed since, see steppygraph.size
+        self._sizes: Optional[Dict[int, int]] = None
+        self._size_total = 0
+        self._stale_sizes: Dict[int, State] = {}
+        self._validated = False
         self._region = region
         self._account = account
         self._name = name
+        self._workflow_type = workflow_type
         self.End: Optional[bool] = None
 
-    def to_json(self) -> str:
-        return json.dumps(self,
-                          sort_keys=True,
-                          indent=JSON_INDENT,
-                          default=to_serializable)  # type: ignore
+    @property
+    def workflow_type(self) -> WorkflowType:
+        """
+        STANDARD or EXPRESS. It is not part of the definition but picks the ARNs of service integrations, and
+        in Express mode build() rejects what Express workflows cannot run, see steppygraph.validate.
+        Setting it applies to the states already added and to their branches. The machine, if its TimeoutSeconds
+        is still the previous type's default, and tasks created without a timeout get the new type's default,
+        see DEFAULT_TIMEOUTS.
+        """
+        return self._workflow_type
+
+    @workflow_type.setter
+    def workflow_type(self, value: WorkflowType) -> None:
+        if value == self._workflow_type:
+            return
+        if getattr(self, 'TimeoutSeconds', None) == DEFAULT_TIMEOUTS[self._workflow_type]:
+            self.TimeoutSeconds = DEFAULT_TIMEOUTS[value]
+        self._workflow_type = value
+        self._validated = False
+        for s in self._states:
+            self.set_resource_attrs(s)
+
+    @classmethod
+    def from_json(cls, text: Union[str, bytes]) -> 'StateMachine':
+        """
+        Loads a machine from an Amazon States Language definition, see steppygraph.loader
+        """
+        from steppygraph.loader import loads
+        return loads(text)
+
+    @classmethod
+    def load(cls, fp: IO) -> 'StateMachine':
+        from steppygraph.loader import load
+        return load(fp)
+
+    def to_json(self, profile: Union[str, Profile] = PRETTY) -> str:
+        """
+        Renders the machine, indented by default. profile is 'pretty', 'compact', 'canonical' or a Profile,
+        see steppygraph.serialize.PROFILES
+        """
+        return dumps(self, **get_profile(profile).options())
+
+    def iter_json(self, sort_keys: bool = True, indent: Optional[Union[int, str]] = JSON_INDENT,
+                  separators: Separators = None) -> Iterator[str]:
+        """
+        Yields the JSON document in chunks, see to_json
+        """
+        return iter_json(self, sort_keys=sort_keys, indent=indent, separators=separators)
+
+    def dump(self, fp: IO[str], sort_keys: bool = True, indent: Optional[Union[int, str]] = JSON_INDENT,
+             separators: Separators = None) -> None:
+        """
+        Writes the JSON document to a file object without building it in memory first
+        """
+        dump(self, fp, sort_keys=sort_keys, indent=indent, separators=separators)
 
     def idx(self, name: str) -> Optional[int]:
         """
-        Returns index of the first state in the graph with a matching name
+        Returns index of the state in the graph with a matching name
         :param name:
         :return: index
         """
-        for i in range(0, len(self._states)):
-            s = self._states[i]
-            if name == s.name():
-                return i
-        return None
+        return self._index.get(name)
+
+    def reindex(self) -> None:
+        """
+        Rebuilds the name to index lookup and the orphan stack from the list of states.
+        Must be called after states are removed, reordered or renamed.
+        """
+        index: Dict[str, int] = {}
+        for i, s in enumerate(self._states):
+            if s.name() in index:
+                raise DuplicateStateError(self._duplicate_message(s.name()))
+            index[s.name()] = i
+        self._index = index
+        self._orphans = [i for i, s in enumerate(self._states) if is_orphan(s)]
+        self._nested = [s for s in self._states if s._nested]
+        self._built = 0
+        self.States = {}
+        self._digest = None
+        self._sizes = None
+        for p in self._parents:
+            p.mark_dirty()
+
+    def _duplicate_message(self, name: str) -> str:
+        return f"Duplicate State: Name '{name}' already used in graph. {[ss.name() for ss in self._states]}"
 
     def last_orphan(self) -> Optional[int]:
         """
@@ -50,11 +152,13 @@ class StateMachine:
         :param name:
         :return: index
         """
-        # traverse the list backwards
-        for index in range(len(self._states) - 1, -1, -1):
-            s = self._states[index]
-            if s._autoconnect is True and s.Type not in TERMINAL_STATES and s._next is None:
+        # states stop being orphans once their Next is set, so stale entries are dropped lazily from the top
+        orphans = self._orphans
+        while orphans:
+            index = orphans[-1]
+            if is_orphan(self._states[index]):
                 return index
+            orphans.pop()
         return None
 
     def next(self, state: State) -> object:
@@ -62,58 +166,151 @@ class StateMachine:
         This method adds a State to the task graph via add_state but it also
         sets the Next property of the previously added state to point to it for convenience.
         """
+        autoconnect = state._autoconnect
         state._autoconnect = True
 
+        wired = None
         if len(self._states) > 0:
             orphan_idx = self.last_orphan()
             if orphan_idx is not None:
                 s = self._states[orphan_idx]
                 if s._autoconnect:
                     s.set_next(state.name())
-
-        return self.add_state(state)
+                    wired = s
+
+        try:
+            return self.add_state(state)
+        except Exception:
+            # a rejected state leaves the machine as it was, the orphan can still be wired to another one
+            state._autoconnect = autoconnect
+            if wired is not None:
+                wired._next = None
+                wired.mark_dirty()
+            raise
 
     def add_state(self, state: State) -> object:
         """
         This method appends a State to the task graph but does NOT affect the Next property.
         Useful when adding states which are out of sequence.
         """
-        for s in self._states:
-            if s.name() == state.name():
-                err_message = f"Duplicate State: Name '{s.name()}' already used in graph. {[ss.name() for ss in self._states]}"
-                raise DuplicateStateError(err_message)
+        name = state.name()
+        if name in self._index:
+            raise DuplicateStateError(self._duplicate_message(name))
 
         self.set_resource_attrs(state)
+        if self.size_budget is not None:
+            from steppygraph.size import check_budget
+            check_budget(self, self.size_budget, adding=state)
+        self._index[name] = len(self._states)
+        if is_orphan(state):
+            self._orphans.append(len(self._states))
+        if state._nested:
+            self._nested.append(state)
+        state.add_owner(self)
         self._states.append(state)
+        self.state_touched(state)
         return self
 
+    def state_changed(self, state: State) -> None:
+        """
+        Called by a state of this machine when it becomes dirty, so that the next build rebuilds it
+        """
+        self._changed[id(state)] = state
+
+    def state_touched(self, state: State) -> None:
+        """
+        Called by a state of this machine whenever it changes, and when it is added. Drops the cached digest,
+        queues the state for size accounting and passes the change on to the Parallel states holding this machine.
+        """
+        if self._sizes is not None:
+            self._stale_sizes[id(state)] = state
+        elif self._digest is None:
+            return
+        self._digest = None
+        for p in self._parents:
+            p.mark_dirty()
+
+    def add_parent(self, parent: State) -> None:
+        if parent not in self._parents:
+            self._parents = self._parents + (parent,)
+
     def set_resource_attrs(self, state):
         """
-        If the State is a Task and has a resource set, set the metadata to auto-fill aws ac and region
+        If the State is a Task and has a resource set, set the metadata to auto-fill aws ac and region, and the
+        integration pattern of the workflow type. Resources may be shared between states and machines, so one
+        with a different region, account or pattern is replaced by a copy rather than changed.
+        Tasks created without a timeout get the workflow type's default, see DEFAULT_TIMEOUTS, and the branches of
+        the state are given the machine's workflow type.
         :param state:
         :return:
         """
         if isinstance(state, Task):
-            if state.Resource:
-                state.Resource.aws_ac = self._account
-                state.Resource.region = self._region
+            timeout = DEFAULT_TIMEOUTS[self._workflow_type]
+            if getattr(state, '_timeout_defaulted', False) and state.TimeoutSeconds != timeout:
+                state.TimeoutSeconds = timeout
+                state._timeout_defaulted = True
+            res = state.Resource
+            sync = self._workflow_type == WorkflowType.STANDARD
+            if res and (res.aws_ac != self._account or res.region != self._region or res.sync != sync):
+                state.Resource = Resource(res.name, type=res.resource_type, region=self._region, aws_ac=self._account,
+                                          sync=sync)
+        elif state._nested:
+            branches = nested_machines(state)
+            # the branches of a FanOut state are stamped out of its prototype
+            prototype = getattr(branches, 'prototype', None)
+            for b in branches if prototype is None else [prototype]:
+                b.workflow_type = self._workflow_type
 
     def build(self) -> Any:
-        d = {}
-        states_len = len(self._states)
-        for i in range(0, states_len):
-            s = self._states[i]
-
-            if i == 0:
-                self.StartAt = s.name()
-
-            if i == states_len - 1:
-                if s.Type not in [ts.value for ts in TERMINAL_STATES]:
-                    s.End = True
+        """
+        Builds the States dict. Only states added or changed since the previous build are rebuilt,
+        states with nested machines always rebuild their branches.
+        Raises InvalidPathError if a rebuilt state has a malformed path, and ValidationError for graph errors
+        when validate_on_build is set or for what Express workflows do not support in Express mode.
+        """
+        states = self._states
+        if states:
+            self.StartAt = states[0].name()
+            last = states[-1]
+            if last.Type not in [ts.value for ts in TERMINAL_STATES] and last.End is not True:
+                last.End = True
+
+        changed = self._changed
+        self._changed = {}
+        if changed or self._built < len(states) or self._nested:
+            self._validated = False
+        for s in changed.values():
+            check_state(s)
+            s.build()
+        for s in self._nested:
+            s.build()
+
+        d = self.States
+        for s in states[self._built:]:
+            check_state(s)
             d[s.name()] = s.build()
-        self.States = d
+        self._built = len(states)
+        if self.size_budget is not None:
+            from steppygraph.size import check_budget
+            check_budget(self, self.size_budget)
+        # branches are checked as part of the machine holding them
+        express = self._workflow_type == WorkflowType.EXPRESS and not self._parents
+        if (self.validate_on_build or express) and not self._validated:
+            from steppygraph.validate import check, check_express
+            if self.validate_on_build:
+                check(self)
+            if express:
+                check_express(self)
+            self._validated = True
         return self
 
+    def size(self) -> int:
+        """
+        Returns the size in bytes of the machine's compact JSON, see steppygraph.size
+        """
+        from steppygraph.size import machine_size
+        return machine_size(self)
+
     def get_states(self) -> List[State]:
         return self._states
 
@@ -121,7 +318,7 @@ class StateMachine:
         return len(self._states)
 
     def printable(self) -> str:
-        return ' '.join([str(s.__dict__) for k, s in self.build().States.items()])
+        return ' '.join([str(state_vars(s)) for k, s in self.build().States.items()])
 
     def last(self) -> State:
         return self._states[-1]
@@ -132,9 +329,7 @@ class StateMachine:
 
 @to_serializable.register(StateMachine)
 def machine_to_json(obj) -> Dict[str, Any]:
-    for k, s in obj.States.items():
-        obj.States[k] = s
-    return filter_props(obj.__dict__)
+    return props(obj)
 
 
 class Branch(StateMachine):
@@ -147,6 +342,17 @@ class Branch(StateMachine):
 
 
 class Parallel(State):
+    __slots__ = ('Branches', '_catch')
+    _json_fields = STATE_FIELDS + ('Branches', 'Parameters', 'ResultPath', 'Retry', 'Catch', 'Next')
+    _json_stream = True
+    _nested = True
+    _builds_next = False
+
+    Parameters = OptionalField()
+    ResultPath = OptionalField()
+    Retry = OptionalField()
+    Catch = OptionalField()
+
     def __init__(self,
                  name: str,
                  branches: List[Branch],
@@ -157,14 +363,95 @@ class Parallel(State):
         self._catch = catch
         self.Branches = branches
 
+    def __copy__(self) -> 'Parallel':
+        other = State.__copy__(self)
+        for b in other.Branches:
+            b.add_parent(other)
+        return other
+
+    def __setattr__(self, key: str, value: Any) -> None:
+        State.__setattr__(self, key, value)
+        if key == 'Branches':
+            for b in value:
+                b.add_parent(self)
+
     def build(self) -> object:
-        if self._catch:
-            self.Catch = self._catch
+        if self._dirty:
+            if self._catch:
+                self.Catch = self._catch
+            self._dirty = False
 
         for b in self.Branches:
             b.build()
         return self
 
+
+class Map(State):
+    """
+    Runs iterator once for each item of the array ItemsPath selects from the input, at most max_concurrency at
+    a time, 0 meaning no limit. Parameters, if given, is the input of each iteration and can refer to the item
+    and its index through $$.Map.Item.Value and $$.Map.Item.Index. The result is the array of the iterations'
+    outputs.
+    """
+    __slots__ = ('Iterator',)
+    _json_fields = STATE_FIELDS + ('ItemsPath', 'MaxConcurrency', 'Parameters', 'Iterator', 'ResultPath', 'Retry',
+                                   'Catch', 'Next')
+    _json_stream = True
+    _nested = True
+
+    ItemsPath = OptionalField()
+    MaxConcurrency = OptionalField()
+    Parameters = OptionalField()
+    ResultPath = OptionalField()
+    Retry = OptionalField()
+    Catch = OptionalField()
+
+    def __init__(self,
+                 name: str,
+                 iterator: Branch,
+                 items_path: str = None,
+                 max_concurrency: int = None,
+                 parameters: Dict[str, Any] = None,
+                 result_path: str = None,
+                 comment: str = None,
+                 retry: List[Retrier] = None,
+                 catch: List[Catcher] = None
+                 ) -> None:
+        State.__init__(self, type=StateType.MAP, name=name, comment=comment)
+        if max_concurrency is not None and max_concurrency < 0:
+            raise ValueError("max_concurrency must be 0 or more")
+        self.Iterator = iterator
+        self.ItemsPath = items_path
+        self.MaxConcurrency = max_concurrency
+        self.Parameters = parameters
+        self.ResultPath = result_path
+        self.Retry = retry
+        self.Catch = catch
+
+    def __copy__(self) -> 'Map':
+        other = State.__copy__(self)
+        other.Iterator.add_parent(other)
+        return other  # type: ignore
+
+    def __setattr__(self, key: str, value: Any) -> None:
+        State.__setattr__(self, key, value)
+        if key == 'Iterator':
+            value.add_parent(self)
+
+    def build(self) -> object:
+        State.build(self)
+        self.Iterator.build()
+        return self
+
+
+def nested_machines(state: State) -> List[StateMachine]:
+    """
+    Returns the machines a state holds: the branches of a Parallel state, the iterator of a Map state
+    """
+    if isinstance(state, Map):
+        return [state.Iterator]
+    return getattr(state, 'Branches', None) or []
+
 # @to_serializable.register(Parallel)
 # def parallel_to_json(obj) -> str:
 #     for k, s in obj.States.items():
@@ -0,0 +1,285 @@
+"""
+Compiled JSONPath expressions, used to apply InputPath, Parameters, ResultPath and OutputPath to payloads
+the way Step Functions does and to reject bad paths when a machine is built.
+
+Supported syntax is $ (or $$ for the context object) followed by .name, ['name'], [index], .* and [*].
+Recursive descent, filters, slices and unions are rejected.
+"""
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple, Union
+
+PATH_CACHE_SIZE = 4096
+
+_WILDCARD = object()
+_MISSING = object()
+
+Step = Union[str, int, object]
+
+
+class InvalidPathError(ValueError):
+    pass
+
+
+class PathMatchError(LookupError):
+    """
+    Raised when a path does not match anything in the document it is applied to
+    """
+    pass
+
+
+class Path:
+    """
+    A parsed path. Instances are shared through the compile_path cache and are immutable.
+    """
+    __slots__ = ('text', 'steps', 'context', 'definite')
+
+    def __init__(self, text: str, steps: Tuple[Step, ...], context: bool) -> None:
+        self.text = text
+        self.steps = steps
+        self.context = context
+        self.definite = _WILDCARD not in steps
+
+    def __repr__(self) -> str:
+        return f"Path({self.text!r})"
+
+    def get(self, doc: Any, context: Any = None) -> Any:
+        """
+        Returns the value selected by the path, a list of values if it contains wildcards
+        """
+        value = self.find(doc, _MISSING, context)
+        if value is _MISSING:
+            raise PathMatchError(f"Path '{self.text}' matched nothing")
+        return value
+
+    def find(self, doc: Any, default: Any = None, context: Any = None) -> Any:
+        """
+        Like get but returns default when the path does not match
+        """
+        node = context if self.context else doc
+        if self.definite:
+            for step in self.steps:
+                if isinstance(node, str):
+                    return default
+                try:
+                    node = node[step]
+                except (KeyError, IndexError, TypeError):
+                    return default
+            return node
+        nodes = [node]
+        for step in self.steps:
+            matched = []
+            for n in nodes:
+                if step is _WILDCARD:
+                    if isinstance(n, dict):
+                        matched.extend(n.values())
+                    elif isinstance(n, list):
+                        matched.extend(n)
+                elif not isinstance(n, str):
+                    try:
+                        matched.append(n[step])
+                    except (KeyError, IndexError, TypeError):
+                        pass
+            nodes = matched
+        return nodes
+
+    def set(self, doc: Any, value: Any) -> Any:
+        """
+        Returns a copy of doc with value placed at the path, as ResultPath does.
+        Missing objects along the way are created, the input document itself is not modified.
+        """
+        if not self.definite or self.context:
+            raise InvalidPathError(f"'{self.text}' is not a reference path and cannot be written to")
+        if not self.steps:
+            return value
+        return self._set(doc, 0, value)
+
+    def _set(self, node: Any, i: int, value: Any) -> Any:
+        step = self.steps[i]
+        last = i == len(self.steps) - 1
+        if type(step) is int:
+            if not isinstance(node, list) or not -len(node) <= step < len(node):
+                raise PathMatchError(f"Path '{self.text}' has no index {step} to write to")
+            copy: Any = list(node)
+        elif node is None or node is _MISSING:
+            copy = {}
+        elif isinstance(node, dict):
+            copy = dict(node)
+        else:
+            raise PathMatchError(f"Path '{self.text}' cannot be written into a {type(node).__name__}")
+        if last:
+            copy[step] = value
+        else:
+            child = copy[step] if type(step) is int else copy.get(step, _MISSING)
+            copy[step] = self._set(child, i + 1, value)
+        return copy
+
+
+def _parse(text: str) -> Path:
+    if not isinstance(text, str):
+        raise InvalidPathError(f"Path must be a string, got {type(text).__name__}")
+    if text.startswith('$$'):
+        context, i = True, 2
+    elif text.startswith('$'):
+        context, i = False, 1
+    else:
+        raise InvalidPathError(f"Path '{text}' must start with '$'")
+    steps: List[Step] = []
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == '.':
+            if text.startswith('..', i):
+                raise InvalidPathError(f"Recursive descent is not supported in '{text}'")
+            j = i + 1
+            while j < n and text[j] not in '.[':
+                j += 1
+            name = text[i + 1:j]
+            if not name:
+                raise InvalidPathError(f"Empty field name at position {i} in '{text}'")
+            if any(ch in name for ch in ']\'"@?,:() '):
+                raise InvalidPathError(f"Invalid field name '{name}' in '{text}'")
+            steps.append(_WILDCARD if name == '*' else name)
+            i = j
+        elif c == '[':
+            q = i + 1
+            while q < n and text[q] == ' ':
+                q += 1
+            if q < n and text[q] in '\'"':
+                # a quoted name ends at the matching quote, whatever it contains
+                k = text.find(text[q], q + 1)
+                if k < 0:
+                    raise InvalidPathError(f"Unclosed quote at position {q} in '{text}'")
+                j = k + 1
+                while j < n and text[j] == ' ':
+                    j += 1
+                if j >= n or text[j] != ']':
+                    raise InvalidPathError(f"Expected ']' at position {j} in '{text}'")
+                steps.append(text[q + 1:k])
+                i = j + 1
+                continue
+            j = text.find(']', i)
+            if j < 0:
+                raise InvalidPathError(f"Unclosed '[' at position {i} in '{text}'")
+            inner = text[i + 1:j].strip()
+            if inner == '*':
+                steps.append(_WILDCARD)
+            else:
+                try:
+                    steps.append(int(inner))
+                except ValueError:
+                    raise InvalidPathError(f"Unsupported selector '[{inner}]' in '{text}'")
+            i = j + 1
+        else:
+            raise InvalidPathError(f"Unexpected '{c}' at position {i} in '{text}'")
+    return Path(text, tuple(steps), context)
+
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def compile_path(text: str) -> Path:
+    """
+    Parses a path once, later calls with the same text return the cached Path
+    """
+    return _parse(text)
+
+
+def reference_path(text: str) -> Path:
+    """
+    Compiles a path which must select a single node, as ResultPath and Choice variables require
+    """
+    p = compile_path(text)
+    if not p.definite:
+        raise InvalidPathError(f"'{text}' must be a reference path without wildcards")
+    return p
+
+
+def _is_intrinsic(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith('States.')
+
+
+def resolve_parameters(template: Any, doc: Any, context: Any = None) -> Any:
+    """
+    Builds the effective input from a Parameters template. Keys ending in '.$' are replaced
+    by the value their path selects from doc, or from the context object for '$$' paths.
+    """
+    if isinstance(template, dict):
+        out = {}
+        for k, v in template.items():
+            if isinstance(k, str) and k.endswith('.$') and isinstance(v, str) and not _is_intrinsic(v):
+                out[k[:-2]] = compile_path(v).get(doc, context)
+            else:
+                out[k] = resolve_parameters(v, doc, context)
+        return out
+    if isinstance(template, list):
+        return [resolve_parameters(v, doc, context) for v in template]
+    return template
+
+
+def check_parameters(template: Any) -> None:
+    if isinstance(template, dict):
+        for k, v in template.items():
+            if isinstance(k, str) and k.endswith('.$'):
+                if not isinstance(v, str):
+                    raise InvalidPathError(f"Value of '{k}' must be a path string")
+                if not _is_intrinsic(v):
+                    compile_path(v)
+            else:
+                check_parameters(v)
+    elif isinstance(template, list):
+        for v in template:
+            check_parameters(v)
+
+
+def check_state(state: Any) -> None:
+    """
+    Compiles every path a state declares, raising InvalidPathError naming the state and field of a bad one
+    """
+    field = None
+    try:
+        for field in ('InputPath', 'OutputPath'):
+            p = getattr(state, field, None)
+            if p is not None:
+                compile_path(p)
+        for field in ('ResultPath', 'ItemsPath'):
+            p = getattr(state, field, None)
+            if p is not None:
+                reference_path(p)
+        field = 'Parameters'
+        params = getattr(state, field, None)
+        if params is not None:
+            check_parameters(params)
+        field = 'Choices'
+        for case in getattr(state, field, None) or ():
+            reference_path(case.Variable)
+    except InvalidPathError as e:
+        raise InvalidPathError(f"State '{state.name()}' {field}: {e}")
+
+
+def _path(text: Optional[str]) -> Optional[Path]:
+    return None if text is None else compile_path(text)
+
+
+def effective_input(state: Any, doc: Any, parameters: Any = None, context: Any = None) -> Any:
+    """
+    Applies InputPath and then the Parameters template (as plain data) to a state's raw input
+    """
+    p = _path(getattr(state, 'InputPath', None))
+    value = doc if p is None else p.get(doc, context)
+    if parameters is not None:
+        value = resolve_parameters(parameters, value, context)
+    return value
+
+
+def with_result(state: Any, doc: Any, result: Any) -> Any:
+    """
+    Places a state's result into its raw input according to ResultPath, by default replacing it
+    """
+    p = _path(getattr(state, 'ResultPath', None))
+    return result if p is None else p.set(doc, result)
+
+
+def effective_output(state: Any, doc: Any, context: Any = None) -> Any:
+    """
+    Applies OutputPath to a state's output
+    """
+    p = _path(getattr(state, 'OutputPath', None))
+    return doc if p is None else p.get(doc, context)
@@ -0,0 +1,168 @@
+"""
+Evaluates the rules of Choice states over large batches of input documents with NumPy,
+for example to replay recorded payloads and see how traffic splits across branches.
+NumPy is an optional dependency, only needed by this module.
+"""
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from steppygraph.local import COMPARISONS, parse_timestamp, _compare
+from steppygraph.paths import compile_path
+from steppygraph.states import Choice
+
+_MISSING = object()
+# stands for a rule or column which is evaluated row by row with the local runner's comparison, where
+# converting the values to a typed array would not compare them the same way
+_SCALAR = object()
+# the largest integers a float64 holds exactly
+_EXACT_INT = 2 ** 53
+
+
+def _numpy() -> Any:
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("steppygraph.routing needs numpy, install it with 'pip install numpy'")
+    return numpy
+
+
+def extract(docs: Sequence[Any], path: str) -> List[Any]:
+    """
+    Returns the value at path in every document, or a marker which never matches any rule where it is missing
+    """
+    find = compile_path(path).find
+    return [find(doc, _MISSING) for doc in docs]
+
+
+class ChoiceEvaluator:
+    """
+    A Choice state compiled for batch evaluation. Each Variable is extracted from the inputs once into
+    typed columns, every rule is then evaluated over whole columns and the first matching rule wins per row,
+    exactly as a single execution would route.
+    """
+
+    def __init__(self, choice: Choice) -> None:
+        np = _numpy()
+        self._np = np
+        self.targets: List[str] = [c.Next for c in choice.Choices] + [choice.Default]
+        self._rules: List[Tuple[str, str, str, Any]] = []
+        for case in choice.Choices:
+            kind, op = COMPARISONS[case._comparison.type()]
+            self._rules.append((case.Variable, kind, op, case._comparison.value()))
+        self._ops = {
+            'Equals': np.equal,
+            'LessThan': np.less,
+            'GreaterThan': np.greater,
+            'LessThanEquals': np.less_equal,
+            'GreaterThanEquals': np.greater_equal,
+        }
+
+    def variables(self) -> List[str]:
+        return list(dict.fromkeys(rule[0] for rule in self._rules))
+
+    def _column(self, raw: Sequence[Any], kind: str) -> Any:
+        """
+        Converts raw values to an array for one kind of comparison plus a mask of the values of that kind,
+        or returns _SCALAR for numbers a float64 would not hold exactly
+        """
+        np = self._np
+        if kind == 'Numeric':
+            if any(type(v) is int and not -_EXACT_INT <= v <= _EXACT_INT for v in raw):
+                return _SCALAR
+            values = np.array([v if type(v) is int or type(v) is float else np.nan for v in raw], dtype=float)
+            return values, ~np.isnan(values)
+        if kind == 'String':
+            # an object array, fixed width strings would drop trailing NUL characters
+            valid = np.array([type(v) is str for v in raw], dtype=bool)
+            return np.array([v if type(v) is str else '' for v in raw], dtype=object), valid
+        if kind == 'Boolean':
+            valid = np.array([type(v) is bool for v in raw], dtype=bool)
+            return np.array([v is True for v in raw], dtype=bool), valid
+        stamps = [parse_timestamp(v) for v in raw]
+        values = np.array([ts.timestamp() if ts is not None else np.nan for ts in stamps], dtype=float)
+        return values, ~np.isnan(values)
+
+    def _expected(self, kind: str, value: Any) -> Any:
+        """
+        Returns what the column is compared with, None if the rule never matches, or _SCALAR if the rule's value
+        is not of its kind, since such comparisons either never match or raise TypeError
+        """
+        if kind == 'Timestamp':
+            ts = parse_timestamp(value)
+            return ts.timestamp() if ts is not None else None
+        if kind == 'Numeric':
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return _SCALAR
+            if isinstance(value, int) and not -_EXACT_INT <= value <= _EXACT_INT:
+                return _SCALAR
+        elif kind == 'String' and not isinstance(value, str):
+            return _SCALAR
+        elif kind == 'Boolean' and not isinstance(value, bool):
+            return _SCALAR
+        return value
+
+    def _scalar(self, raw: Sequence[Any], kind: str, op: str, value: Any, pending: Any) -> Any:
+        """
+        Evaluates a rule row by row, for the rows still pending, exactly as steppygraph.local.choose does
+        """
+        np = self._np
+        return np.array([bool(p) and v is not _MISSING and _compare(kind, op, v, value)
+                         for p, v in zip(pending, raw)], dtype=bool)
+
+    def evaluate(self,
+                 docs: Optional[Sequence[Any]] = None,
+                 columns: Optional[Mapping[str, Sequence[Any]]] = None) -> Any:
+        """
+        Returns an array with the index into targets chosen for every row.
+        Rows are either given as input documents or as already extracted columns of values keyed by Variable.
+        """
+        np = self._np
+        if columns is None:
+            if docs is None:
+                raise ValueError("Either docs or columns must be given")
+            columns = {v: extract(docs, v) for v in self.variables()}
+        n = len(next(iter(columns.values()))) if columns else len(docs or [])
+        chosen = np.full(n, len(self._rules), dtype=np.intp)
+        pending = np.ones(n, dtype=bool)
+        typed: Dict[Tuple[str, str], Any] = {}
+        for i, (variable, kind, op, value) in enumerate(self._rules):
+            if not pending.any():
+                break
+            expected = self._expected(kind, value)
+            if expected is None:
+                continue
+            raw = columns[variable]
+            column = _SCALAR
+            if expected is not _SCALAR:
+                if (variable, kind) not in typed:
+                    typed[(variable, kind)] = self._column(raw, kind)
+                column = typed[(variable, kind)]
+            if column is _SCALAR:
+                hit = self._scalar(raw, kind, op, value, pending)
+            else:
+                values, valid = column
+                hit = pending & valid & self._ops[op](values, expected)
+            chosen[hit] = i
+            pending &= ~hit
+        return chosen
+
+    def route(self, docs: Optional[Sequence[Any]] = None,
+              columns: Optional[Mapping[str, Sequence[Any]]] = None) -> Any:
+        """
+        Returns an array with the name of the next state for every row
+        """
+        return self._np.array(self.targets, dtype=object)[self.evaluate(docs, columns)]
+
+    def split(self, docs: Optional[Sequence[Any]] = None,
+              columns: Optional[Mapping[str, Sequence[Any]]] = None) -> Dict[str, int]:
+        """
+        Counts how many rows go to each next state
+        """
+        counts = self._np.bincount(self.evaluate(docs, columns), minlength=len(self.targets))
+        split: Dict[str, int] = {}
+        for target, count in zip(self.targets, counts):
+            split[target] = split.get(target, 0) + int(count)
+        return split
+
+
+def compile_choice(choice: Choice) -> ChoiceEvaluator:
+    return ChoiceEvaluator(choice)
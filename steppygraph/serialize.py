@@ -1,6 +1,542 @@
+import json
+import re
 from functools import singledispatch
+from json.encoder import encode_basestring_ascii
+from typing import Any, Callable, Dict, IO, Iterator, List, Optional, Tuple, Union
+
+JSON_INDENT = 4
+CHUNK_SIZE = 64 * 1024
+COMPACT_SEPARATORS = (',', ':')
+
+Indent = Optional[Union[int, str]]
+Separators = Optional[Tuple[str, str]]
+
 
 @singledispatch
 def to_serializable(val):
     """Used by default."""
     return str(val)
+
+
+class FieldPlan:
+    """
+    The compiled serialization plan of a class: which attributes to emit and in what order.
+    Classes opt in by declaring a _json_fields tuple, and _json_build = True if build() must run before emitting.
+    With _json_extras = True the public names set in an instance's _extra dict which are not in _json_fields are
+    emitted after them.
+    """
+    __slots__ = ('fields', 'sorted_fields', 'build', 'extras', 'field_set')
+
+    def __init__(self, fields: Tuple[str, ...], build: bool, extras: bool = False) -> None:
+        self.fields = fields
+        self.sorted_fields = tuple(sorted(fields))
+        self.build = build
+        self.extras = extras
+        self.field_set = frozenset(fields)
+
+
+_plans: Dict[type, Optional[FieldPlan]] = {}
+
+
+def plan_for(cls: type) -> Optional[FieldPlan]:
+    """
+    Returns the field plan of a class, compiling it on first use. None if the class has no _json_fields.
+    """
+    try:
+        return _plans[cls]
+    except KeyError:
+        fields = getattr(cls, '_json_fields', None)
+        plan = FieldPlan(tuple(fields), bool(getattr(cls, '_json_build', False)),
+                         bool(getattr(cls, '_json_extras', False))) if fields is not None else None
+        _plans[cls] = plan
+        return plan
+
+
+def fields_of(obj: Any, plan: FieldPlan, sort_keys: bool = False) -> Tuple[str, ...]:
+    """
+    Returns the fields to emit for obj, those of its plan followed by any undeclared ones it carries
+    """
+    fields = plan.sorted_fields if sort_keys else plan.fields
+    if plan.extras and obj._extra:
+        more = tuple(k for k in obj._extra if k not in plan.field_set)
+        if more:
+            fields = tuple(sorted(fields + more)) if sort_keys else fields + more
+    return fields
+
+
+def props(obj: Any) -> Dict[str, Any]:
+    """
+    Returns the non-None fields of obj listed in its plan, values are left unconverted.
+    """
+    plan = plan_for(type(obj))
+    if plan is None:
+        raise TypeError(f"{type(obj).__name__} has no field plan")
+    d = {}
+    for f in fields_of(obj, plan):
+        v = getattr(obj, f, None)
+        if v is not None:
+            d[f] = v
+    return d
+
+
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def encode(val: Any) -> Any:
+    """
+    Converts val into plain dicts, lists and scalars ready for any JSON encoder
+    """
+    t = type(val)
+    if t in _SCALARS:
+        return val
+    if t is list or t is tuple:
+        return [encode(v) for v in val]
+    if t is dict:
+        return {k: encode(v) for k, v in val.items()}
+    plan = plan_for(t)
+    if plan is not None:
+        return _encode_obj(val, plan)
+    if isinstance(val, _SCALARS):
+        return val
+    if isinstance(val, (list, tuple)):
+        return [encode(v) for v in val]
+    if isinstance(val, dict):
+        return {k: encode(v) for k, v in val.items()}
+    return encode(_converter(t)(val))
+
+
+def _encode_obj(val: Any, plan: FieldPlan) -> Dict[str, Any]:
+    if plan.build:
+        val.build()
+    d = {}
+    for f in fields_of(val, plan):
+        v = getattr(val, f, None)
+        if v is not None:
+            d[f] = v if type(v) in _SCALARS else encode(v)
+    return d
+
+
+def _object_writer(write_obj: Callable[[Any, FieldPlan, int, List[str]], None]) \
+        -> Callable[[Any, FieldPlan, int, List[str]], None]:
+    """
+    Returns what _Writer uses to write objects with a field plan, given its own. instrument replaces it to time them.
+    """
+    return write_obj
+
+
+def _floatstr(o: float) -> str:
+    if o != o:
+        return 'NaN'
+    if o == float('inf'):
+        return 'Infinity'
+    if o == -float('inf'):
+        return '-Infinity'
+    return float.__repr__(o)
+
+
+def _keystr(k: Any) -> str:
+    if isinstance(k, str):
+        return encode_basestring_ascii(k)
+    if isinstance(k, float):
+        return encode_basestring_ascii(_floatstr(k))
+    if k is True:
+        return '"true"'
+    if k is False:
+        return '"false"'
+    if k is None:
+        return '"null"'
+    if isinstance(k, int):
+        return encode_basestring_ascii(int.__repr__(k))
+    raise TypeError(f'keys must be str, int, float, bool or None, not {k.__class__.__name__}')
+
+
+_converters: Dict[type, Callable[[Any], Any]] = {}
+
+
+def _converter(cls: type) -> Callable[[Any], Any]:
+    """
+    Returns the to_serializable implementation for a class without a field plan, looked up once per class
+    """
+    try:
+        return _converters[cls]
+    except KeyError:
+        _converters[cls] = fn = to_serializable.dispatch(cls)
+        return fn
+
+
+class _Writer:
+    """
+    Appends the indented JSON text of values to a list of parts, producing
+    the same text as json.dumps with the given indent and sort_keys.
+    """
+
+    def __init__(self, indent: Union[int, str], sort_keys: bool) -> None:
+        step = indent if isinstance(indent, str) else ' ' * indent
+        pads: List[str] = []
+        keys: Dict[str, str] = {}
+        # per plan, the fields to emit in order paired with their encoded keys
+        layouts: Dict[int, Tuple[Tuple[str, str], ...]] = {}
+        enc = encode_basestring_ascii
+        intstr = int.__repr__
+
+        def pad(depth: int) -> str:
+            while len(pads) <= depth:
+                pads.append('\n' + step * len(pads))
+            return pads[depth]
+
+        def key(k: Any) -> str:
+            if type(k) is not str:
+                return _keystr(k) + ': '
+            try:
+                return keys[k]
+            except KeyError:
+                keys[k] = ks = enc(k) + ': '
+                return ks
+
+        def layout(v: Any, plan: FieldPlan) -> Tuple[Tuple[str, str], ...]:
+            if plan.extras and v._extra:
+                fields = fields_of(v, plan, sort_keys)
+                if len(fields) != len(plan.fields):
+                    return tuple((f, key(f)) for f in fields)
+            try:
+                return layouts[id(plan)]
+            except KeyError:
+                fields = plan.sorted_fields if sort_keys else plan.fields
+                layouts[id(plan)] = lay = tuple((f, key(f)) for f in fields)
+                return lay
+
+        def write(v: Any, depth: int, parts: List[str]) -> None:
+            t = type(v)
+            if t is str:
+                parts.append(enc(v))
+            elif v is None:
+                parts.append('null')
+            elif v is True:
+                parts.append('true')
+            elif v is False:
+                parts.append('false')
+            elif t is int:
+                parts.append(intstr(v))
+            elif t is float:
+                parts.append(_floatstr(v))
+            elif t is list or t is tuple:
+                write_list(v, depth, parts)
+            elif t is dict:
+                write_dict(v, depth, parts)
+            else:
+                plan = plan_for(t)
+                if plan is not None:
+                    write_obj(v, plan, depth, parts)
+                elif isinstance(v, str):
+                    parts.append(enc(v))
+                elif isinstance(v, int):
+                    parts.append(intstr(v))
+                elif isinstance(v, float):
+                    parts.append(_floatstr(v))
+                elif isinstance(v, (list, tuple)):
+                    write_list(v, depth, parts)
+                elif isinstance(v, dict):
+                    write_dict(v, depth, parts)
+                else:
+                    write(_converter(t)(v), depth, parts)
+
+        def write_list(v: Any, depth: int, parts: List[str]) -> None:
+            if not v:
+                parts.append('[]')
+                return
+            nl = pad(depth + 1)
+            sep = '[' + nl
+            for item in v:
+                parts.append(sep)
+                sep = ',' + nl
+                if type(item) is str:
+                    parts.append(enc(item))
+                else:
+                    write(item, depth + 1, parts)
+            parts.append(pad(depth) + ']')
+
+        def write_dict(v: Any, depth: int, parts: List[str]) -> None:
+            if not v:
+                parts.append('{}')
+                return
+            nl = pad(depth + 1)
+            sep = '{' + nl
+            for k, item in sorted(v.items()) if sort_keys else v.items():
+                parts.append(sep)
+                sep = ',' + nl
+                parts.append(key(k))
+                write(item, depth + 1, parts)
+            parts.append(pad(depth) + '}')
+
+        def write_obj(v: Any, plan: FieldPlan, depth: int, parts: List[str]) -> None:
+            if plan.build:
+                v.build()
+            nl = pad(depth + 1)
+            sep = '{' + nl
+            for f, k in layout(v, plan):
+                item = getattr(v, f, None)
+                if item is None:
+                    continue
+                parts.append(sep)
+                sep = ',' + nl
+                parts.append(k)
+                t = type(item)
+                if t is str:
+                    parts.append(enc(item))
+                elif t is int:
+                    parts.append(intstr(item))
+                elif t is list:
+                    write_list(item, depth + 1, parts)
+                else:
+                    write(item, depth + 1, parts)
+            parts.append('{}' if sep[0] == '{' else pad(depth) + '}')
+
+        write_obj = _object_writer(write_obj)
+        self.step = step
+        self.pad = pad
+        self.key = key
+        self.write = write
+        self.sort_keys = sort_keys
+
+    def fields(self, v: Any, plan: FieldPlan) -> Tuple[str, ...]:
+        return fields_of(v, plan, self.sort_keys)
+
+
+class Profile:
+    """
+    A named set of output options, see PROFILES
+    """
+    __slots__ = ('name', 'sort_keys', 'indent', 'separators')
+
+    def __init__(self, name: str, sort_keys: bool, indent: Indent, separators: Separators = None) -> None:
+        self.name = name
+        self.sort_keys = sort_keys
+        self.indent = indent
+        self.separators = separators
+
+    def options(self) -> Dict[str, Any]:
+        return {'sort_keys': self.sort_keys, 'indent': self.indent, 'separators': self.separators}
+
+    def __repr__(self) -> str:
+        return f"Profile({self.name!r})"
+
+
+# indented with sorted keys, what to_json has always produced
+PRETTY = Profile('pretty', True, JSON_INDENT)
+# no whitespace and fields in the order the classes declare them, the smallest and quickest to write
+COMPACT = Profile('compact', False, None, COMPACT_SEPARATORS)
+# no whitespace, sorted keys and ASCII only, so equal machines always give the same bytes
+CANONICAL = Profile('canonical', True, None, COMPACT_SEPARATORS)
+
+PROFILES = {p.name: p for p in (PRETTY, COMPACT, CANONICAL)}
+
+
+def get_profile(profile: Union[str, Profile]) -> Profile:
+    if isinstance(profile, Profile):
+        return profile
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise ValueError(f"Unknown output profile '{profile}', expected one of {sorted(PROFILES)}")
+
+
+# encodes a document of plain values with COMPACT_SEPARATORS, or returns None to leave it to the json module
+Backend = Callable[[Any, bool], Optional[str]]
+
+
+def _json_backend(doc: Any, sort_keys: bool) -> Optional[str]:
+    return json.dumps(doc, sort_keys=sort_keys, separators=COMPACT_SEPARATORS)
+
+
+# a number the json module would write in exponent form, orjson writes 1e+16 as 1e16 and 1e-05 as 0.00001
+_ORJSON_FLOAT = re.compile(rb'[:,\[]-?(?:0\.0000|[0-9.]+e)')
+
+
+def _orjson_backend(doc: Any, sort_keys: bool) -> Optional[str]:
+    import orjson
+    try:
+        out = orjson.dumps(doc, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    except TypeError:
+        # integers over 64 bits and keys which are not strings
+        return None
+    # orjson writes non-ASCII and DEL characters unescaped, NaN and infinities as null
+    if not out.isascii() or b'\x7f' in out or b'null' in out or _ORJSON_FLOAT.search(out):
+        return None
+    return out.decode('ascii')
+
+
+_backends: Dict[str, Backend] = {'json': _json_backend, 'orjson': _orjson_backend}
+_backend: Optional[Backend] = None
+_backend_name = ''
+
+
+def register_backend(name: str, backend: Backend) -> None:
+    """
+    Makes backend available to set_backend. It must produce exactly what the json module would, returning None
+    for documents it cannot.
+    """
+    _backends[name] = backend
+
+
+def set_backend(name: Optional[str] = None) -> None:
+    """
+    Selects the encoder used for output without whitespace. None picks orjson if it is installed, else json.
+    """
+    global _backend, _backend_name
+    if name is None:
+        try:
+            import orjson  # noqa: F401
+            name = 'orjson'
+        except ImportError:
+            name = 'json'
+    elif name == 'orjson':
+        try:
+            import orjson  # noqa: F401
+        except ImportError:
+            raise ImportError("The orjson backend needs orjson, install it with 'pip install orjson'")
+    if name not in _backends:
+        raise ValueError(f"Unknown backend '{name}', expected one of {sorted(_backends)}")
+    _backend, _backend_name = _backends[name], name
+
+
+def get_backend() -> str:
+    if _backend is None:
+        set_backend()
+    return _backend_name
+
+
+def _dumps_compact(doc: Any, sort_keys: bool) -> str:
+    if _backend is None:
+        set_backend()
+    assert _backend is not None
+    out = _backend(doc, sort_keys)
+    return out if out is not None else _json_backend(doc, sort_keys)  # type: ignore
+
+
+def dumps(obj: Any, sort_keys: bool = True, indent: Indent = JSON_INDENT, separators: Separators = None) -> str:
+    """
+    Serializes obj to a JSON string using the field plans of its classes. The output is the same as
+    json.dumps(obj, default=to_serializable, sort_keys=sort_keys, indent=indent, separators=separators).
+    Without indent and with COMPACT_SEPARATORS it is written by the selected backend, see set_backend.
+    """
+    if indent is None:
+        doc = encode(obj)
+        if separators == COMPACT_SEPARATORS:
+            return _dumps_compact(doc, sort_keys)
+        return json.dumps(doc, sort_keys=sort_keys, separators=separators)
+    if separators is not None:
+        raise ValueError("separators can only be given without indent")
+    parts: List[str] = []
+    _Writer(indent, sort_keys).write(obj, 0, parts)
+    return ''.join(parts)
+
+
+def _streamed(v: Any) -> bool:
+    return bool(getattr(type(v), '_json_stream', False)) and plan_for(type(v)) is not None
+
+
+def _iter_indented(obj: Any, indent: Union[int, str], sort_keys: bool) -> Iterator[str]:
+    """
+    Yields the indented JSON text of obj piece by piece. Objects marked with _json_stream (machines and
+    states holding branches) are walked lazily down to their individual states, everything else is
+    written in one go.
+    """
+    w = _Writer(indent, sort_keys)
+
+    def walk(v: Any, depth: int) -> Iterator[str]:
+        plan = plan_for(type(v))
+        assert plan is not None
+        if plan.build:
+            v.build()
+        parts: List[str] = []
+        sep = '{' + w.pad(depth + 1)
+        for f in w.fields(v, plan):
+            item = getattr(v, f, None)
+            if item is None:
+                continue
+            parts.append(sep)
+            sep = ',' + w.pad(depth + 1)
+            parts.append(w.key(f))
+            if item and isinstance(item, (list, tuple, dict)):
+                yield ''.join(parts)
+                parts = []
+                yield from walk_container(item, depth + 1)
+            elif _streamed(item):
+                yield ''.join(parts)
+                parts = []
+                yield from walk(item, depth + 1)
+            else:
+                w.write(item, depth + 1, parts)
+        parts.append('{}' if sep[0] == '{' else w.pad(depth) + '}')
+        yield ''.join(parts)
+
+    def walk_container(c: Any, depth: int) -> Iterator[str]:
+        if isinstance(c, dict):
+            closing = '}'
+            sep = '{' + w.pad(depth + 1)
+            items: Any = sorted(c.items()) if sort_keys else c.items()
+        else:
+            closing = ']'
+            sep = '[' + w.pad(depth + 1)
+            items = ((None, item) for item in c)
+        keyed = closing == '}'
+        for k, item in items:
+            yield sep + w.key(k) if keyed else sep
+            sep = ',' + w.pad(depth + 1)
+            if _streamed(item):
+                yield from walk(item, depth + 1)
+            else:
+                parts: List[str] = []
+                w.write(item, depth + 1, parts)
+                yield ''.join(parts)
+        yield w.pad(depth) + closing
+
+    if _streamed(obj):
+        yield from walk(obj, 0)
+    else:
+        parts: List[str] = []
+        w.write(obj, 0, parts)
+        yield ''.join(parts)
+
+
+def iter_json(obj: Any,
+              sort_keys: bool = True,
+              indent: Indent = JSON_INDENT,
+              chunk_size: int = CHUNK_SIZE,
+              separators: Separators = None) -> Iterator[str]:
+    """
+    Encodes obj incrementally, yielding chunks of roughly chunk_size characters.
+    States are only rendered as the walk reaches them, so memory stays bounded
+    by the largest single state rather than the whole document.
+    """
+    if indent is None:
+        pieces: Iterator[str] = json.JSONEncoder(default=to_serializable, sort_keys=sort_keys,
+                                                 separators=separators).iterencode(obj)
+    elif separators is not None:
+        raise ValueError("separators can only be given without indent")
+    else:
+        pieces = _iter_indented(obj, indent, sort_keys)
+    buf = []
+    size = 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf)
+
+
+def dump(obj: Any,
+         fp: IO[str],
+         sort_keys: bool = True,
+         indent: Indent = JSON_INDENT,
+         chunk_size: int = CHUNK_SIZE,
+         separators: Separators = None) -> None:
+    """
+    Writes obj as JSON to a writable text file object chunk by chunk
+    """
+    for chunk in iter_json(obj, sort_keys=sort_keys, indent=indent, chunk_size=chunk_size, separators=separators):
+        fp.write(chunk)
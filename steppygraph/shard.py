@@ -0,0 +1,213 @@
+"""
+Splits machines too large to deploy into a root machine and child machines it runs with StartExecution tasks.
+
+Cuts are only made where the graph has a single entry and a single exit: every transition into a run of
+consecutive states lands on its first state and every transition out of it lands on the state following it.
+Such a run behaves the same in place or as a child execution which succeeds where it would have moved on, so
+the root machine keeps the original behaviour. Runs are packed greedily in state order, which gives the fewest
+children the available cuts allow.
+
+Failing inside a child fails the StartExecution task, and so the root execution, with States.TaskFailed rather
+than the Fail state's own error.
+"""
+import itertools
+from copy import copy
+from typing import Iterator, List, Optional, Tuple
+
+from steppygraph.fanout import BranchTable
+from steppygraph.machine import StateMachine, Parallel, Map
+from steppygraph.size import DEFINITION_SIZE_LIMIT, entry_size, _base_size, _compact, _END
+from steppygraph.states import State, StateType, Task, Succeed, StartExecution, WorkflowType
+from steppygraph.validate import _transitions
+
+DEFAULT_NAME = 'machine'
+
+_SUCCEED = len('{"Type":"Succeed"}')
+
+
+class ShardError(ValueError):
+    pass
+
+
+def machine_arn(region: str, account: str, name: str) -> str:
+    return f"arn:aws:states:{region}:{account}:stateMachine:{name}"
+
+
+def _cuts(machine: StateMachine) -> Tuple[List[int], List[int]]:
+    """
+    Returns the positions between states where the machine can be cut, 0 and the number of states included,
+    and for each position the number of transitions landing on the state there from states before it
+    """
+    states = machine.get_states()
+    n = len(states)
+    # +1 where a range of positions crossed by some transition starts, -1 past its end
+    crossed = [0] * (n + 2)
+    into = [0] * (n + 1)
+    for i, s in enumerate(states):
+        for _, target in _transitions(s):
+            j = machine.idx(target)
+            if j is None:
+                continue
+            if j > i:
+                # a forward transition may only cross the cut in front of its target
+                into[j] += 1
+                lo, hi = i + 1, j - 1
+            else:
+                # a backward one may not cross any
+                lo, hi = j + 1, i
+            if lo <= hi:
+                crossed[lo] += 1
+                crossed[hi + 1] -= 1
+    cuts = []
+    depth = 0
+    for k in range(n + 1):
+        depth += crossed[k]
+        if depth == 0:
+            cuts.append(k)
+    return cuts, into
+
+
+def _ends(state: State, i: int, n: int) -> bool:
+    if state.Type == StateType.SUCCEED.value or state.End is True:
+        return True
+    return i == n - 1 and state.Type != StateType.FAIL.value
+
+
+def _regions(machine: StateMachine, max_bytes: int, max_states: Optional[int]) -> List[Tuple[int, int, bool]]:
+    """
+    Packs the states into runs [a, b) between cuts, each as large as will fit in a child machine.
+    The flag is True for runs which move on to state b rather than end the execution.
+    """
+    states = machine.get_states()
+    n = len(states)
+    cuts, into = _cuts(machine)
+    limit = max_states if max_states is not None else n + 1
+    regions = []
+    c = 0
+    while cuts[c] < n:
+        a = cuts[c]
+        size = _base_size(machine, states[a].name()) + _END - 1
+        count = 0
+        ends = False
+        best = None
+        best_exits = False
+        i = a
+        for k in range(c + 1, len(cuts)):
+            b = cuts[k]
+            for j in range(i, b):
+                size += entry_size(states[j]) + 1
+                ends = ends or _ends(states[j], j, n)
+            count += b - i
+            i = b
+            exits = b < n and into[b] > 0
+            # a child leaving to the next state ends in a Succeed state named after it
+            exit_size = _compact(states[b].name()) + 2 + _SUCCEED if exits else 0
+            if size + exit_size > max_bytes or count + exits > limit:
+                break
+            if exits:
+                closes = not ends
+            else:
+                # build() ends a child on its last state, which must then be one the run already ended on
+                closes = b == n or _ends(states[b - 1], b - 1, n)
+            if closes:
+                best, best_exits = k, exits
+        if best is None:
+            raise ShardError(f"The states from '{states[a].name()}' cannot be split to fit the budget")
+        regions.append((a, cuts[best], best_exits))
+        c = best
+    return regions
+
+
+def _copy_state(state: State) -> State:
+    """
+    Copies a state along with the machines it holds. A plain copy() of a Parallel or Map state shares them, and
+    registers the copy as their parent, which would tie the input machine's branches to the new machines.
+    """
+    if isinstance(state, Parallel):
+        other = State.__copy__(state)
+        branches = state.Branches
+        if isinstance(branches, BranchTable):
+            other.Branches = BranchTable(_copy_machine(branches.prototype), branches.rows)
+        else:
+            other.Branches = [_copy_machine(b) for b in branches]
+        return other
+    if isinstance(state, Map):
+        other = State.__copy__(state)
+        other.Iterator = _copy_machine(state.Iterator)
+        return other
+    return copy(state)
+
+
+def _copy_machine(machine: StateMachine) -> StateMachine:
+    m = type(machine)(machine._region, machine._account, name=machine.name())
+    m._workflow_type = machine._workflow_type
+    for f in ('TimeoutSeconds', 'Comment', 'Version'):
+        if getattr(machine, f, None) is not None:
+            setattr(m, f, getattr(machine, f))
+    for s in machine.get_states():
+        _add_copy(m, s)
+    return m
+
+
+def _add_copy(machine: StateMachine, state: State) -> None:
+    state = _copy_state(state)
+    res = state.Resource if isinstance(state, Task) else None
+    machine.add_state(state)
+    if res is not None and state.Resource is not res:
+        # add_state gives resources the machine's region and account, keep the state's own
+        state.Resource = res
+
+
+def _new_machine(machine: StateMachine, name: str) -> StateMachine:
+    m = StateMachine(machine._region, machine._account, name=name)
+    m.TimeoutSeconds = getattr(machine, 'TimeoutSeconds', None)
+    return m
+
+
+def _shard(machine: StateMachine, max_bytes: int, max_states: Optional[int], names: Iterator[str]) \
+        -> List[StateMachine]:
+    n = machine.count_states()
+    if machine.size() <= max_bytes and (max_states is None or n <= max_states):
+        return [machine]
+    if machine.workflow_type == WorkflowType.EXPRESS:
+        raise ShardError("Express workflows cannot wait for child executions, so they cannot be sharded")
+
+    states = machine.get_states()
+    regions = _regions(machine, max_bytes, max_states)
+    if len(regions) >= n:
+        raise ShardError("The budget is too small to hold more than one state per machine")
+
+    root = _new_machine(machine, machine.name())
+    for f in ('Comment', 'Version'):
+        if getattr(machine, f, None) is not None:
+            setattr(root, f, getattr(machine, f))
+    children = []
+    for a, b, exits in regions:
+        child = _new_machine(machine, next(names))
+        for s in states[a:b]:
+            _add_copy(child, s)
+        task = StartExecution(states[a].name(), machine_arn(machine._region, machine._account, child.name()),
+                              timeout_seconds=child.TimeoutSeconds)
+        if exits:
+            child.add_state(Succeed(states[b].name()))
+            task.set_next(states[b].name())
+        else:
+            task.End = True
+        root.add_state(task)
+        children.append(child)
+    return _shard(root, max_bytes, max_states, names) + children
+
+
+def shard(machine: StateMachine, max_bytes: int = DEFINITION_SIZE_LIMIT, max_states: int = None) -> List[StateMachine]:
+    """
+    Splits a machine whose compact JSON is over max_bytes, or which has more than max_states states, into machines
+    within both limits. Returns the machine to start executions with first, then the machines it runs, named after
+    the machine with a numeric suffix. Returns just the machine when it is within the limits already.
+    Neither the machine nor its states are changed, the new machines hold copies of the states.
+
+    Raises ShardError if some run of states which cannot be cut is too large on its own, or if an Express machine
+    would have to be split.
+    """
+    base = machine.name() or DEFAULT_NAME
+    names = (f"{base}-{i}" for i in itertools.count(1))
+    return _shard(machine, max_bytes, max_states, names)
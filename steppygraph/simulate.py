@@ -0,0 +1,404 @@
+"""
+Monte Carlo estimates of the transitions, duration and cost of executions, from annotations saying how often
+each task fails, how long states take and how Choice states split.
+
+All runs step through the graph together: the runs waiting at a state are handled as one batch of NumPy
+arrays, and states are visited in topological order so that runs arriving from different paths are merged
+before the state is processed. Retries are drawn attempt by attempt with a counter per Retrier, as Step
+Functions keeps them, and errors nothing retries go to the first matching Catcher or fail the run. A failed
+Parallel branch or Map iteration fails its state with the error it failed with, that of the branch or iteration
+which failed soonest when several did, as the local runner does.
+NumPy is an optional dependency, only needed by this module.
+"""
+import heapq
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from steppygraph.latency import RETRY_MAX_ATTEMPTS, RETRY_INTERVAL_SECONDS, RETRY_BACKOFF_RATE
+from steppygraph.local import error_matches
+from steppygraph.machine import StateMachine, Map
+from steppygraph.states import State, StateType, Task, Wait, Choice, ErrorType
+from steppygraph.validate import _components, _ends, _transitions
+
+# standard workflow price in USD
+PRICE_PER_TRANSITION = 0.000025
+DEFAULT_RUNS = 100000
+DEFAULT_MAX_TRANSITIONS = 25000
+
+# draws an array of the given shape of durations in seconds
+Distribution = Callable[[Any, Tuple[int, ...]], Any]
+
+
+def _numpy() -> Any:
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("steppygraph.simulate needs numpy, install it with 'pip install numpy'")
+    return numpy
+
+
+def fixed(seconds: float) -> Distribution:
+    return lambda rng, shape: _numpy().full(shape, float(seconds))
+
+
+def uniform(low: float, high: float) -> Distribution:
+    return lambda rng, shape: rng.uniform(low, high, shape)
+
+
+def exponential(mean: float) -> Distribution:
+    return lambda rng, shape: rng.exponential(mean, shape)
+
+
+def lognormal(median: float, sigma: float) -> Distribution:
+    mu = _numpy().log(median)
+    return lambda rng, shape: rng.lognormal(mu, sigma, shape)
+
+
+class StateModel:
+    """
+    What the simulation assumes about one state.
+
+    :param failure: the probability that one attempt of a task fails with error
+    :param duration: the distribution of one attempt's duration, or of the state's for other types.
+        Attempts running past the task's TimeoutSeconds fail with States.Timeout.
+    :param choices: for Choice states, target state name to the probability of going there.
+        Unannotated Choice states pick each of their rules and the default equally often.
+    :param items: for Map states, the number of items each run iterates over, in waves of MaxConcurrency
+    """
+    __slots__ = ('failure', 'duration', 'choices', 'error', 'items')
+
+    def __init__(self,
+                 failure: float = 0.0,
+                 duration: Distribution = None,
+                 choices: Mapping[str, float] = None,
+                 error: str = ErrorType.TASK_FAILED.value,
+                 items: int = 1) -> None:
+        self.failure = failure
+        self.duration = duration
+        self.choices = choices
+        self.error = error
+        self.items = items
+
+
+class Simulation:
+    """
+    Per run arrays of transitions, duration in seconds, cost in USD and whether the run failed, plus the number
+    of times each state, branch states included, was entered over all runs.
+    """
+
+    def __init__(self, transitions: Any, duration: Any, failed: Any, cost: Any, visits: Dict[str, int]) -> None:
+        self.transitions = transitions
+        self.duration = duration
+        self.failed = failed
+        self.cost = cost
+        self.visits = visits
+
+    def percentiles(self, q: Sequence[float] = (50, 90, 99)) -> Dict[float, float]:
+        """
+        Returns the duration percentiles of the runs
+        """
+        values = _numpy().percentile(self.duration, q)
+        return {p: float(v) for p, v in zip(q, values)}
+
+    def summary(self) -> Dict[str, float]:
+        d: Dict[str, float] = {
+            'runs': len(self.duration),
+            'failure_rate': float(self.failed.mean()),
+            'mean_transitions': float(self.transitions.mean()),
+            'mean_cost': float(self.cost.mean()),
+            'mean_duration': float(self.duration.mean()),
+        }
+        for p, v in self.percentiles().items():
+            d[f'p{p:g}_duration'] = v
+        return d
+
+
+_DEFAULT_MODEL = StateModel()
+
+
+class _Runs:
+    """
+    The arrays of one batch of runs through a machine or branch
+    """
+
+    def __init__(self, np: Any, n: int) -> None:
+        self.duration = np.zeros(n)
+        self.transitions = np.zeros(n, dtype=np.int64)
+        self.failed = np.zeros(n, dtype=bool)
+        # the error each failed run failed with
+        self.error = np.full(n, None, dtype=object)
+
+    def fail(self, ids: Any, error: Optional[str]) -> None:
+        self.failed[ids] = True
+        self.error[ids] = error
+
+
+class _Simulator:
+
+    def __init__(self, np: Any, rng: Any, models: Mapping[str, StateModel], max_transitions: int) -> None:
+        self.np = np
+        self.rng = rng
+        self.models = models
+        self.max_transitions = max_transitions
+        self.visits: Dict[str, int] = {}
+
+    def model(self, state: State) -> StateModel:
+        return self.models.get(state.name(), _DEFAULT_MODEL)
+
+    def draw(self, model: StateModel, shape: Tuple[int, ...]) -> Any:
+        if model.duration is None:
+            return self.np.zeros(shape)
+        return model.duration(self.rng, shape)
+
+    def run(self, machine: StateMachine, n: int) -> _Runs:
+        """
+        Runs n executions of machine, all starting together
+        """
+        np = self.np
+        runs = _Runs(np, n)
+        states = machine.get_states()
+        if not states:
+            return runs
+        # sources first, the states of a loop share a rank
+        components = _components([self._targets(machine, s) for s in states])
+        rank = [0] * len(states)
+        for k, component in enumerate(components):
+            for v in component:
+                rank[v] = len(components) - k
+        pending: Dict[int, List[Any]] = {0: [np.arange(n)]}
+        heap = [(rank[0], 0)]
+        last = len(states) - 1
+        while heap:
+            _, v = heapq.heappop(heap)
+            batch = pending.pop(v, None)
+            if batch is None:
+                continue
+            ids = np.concatenate(batch) if len(batch) > 1 else batch[0]
+            state = states[v]
+            self.visits[state.name()] = self.visits.get(state.name(), 0) + len(ids)
+            runs.transitions[ids] += 1
+            for target, moved in self._step(machine, state, v == last, ids, runs):
+                # runs going round a loop too often stop as failed, like the local runner
+                over = runs.transitions[moved] >= self.max_transitions
+                if over.any():
+                    runs.fail(moved[over], 'States.Runtime')
+                    moved = moved[~over]
+                if not len(moved):
+                    continue
+                if target not in pending:
+                    pending[target] = []
+                    heapq.heappush(heap, (rank[target], target))
+                pending[target].append(moved)
+        return runs
+
+    @staticmethod
+    def _targets(machine: StateMachine, state: State) -> List[int]:
+        out = []
+        for _, name in _transitions(state):
+            j = machine.idx(name)
+            if j is not None:
+                out.append(j)
+        return out
+
+    def _next(self, machine: StateMachine, state: State, last: bool, ids: Any) -> List[Tuple[int, Any]]:
+        if _ends(state, last):
+            return []
+        nxt = state._next or getattr(state, 'Next', None)
+        j = machine.idx(nxt) if nxt else None
+        return [] if j is None else [(j, ids)]
+
+    def _catch(self, machine: StateMachine, state: State, error: str, ids: Any, runs: _Runs) \
+            -> List[Tuple[int, Any]]:
+        for c in getattr(state, '_catch', None) or getattr(state, 'Catch', None) or []:
+            if error_matches(error, c.ErrorEquals):
+                j = machine.idx(c._next.name())
+                if j is not None:
+                    return [(j, ids)]
+                break
+        runs.fail(ids, error)
+        return []
+
+    def _step(self, machine: StateMachine, state: State, last: bool, ids: Any, runs: _Runs) \
+            -> List[Tuple[int, Any]]:
+        np = self.np
+        model = self.model(state)
+        if isinstance(state, Task):
+            return self._task(machine, state, last, ids, runs, model)
+        if isinstance(state, Wait):
+            runs.duration[ids] += state.Seconds or 0
+            return self._next(machine, state, last, ids)
+        if isinstance(state, Choice):
+            return self._choice(machine, state, ids, model)
+        if isinstance(state, Map):
+            return self._map(machine, state, last, ids, runs, model)
+        branches = getattr(state, 'Branches', None)
+        if branches is not None:
+            return self._parallel(machine, state, branches, last, ids, runs)
+        runs.duration[ids] += self.draw(model, (len(ids),))
+        if state.Type == StateType.FAIL.value:
+            runs.fail(ids, getattr(state, 'Error', None))
+            return []
+        if state.Type == StateType.SUCCEED.value:
+            return []
+        return self._next(machine, state, last, ids)
+
+    def _choice(self, machine: StateMachine, state: Choice, ids: Any, model: StateModel) -> List[Tuple[int, Any]]:
+        np = self.np
+        if model.choices:
+            names = list(model.choices)
+            p = np.array([model.choices[t] for t in names], dtype=float)
+        else:
+            names = [c.Next for c in state.Choices or []] + ([state.Default] if state.Default else [])
+            p = np.full(len(names), 1.0 / len(names))
+        picked = self.rng.choice(len(names), size=len(ids), p=p / p.sum())
+        out = []
+        for i, name in enumerate(names):
+            j = machine.idx(name)
+            moved = ids[picked == i]
+            if j is not None and len(moved):
+                out.append((j, moved))
+        return out
+
+    def _task(self, machine: StateMachine, task: Task, last: bool, ids: Any, runs: _Runs, model: StateModel) \
+            -> List[Tuple[int, Any]]:
+        np = self.np
+        timeout = task.TimeoutSeconds
+
+        def attempt(active: Any) -> List[Any]:
+            d = self.draw(model, (len(active),))
+            timed_out = np.zeros(len(active), dtype=bool) if timeout is None else d > timeout
+            if timeout is not None:
+                d = np.minimum(d, timeout)
+            runs.duration[active] += d
+            error = self.rng.random(len(active)) < model.failure
+            # a timed out attempt fails with States.Timeout whatever else happened
+            return [(model.error, error & ~timed_out), (ErrorType.TIMEOUT.value, timed_out)]
+        return self._retrying(machine, task, last, ids, runs, attempt)
+
+    def _parallel(self, machine: StateMachine, state: State, branches: Sequence[StateMachine], last: bool, ids: Any,
+                  runs: _Runs) -> List[Tuple[int, Any]]:
+        np = self.np
+
+        def attempt(active: Any) -> List[Tuple[Optional[str], Any]]:
+            results = [self.run(b, len(active)) for b in branches]
+            if not results:
+                return []
+            duration = np.stack([r.duration for r in results], axis=1)
+            runs.duration[active] += duration.max(axis=1)
+            for r in results:
+                runs.transitions[active] += r.transitions
+            return self._branch_errors(np.stack([r.failed for r in results], axis=1), duration,
+                                       np.stack([r.error for r in results], axis=1))
+        return self._retrying(machine, state, last, ids, runs, attempt)
+
+    def _branch_errors(self, failed: Any, duration: Any, error: Any) -> List[Tuple[Optional[str], Any]]:
+        """
+        Given which branches of each run failed, one row per run, returns for each error the runs whose soonest
+        failing branch failed with it
+        """
+        np = self.np
+        rows = np.flatnonzero(failed.any(axis=1))
+        if not len(rows):
+            return []
+        soonest = np.where(failed[rows], duration[rows], np.inf).argmin(axis=1)
+        errors = error[rows, soonest]
+        out = []
+        for e in dict.fromkeys(errors.tolist()):
+            mask = np.zeros(len(failed), dtype=bool)
+            mask[rows[np.array([x == e for x in errors], dtype=bool)]] = True
+            out.append((e, mask))
+        return out
+
+    def _map(self, machine: StateMachine, state: Map, last: bool, ids: Any, runs: _Runs, model: StateModel) \
+            -> List[Tuple[int, Any]]:
+        np = self.np
+        n = model.items
+        width = min(n, state.MaxConcurrency or n)
+
+        def attempt(active: Any) -> List[Any]:
+            if not n:
+                return []
+            r = self.run(state.Iterator, len(active) * n)
+            # the items run in waves of MaxConcurrency, each as long as its slowest item
+            waves = -(-n // width)
+            d = np.zeros((len(active), waves * width))
+            d[:, :n] = r.duration.reshape(len(active), n)
+            runs.duration[active] += d.reshape(len(active), waves, width).max(axis=2).sum(axis=1)
+            runs.transitions[active] += r.transitions.reshape(len(active), n).sum(axis=1)
+            return self._branch_errors(r.failed.reshape(len(active), n), r.duration.reshape(len(active), n),
+                                       r.error.reshape(len(active), n))
+        return self._retrying(machine, state, last, ids, runs, attempt)
+
+    def _retrying(self, machine: StateMachine, state: State, last: bool, ids: Any, runs: _Runs,
+                  attempt: Callable[[Any], List[Tuple[Optional[str], Any]]]) -> List[Tuple[int, Any]]:
+        """
+        Makes attempts for the runs in ids until they succeed or the state's Retriers give up. attempt adds the
+        time an attempt takes to the runs it is given and returns pairs of an error and which of them failed
+        with it.
+        """
+        np = self.np
+        retry = getattr(state, 'Retry', None) or []
+        # for each error the Retrier handling it, with its attempts, interval and backoff rate
+        retriers: Dict[Optional[str], Any] = {}
+
+        def retrier(e: Optional[str]) -> Any:
+            if e not in retriers:
+                r = next((r for r in retry if error_matches(e, r.ErrorEquals)), None)
+                retriers[e] = None if r is None else (
+                    id(r),
+                    r.MaxAttempts if r.MaxAttempts is not None else RETRY_MAX_ATTEMPTS,
+                    r.IntervalSeconds if r.IntervalSeconds is not None else RETRY_INTERVAL_SECONDS,
+                    r.BackoffRate if r.BackoffRate is not None else RETRY_BACKOFF_RATE)
+            return retriers[e]
+        counters: Dict[int, Any] = {}
+        active = ids
+        succeeded = []
+        failed_with: Dict[Optional[str], List[Any]] = {}
+        while len(active):
+            kinds = attempt(active)
+            ok = np.ones(len(active), dtype=bool)
+            retrying = []
+            for e, mask in kinds:
+                ok &= ~mask
+                if not mask.any():
+                    continue
+                hit = active[mask]
+                handler = retrier(e)
+                if handler is None:
+                    failed_with.setdefault(e, []).append(hit)
+                    continue
+                key, max_attempts, interval, rate = handler
+                count = counters.setdefault(key, np.zeros(len(runs.duration), dtype=np.int64))
+                again = count[hit] < max_attempts
+                failed_with.setdefault(e, []).append(hit[~again])
+                hit = hit[again]
+                runs.duration[hit] += interval * rate ** count[hit]
+                count[hit] += 1
+                runs.transitions[hit] += 1
+                retrying.append(hit)
+            succeeded.append(active[ok])
+            active = np.concatenate(retrying) if retrying else active[:0]
+        for count in counters.values():
+            count[ids] = 0
+
+        out = self._next(machine, state, last, np.concatenate(succeeded))
+        for e, hits in failed_with.items():
+            out += self._catch(machine, state, e, np.concatenate(hits), runs)
+        return out
+
+
+def simulate(machine: StateMachine,
+             models: Mapping[str, StateModel] = None,
+             runs: int = DEFAULT_RUNS,
+             seed: Optional[int] = None,
+             price_per_transition: float = PRICE_PER_TRANSITION,
+             max_transitions: int = DEFAULT_MAX_TRANSITIONS) -> Simulation:
+    """
+    Simulates runs executions of a built machine. models maps state names, including those in Parallel
+    branches and Map iterators, to StateModels; states without one never fail and take no time other than
+    their Wait seconds.
+    Each state entered and each retry counts as one transition.
+    """
+    np = _numpy()
+    sim = _Simulator(np, np.random.default_rng(seed), models or {}, max_transitions)
+    r = sim.run(machine.build(), runs)
+    return Simulation(r.transitions, r.duration, r.failed, r.transitions * price_per_transition, sim.visits)
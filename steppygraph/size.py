@@ -0,0 +1,154 @@
+"""
+Serialized size accounting, to catch machines over the Step Functions definition size limit without rendering them.
+
+Sizes are those of the compact JSON (no indentation, ASCII escaped) a machine renders to, which is what counts
+against the limit once whitespace is stripped. Each state caches its own size until it changes and each machine
+keeps a running total which only re-measures the states changed since the last call.
+"""
+import heapq
+import json
+from typing import Any, List, Tuple, Union
+
+from steppygraph.hashing import rendered_fields
+from steppygraph.machine import StateMachine, TERMINAL_STATES, nested_machines
+from steppygraph.serialize import encode
+from steppygraph.states import State
+
+DEFINITION_SIZE_LIMIT = 1024 * 1024
+
+# the names of the Parallel states and branch indexes leading to a state, then its own name
+StatePath = Tuple[Union[str, int], ...]
+
+_MACHINE_FIELDS = ('TimeoutSeconds', 'End', 'Comment', 'Version')
+_TERMINAL_TYPES = tuple(t.value for t in TERMINAL_STATES)
+# what build() adds to the last state
+_END = len(',"End":true')
+
+
+class DefinitionSizeError(ValueError):
+    pass
+
+
+def _compact(value: Any) -> int:
+    return len(json.dumps(value, separators=(',', ':')))
+
+
+def state_size(state: State) -> int:
+    """
+    Returns the size of a state's JSON object, the branches of Parallel and Map states included
+    """
+    size = state._size
+    if size is None:
+        d = rendered_fields(state)
+        branches = d.pop('Branches', None)
+        iterator = d.pop('Iterator', None)
+        size = _compact(encode(d))
+        if iterator is not None:
+            size += len(',"Iterator":') + machine_size(iterator)
+        if isinstance(branches, list):
+            size += len(',"Branches":[]') + sum(machine_size(b) for b in branches) + max(len(branches) - 1, 0)
+        elif branches is not None:
+            # branches rendered straight to plain values, see steppygraph.fanout
+            size += len(',"Branches":') + _compact(encode(branches))
+        state._size = size
+    return size
+
+
+def entry_size(state: State) -> int:
+    """
+    Returns the size of a state's entry in its machine's States object, "name":{...}
+    """
+    return _compact(state.name()) + 1 + state_size(state)
+
+
+def _end_size(state: State) -> int:
+    return 0 if state.Type in _TERMINAL_TYPES or state.End is True else _END
+
+
+def _base_size(machine: StateMachine, start: Any) -> int:
+    d = {f: getattr(machine, f, None) for f in _MACHINE_FIELDS}
+    d = {f: v for f, v in d.items() if v is not None}
+    if start is not None:
+        d['StartAt'] = start
+    d['States'] = {}
+    return _compact(encode(d))
+
+
+def machine_size(machine: StateMachine) -> int:
+    """
+    Returns the size of the machine's compact JSON as build() would leave it, without rendering it.
+    Only states added or changed since the previous call are measured.
+    """
+    sizes = machine._sizes
+    if sizes is None:
+        sizes = machine._sizes = {}
+        machine._size_total = 0
+        machine._stale_sizes = {id(s): s for s in machine.get_states()}
+    total = machine._size_total
+    for key, s in machine._stale_sizes.items():
+        size = entry_size(s)
+        total += size - sizes.get(key, 0)
+        sizes[key] = size
+    machine._stale_sizes = {}
+    machine._size_total = total
+
+    states = machine.get_states()
+    if not states:
+        return _base_size(machine, None)
+    return _base_size(machine, states[0].name()) + total + len(states) - 1 + _end_size(states[-1])
+
+
+def check_budget(machine: StateMachine, budget: int, adding: State = None) -> int:
+    """
+    Raises DefinitionSizeError if the machine, with adding appended, is larger than budget. Returns the size.
+    """
+    size = machine_size(machine)
+    if adding is not None:
+        states = machine.get_states()
+        if states:
+            size += 1 - _end_size(states[-1])
+        else:
+            size += _base_size(machine, adding.name()) - _base_size(machine, None)
+        size += entry_size(adding) + _end_size(adding)
+    if size > budget:
+        what = f"adding state '{adding.name()}'" if adding is not None else "the machine"
+        raise DefinitionSizeError(f"Definition size budget exceeded by {what}: {size} > {budget} bytes")
+    return size
+
+
+class Contributor:
+    """
+    A part of a machine and its serialized size. kind is 'state', 'branch' or 'parameters'.
+    """
+    __slots__ = ('kind', 'path', 'size')
+
+    def __init__(self, kind: str, path: StatePath, size: int) -> None:
+        self.kind = kind
+        self.path = path
+        self.size = size
+
+    def __repr__(self) -> str:
+        return f"Contributor({self.kind}, {self.path}, {self.size})"
+
+
+def _contributors(machine: StateMachine, path: StatePath, out: List[Contributor]) -> None:
+    machine_size(machine)
+    for s in machine.get_states():
+        where = path + (s.name(),)
+        out.append(Contributor('state', where, entry_size(s)))
+        params = getattr(s, 'Parameters', None)
+        if params is not None:
+            out.append(Contributor('parameters', where, _compact(encode(params))))
+        for i, b in enumerate(nested_machines(s)):
+            out.append(Contributor('branch', where + (i,), machine_size(b)))
+            _contributors(b, where + (i,), out)
+
+
+def size_report(machine: StateMachine, top: int = 10) -> List[Contributor]:
+    """
+    Returns the largest states, Parallel branches and Parameters objects of a machine and its branches,
+    biggest first. Nested parts are also counted in the states and branches containing them.
+    """
+    out: List[Contributor] = []
+    _contributors(machine, (), out)
+    return heapq.nlargest(top, out, key=lambda c: c.size)
@@ -1,17 +1,24 @@
 import json
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, IO, Iterator, Union
 
 from enum import Enum
 
-from steppygraph.serialize import to_serializable
-from steppygraph.utils import filter_props
+from steppygraph.serialize import to_serializable, iter_json, dump, dumps, props, JSON_INDENT, Profile, PRETTY, \
+    Separators, get_profile
 
 ERROR_MAX_ATTEMPTS_DEFAULT = 2
 ERROR_BACKOFF_RATE_DEFAULT = 1.5
 ERROR_INTERVAL_S_DEFAULT = 60
-JSON_INDENT = 4
 DEFAULT_TASK_TIMEOUT = 600
+# stands for a task timeout left to the default of the machine's workflow type, DEFAULT_TASK_TIMEOUT until the task
+# is added to an Express machine, see StateMachine.set_resource_attrs
+DEFAULT_TIMEOUT: Any = object()
 DEFAULT_WAIT_PERIOD = 60
+# the longest an Express workflow execution may run
+EXPRESS_MAX_DURATION = 300
+
+# fields shared by every state, in the order they are emitted when keys are not sorted
+STATE_FIELDS = ('Type', 'End', 'Comment', 'InputPath', 'OutputPath')
 
 
 class ErrorType(Enum):
@@ -33,6 +40,7 @@ class StateType(Enum):
     WAIT = 'Wait'
     CHOICE = 'Choice'
     PARALLEL = 'Parallel'
+    MAP = 'Map'
     SUCCEED = 'Succeed'
     FAIL = 'Fail'
 
@@ -40,11 +48,20 @@ class StateType(Enum):
         return self.value
 
 
+class WorkflowType(Enum):
+    STANDARD = 'STANDARD'
+    EXPRESS = 'EXPRESS'
+
+    def __str__(self):
+        return self.value
+
+
 class ResourceType(Enum):
     LAMBDA = 'lambda'
     ACTIVITY = 'activity'
     BATCH = 'batch'
     ECS = 'ecs'
+    EXECUTION = 'execution'
 
     def __str__(self):
         return self.value
@@ -84,25 +101,41 @@ class LogicalOperatorType(Enum):
 
 
 class Resource:
+    """
+    sync selects the integration pattern of Batch, ECS and execution resources: run the job and wait for it,
+    or only start it, which is all Express workflows support. Machines set it for their workflow type.
+    """
+    __slots__ = ('resource_type', 'name', 'region', 'aws_ac', 'sync')
+
     def __init__(self,
                  name: str,
                  type: ResourceType,
                  region: str = '',
-                 aws_ac: str = '') -> None:
+                 aws_ac: str = '',
+                 sync: bool = True) -> None:
         self.resource_type = type
         self.name = name
         self.region = region
         self.aws_ac = aws_ac
+        self.sync = sync
 
     def __str__(self) -> str:
+        return self.arn(self.region, self.aws_ac)
+
+    def arn(self, region: str, aws_ac: str) -> str:
+        """
+        Returns the ARN of this resource in another region and account
+        """
         if self.resource_type == ResourceType.LAMBDA:
-            return f"arn:aws:lambda:{self.region}:{self.aws_ac}:function:{self.name}"
+            return f"arn:aws:lambda:{region}:{aws_ac}:function:{self.name}"
         elif self.resource_type == ResourceType.BATCH:
-            return f"arn:aws:states:{self.region}:{self.aws_ac}:batch:submitJob.sync"
+            return f"arn:aws:states:{region}:{aws_ac}:batch:submitJob" + ('.sync' if self.sync else '')
         elif self.resource_type == ResourceType.ECS:
-            return f"arn:aws:states:{self.region}:{self.aws_ac}:ecs:runTask.sync"
+            return f"arn:aws:states:{region}:{aws_ac}:ecs:runTask" + ('.sync' if self.sync else '')
+        elif self.resource_type == ResourceType.EXECUTION:
+            return f"arn:aws:states:{region}:{aws_ac}:states:startExecution" + ('.sync:2' if self.sync else '')
         else:
-            return f"arn:aws:states:{self.region}:{self.aws_ac}:activity:{self.name}"
+            return f"arn:aws:states:{region}:{aws_ac}:activity:{self.name}"
 
 
 @to_serializable.register(Resource)
@@ -111,11 +144,70 @@ def resource_to_json(val) -> str:
     return str(val)
 
 
+class OptionalField:
+    """
+    A public attribute which is None most of the time. Values are kept in the instance's _extra dict,
+    which is only allocated once one of these fields is set, so unset fields cost no memory.
+    """
+    __slots__ = ('name',)
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+
+    def __get__(self, obj: Any, owner: type = None) -> Any:
+        if obj is None:
+            return self
+        extra = obj._extra
+        return extra.get(self.name) if extra else None
+
+    def __set__(self, obj: Any, value: Any) -> None:
+        _set_extra(obj, self.name, value)
+
+    def __delete__(self, obj: Any) -> None:
+        _set_extra(obj, self.name, None)
+
+
+def _set_extra(obj: Any, name: str, value: Any) -> None:
+    extra = obj._extra
+    if value is None:
+        if extra:
+            extra.pop(name, None)
+    elif extra is None:
+        obj._extra = {name: value}
+    else:
+        extra[name] = value
+
+
 class State:
+    """
+    Public fields a state class does not declare can still be set, for ASL fields the model does not know yet.
+    They are kept in _extra like optional fields and rendered after the declared ones.
+    """
+    __slots__ = ('Type', 'Next', '_name', '_next', '_autoconnect', '_dirty', '_fragment', '_digest', '_size',
+                 '_owners', '_extra')
+    _json_fields = STATE_FIELDS + ('Next',)
+    _json_build = True
+    _json_extras = True
+    _nested = False
+    # whether build() copies the Next set through set_next into the Next field
+    _builds_next = True
+
+    End = OptionalField()
+    Comment = OptionalField()
+    InputPath = OptionalField()
+    OutputPath = OptionalField()
+
     def __init__(self,
                  name: str,
                  type: StateType,
                  comment: str = None) -> None:
+        # a state is dirty until built, and again whenever a public attribute or Next changes
+        self._dirty = True
+        self._fragment: Optional[dict] = None
+        self._digest: Optional[bytes] = None
+        self._size: Optional[int] = None
+        self._owners: Any = ()
+        self._extra: Optional[Dict[str, Any]] = None
         self.Type = type.value
         self.End: Optional[bool] = None
         self.Comment = comment
@@ -125,19 +217,100 @@ class State:
         self._next: Optional[str] = None
         self._autoconnect = False
 
+    def __copy__(self) -> 'State':
+        """
+        Copies the state's fields. The copy does not belong to any machine and has its own optional fields.
+        """
+        other = self.__class__.__new__(self.__class__)
+        self._copy_slots(other)
+        other._dirty = True
+        other._fragment = None
+        other._digest = None
+        other._size = None
+        other._owners = ()
+        other._extra = dict(self._extra) if self._extra else None
+        return other
+
+    def _copy_slots(self, other: 'State') -> None:
+        for cls in type(self).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(self, slot):
+                    object.__setattr__(other, slot, object.__getattribute__(self, slot))
+
+    def __setstate__(self, state: Any) -> None:
+        if isinstance(state, tuple):
+            state = state[1]
+        for k, v in state.items():
+            object.__setattr__(self, k, v)
+
+    def __setattr__(self, key: str, value: Any) -> None:
+        try:
+            object.__setattr__(self, key, value)
+        except AttributeError:
+            if key[0] == '_' or hasattr(type(self), key):
+                raise
+            _set_extra(self, key, value)
+        # a dirty state nobody owns has nothing cached to drop, which is the common case while constructing it
+        if key[0] != '_' and (self._owners or not self._dirty or self._fragment is not None
+                              or self._digest is not None or self._size is not None):
+            self.mark_dirty()
+
+    def __getattr__(self, key: str) -> Any:
+        # only reached for names that are neither slots nor declared, see __setattr__
+        if key[0] != '_':
+            extra = self._extra
+            if extra and key in extra:
+                return extra[key]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{key}'")
+
+    def __delattr__(self, key: str) -> None:
+        try:
+            object.__delattr__(self, key)
+        except AttributeError:
+            if key[0] == '_' or not self._extra or key not in self._extra:
+                raise
+            del self._extra[key]
+        if key[0] != '_':
+            self.mark_dirty()
+
+    def mark_dirty(self) -> None:
+        """
+        Drops the cached fragment, digest and size, and tells the owning machines that this state needs rebuilding
+        """
+        self._fragment = None
+        self._digest = None
+        self._size = None
+        for m in self._owners:
+            m.state_touched(self)
+        if not self._dirty:
+            self._dirty = True
+            for m in self._owners:
+                m.state_changed(self)
+
+    def add_owner(self, owner: Any) -> None:
+        if owner not in self._owners:
+            self._owners = self._owners + (owner,)
+
     def name(self) -> str:
         return self._name
 
     def build(self):
-        if self._next:
-            self.Next = self._next
+        if self._dirty:
+            if self._next:
+                self.Next = self._next
+            self._dirty = False
         return self
 
-    def to_json(self):
-        return json.dumps(self,
-                          default=to_serializable,
-                          sort_keys=True,
-                          indent=JSON_INDENT)
+    def to_json(self, profile: Union[str, Profile] = PRETTY) -> str:
+        return dumps(self, **get_profile(profile).options())
+
+    def iter_json(self, sort_keys: bool = True, indent: Optional[Union[int, str]] = JSON_INDENT,
+                  separators: Separators = None) -> Iterator[str]:
+        return iter_json(self, sort_keys=sort_keys, indent=indent, separators=separators)
+
+    def dump(self, fp: IO[str], sort_keys: bool = True, indent: Optional[Union[int, str]] = JSON_INDENT,
+             separators: Separators = None) -> None:
+        dump(self, fp, sort_keys=sort_keys, indent=indent, separators=separators)
 
     def set_next(self, next: str):
         """
@@ -149,18 +322,54 @@ class State:
 
         if self._next is None:
             self._next = next
+            self.mark_dirty()
 
     def get_next(self) -> Optional[str]:
         return self._next
 
 
+def state_props(val: State) -> dict:
+    """
+    Returns the public properties of a state, reusing the cached fragment until the state changes
+    """
+    if val._fragment is None:
+        val._fragment = props(val)
+    return val._fragment
+
+
+# slots holding caches and bookkeeping rather than the state's own fields
+_CACHE_SLOTS = ('_dirty', '_fragment', '_digest', '_size', '_owners', '_extra')
+
+
+def state_vars(val: State) -> Dict[str, Any]:
+    """
+    Returns all the fields of a state, private ones and those which are None included, for debugging
+    """
+    d: Dict[str, Any] = {}
+    for cls in reversed(type(val).__mro__):
+        for k, v in vars(cls).items():
+            if isinstance(v, OptionalField):
+                d[k] = v.__get__(val)
+        for slot in vars(cls).get('__slots__', ()):
+            if slot not in _CACHE_SLOTS and slot != 'Next' and hasattr(val, slot):
+                d[slot] = getattr(val, slot)
+    if hasattr(val, 'Next'):
+        d['Next'] = val.Next
+    for k, v in (val._extra or {}).items():
+        d.setdefault(k, v)
+    return d
+
+
 @to_serializable.register(State)
 def state_to_json(val: State) -> dict:
-    # val.Type = val.Type.value
-    return filter_props(val.build().__dict__)
+    return state_props(val.build())
 
 
 class Catcher:
+    __slots__ = ('ErrorEquals', 'Next', '_next')
+    _json_fields = ('ErrorEquals', 'Next')
+    _json_build = True
+
     def __init__(self, error_equals: List[ErrorType], next: State) -> None:
         self.ErrorEquals = error_equals
         self._next = next
@@ -172,10 +381,13 @@ class Catcher:
 
 @to_serializable.register(Catcher)
 def catcher_to_json(val: Catcher) -> dict:
-    return filter_props(val.build().__dict__)
+    return props(val.build())
 
 
 class Retrier:
+    __slots__ = ('BackoffRate', 'MaxAttempts', 'IntervalSeconds', 'ErrorEquals')
+    _json_fields = ('BackoffRate', 'MaxAttempts', 'IntervalSeconds', 'ErrorEquals')
+
     def __init__(self,
                  max_attempts=ERROR_MAX_ATTEMPTS_DEFAULT,
                  backoff_rate=ERROR_BACKOFF_RATE_DEFAULT,
@@ -189,18 +401,27 @@ class Retrier:
 
 @to_serializable.register(Retrier)
 def retrier_to_json(val: Retrier) -> dict:
-    d = val.__dict__
-    return d
+    return props(val)
 
 
 class Task(State):
+    __slots__ = ('Resource', 'TimeoutSeconds', '_timeout_defaulted')
+    _json_fields = STATE_FIELDS + ('Resource', 'ResultPath', 'Retry', 'Catch', 'TimeoutSeconds', 'HeartbeatSeconds',
+                                   'Parameters', 'Next')
+
+    ResultPath = OptionalField()
+    Retry = OptionalField()
+    Catch = OptionalField()
+    HeartbeatSeconds = OptionalField()
+    Parameters = OptionalField()
+
     def __init__(self,
                  name: str,
                  resource: Resource = None,
                  comment: str = None,
                  retry: List[Retrier] = None,
                  catch: List[Catcher] = None,
-                 timeout_seconds: int = DEFAULT_TASK_TIMEOUT
+                 timeout_seconds: Optional[int] = DEFAULT_TIMEOUT
                  ) -> None:
         State.__init__(self, type=StateType.TASK, name=name, comment=comment)
         if not isinstance(resource, Resource):
@@ -210,11 +431,20 @@ class Task(State):
         self.ResultPath = None
         self.Retry = retry
         self.Catch = catch
-        self.TimeoutSeconds = timeout_seconds
+        self.TimeoutSeconds = DEFAULT_TASK_TIMEOUT if timeout_seconds is DEFAULT_TIMEOUT else timeout_seconds
+        # whether TimeoutSeconds is still the default, which the workflow type of the machine may replace
+        self._timeout_defaulted = timeout_seconds is DEFAULT_TIMEOUT
         self.HeartbeatSeconds = None
 
+    def __setattr__(self, key: str, value: Any) -> None:
+        State.__setattr__(self, key, value)
+        if key == 'TimeoutSeconds':
+            object.__setattr__(self, '_timeout_defaulted', False)
+
 
 class ContainerOverrides:
+    _json_fields = ('Command', 'Environment', 'InstanceType', 'Memory', 'ResourceRequirements', 'Vcpus')
+
     def __init__(self,
                  command: Optional[str] = None,
                  environment: Optional[str] = None,
@@ -244,10 +474,12 @@ class ContainerOverrides:
 
 @to_serializable.register(ContainerOverrides)
 def containeroverrides_to_json(val: ContainerOverrides) -> dict:
-    return filter_props(val.__dict__)
+    return props(val)
 
 
 class BatchJob(Task):
+    __slots__ = ()
+
     def __init__(self,
                  name: str,
                  definition: str,
@@ -256,7 +488,7 @@ class BatchJob(Task):
                  comment: str = None,
                  retry: List[Retrier] = None,
                  catch: List[Catcher] = None,
-                 timeout_seconds: int = DEFAULT_TASK_TIMEOUT,
+                 timeout_seconds: Optional[int] = DEFAULT_TIMEOUT,
                  container_overrides: Optional[ContainerOverrides] = None
                  ) -> None:
         Task.__init__(self,
@@ -279,12 +511,9 @@ class BatchJob(Task):
             self.Parameters["Parameters.$"] = parameters
 
 
-@to_serializable.register(BatchJob)
-def batchjob_to_json(val: BatchJob) -> dict:
-    return filter_props(val.__dict__)
-
-
 class EcsTask(Task):
+    __slots__ = ()
+
     def __init__(self,
                  name: str,
                  cluster: str,
@@ -295,7 +524,7 @@ class EcsTask(Task):
                  comment: str = None,
                  retry: List[Retrier] = None,
                  catch: List[Catcher] = None,
-                 timeout_seconds: int = DEFAULT_TASK_TIMEOUT
+                 timeout_seconds: Optional[int] = DEFAULT_TIMEOUT
                  ) -> None:
         Task.__init__(self,
                       name=name,
@@ -313,7 +542,42 @@ class EcsTask(Task):
         }
 
 
+class StartExecution(Task):
+    """
+    Runs another state machine and waits for it. The state's output is the child execution's output.
+    """
+    __slots__ = ()
+
+    def __init__(self,
+                 name: str,
+                 state_machine_arn: str,
+                 comment: str = None,
+                 retry: List[Retrier] = None,
+                 catch: List[Catcher] = None,
+                 timeout_seconds: Optional[int] = DEFAULT_TIMEOUT
+                 ) -> None:
+        Task.__init__(self,
+                      name=name,
+                      resource=Resource(name=name, type=ResourceType.EXECUTION),
+                      comment=comment,
+                      retry=retry,
+                      catch=catch,
+                      timeout_seconds=timeout_seconds)
+        self.Parameters = {
+            "StateMachineArn": state_machine_arn,
+            "Input.$": "$"
+        }
+        self.OutputPath = "$.Output"
+
+
 class Pass(State):
+    __slots__ = ()
+    _json_fields = STATE_FIELDS + ('Parameters', 'ResultPath', 'Result', 'Next')
+
+    Parameters = OptionalField()
+    ResultPath = OptionalField()
+    Result = OptionalField()
+
     def __init__(self,
                  name: str,
                  result: dict = None,
@@ -326,6 +590,13 @@ class Pass(State):
 
 
 class Wait(State):
+    __slots__ = ('Seconds',)
+    _json_fields = STATE_FIELDS + ('Seconds', 'SecondsPath', 'Timestamp', 'TimestampPath', 'Next')
+
+    SecondsPath = OptionalField()
+    Timestamp = OptionalField()
+    TimestampPath = OptionalField()
+
     def __init__(self,
                  name: str,
                  seconds: int = DEFAULT_TASK_TIMEOUT,
@@ -336,6 +607,8 @@ class Wait(State):
 
 
 class Comparison:
+    __slots__ = ('_comparison_type', '_value')
+
     def __init__(self, comparison_type: ComparisonType, value: object) -> None:
         self._comparison_type = comparison_type
         self._value = value
@@ -348,6 +621,8 @@ class Comparison:
 
 
 class ChoiceCase:
+    __slots__ = ('Variable', 'Next', '_comparison')
+
     def __init__(self,
                  variable: str,
                  comparison: Comparison,
@@ -359,12 +634,13 @@ class ChoiceCase:
 
 @to_serializable.register(ChoiceCase)
 def choicecase_to_json(val: ChoiceCase) -> dict:
-    d = val.__dict__
-    d[val._comparison.type()] = val._comparison.value()
-    return filter_props(d)
+    return {'Variable': val.Variable, 'Next': val.Next, val._comparison.type(): val._comparison.value()}
 
 
 class Choice(State):
+    __slots__ = ('Choices', 'Default')
+    _json_fields = STATE_FIELDS + ('Choices', 'Default', 'Next')
+
     def __init__(self,
                  name: str,
                  choices: List[ChoiceCase],
@@ -377,22 +653,17 @@ class Choice(State):
 
 
 class Succeed(State):
+    __slots__ = ()
+
     def __init__(self, name: str) -> None:
         State.__init__(self, type=StateType.SUCCEED, name=name)
 
 
-@to_serializable.register(Succeed)
-def succeed_to_json(val: Succeed) -> dict:
-    return filter_props(val.__dict__)
-
-
 class Fail(State):
+    __slots__ = ('Cause', 'Error')
+    _json_fields = STATE_FIELDS + ('Cause', 'Error', 'Next')
+
     def __init__(self, name: str, cause: str = "", error: str = "") -> None:
         State.__init__(self, type=StateType.FAIL, name=name)
         self.Cause = cause
         self.Error = error
-
-
-@to_serializable.register(Fail)
-def fail_to_json(val: Fail) -> dict:
-    return filter_props(val.__dict__)
@@ -0,0 +1,72 @@
+"""
+Renders one machine for many regions and accounts. The machine is serialized once with markers where the region
+and account of each task's resource go, and every variant is then a join of the text between the markers with
+the values substituted, without building the machine or touching its resources again.
+
+Only task Resource ARNs are substituted. Values held in other fields, such as the StateMachineArn parameter of
+StartExecution, are rendered as they are.
+"""
+import json
+import re
+import uuid
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+from steppygraph.machine import StateMachine, nested_machines
+from steppygraph.serialize import Profile, PRETTY, dumps, encode, get_profile
+from steppygraph.states import Task
+
+REGION = 'region'
+ACCOUNT = 'account'
+
+
+class Template:
+    """
+    A machine's JSON split at the region and account of its task resources. fragments has one more item than
+    slots, slot i, REGION or ACCOUNT, goes between fragments i and i + 1.
+    """
+    __slots__ = ('fragments', 'slots')
+
+    def __init__(self, fragments: List[str], slots: List[str]) -> None:
+        self.fragments = fragments
+        self.slots = slots
+
+    def render(self, region: str, account: str) -> str:
+        values = {REGION: json.dumps(str(region))[1:-1], ACCOUNT: json.dumps(str(account))[1:-1]}
+        fragments = self.fragments
+        parts = [fragments[0]]
+        for i, slot in enumerate(self.slots, 1):
+            parts.append(values[slot])
+            parts.append(fragments[i])
+        return ''.join(parts)
+
+    def render_all(self, targets: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+        """
+        Renders the machine for each (region, account) pair
+        """
+        return {(region, account): self.render(region, account) for region, account in targets}
+
+
+def _mark(machine: StateMachine, doc: Dict[str, Any], region: str, account: str) -> None:
+    states = doc.get('States', {})
+    for s in machine.get_states():
+        d = states[s.name()]
+        if isinstance(s, Task) and s.Resource is not None:
+            d['Resource'] = s.Resource.arn(region, account)
+        nested = [d['Iterator']] if 'Iterator' in d else d.get('Branches', [])
+        for b, bd in zip(nested_machines(s), nested):
+            _mark(b, bd, region, account)
+
+
+def compile_template(machine: StateMachine, profile: Union[str, Profile] = PRETTY) -> Template:
+    """
+    Renders the machine once with the given output profile, see StateMachine.to_json, leaving the region and
+    account of its task resources open. The machine is built but its resources are not changed.
+    """
+    # the markers are made of characters JSON leaves as they are and cannot clash with the machine's own text
+    token = uuid.uuid4().hex
+    markers = {f"{token}r": REGION, f"{token}a": ACCOUNT}
+    doc = encode(machine.build())
+    _mark(machine, doc, f"{token}r", f"{token}a")
+    text = dumps(doc, **get_profile(profile).options())
+    pieces = re.split(f"({token}[ra])", text)
+    return Template(pieces[0::2], [markers[m] for m in pieces[1::2]])
@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from steppygraph.batch import render_many
+from steppygraph.machine import StateMachine
+from steppygraph.states import Pass
+
+
+def make_machine(n: int) -> StateMachine:
+    s = StateMachine()
+    for i in range(n):
+        s.next(Pass(f"pass-{i}"))
+    return s
+
+
+def broken() -> StateMachine:
+    raise RuntimeError("factory failed")
+
+
+def test_render_many_in_order():
+    sources = [make_machine(3), partial(make_machine, 2), broken, partial(make_machine, 1)]
+    results = list(render_many(sources, workers=2))
+    assert [r.index for r in results] == [0, 1, 2, 3]
+    assert results[0].json == make_machine(3).build().to_json()
+    assert results[1].json == make_machine(2).build().to_json()
+    assert not results[2].ok and "factory failed" in results[2].error
+    assert results[3].ok
+
+
+def test_render_many_as_completed():
+    sources = [partial(make_machine, i) for i in range(1, 20)]
+    results = list(render_many(sources, ordered=False, chunk_size=3, executor=ThreadPoolExecutor(2)))
+    assert sorted(r.index for r in results) == list(range(19))
+    assert all(r.ok for r in results)
+
+
+def test_unpicklable_source_is_reported():
+    results = list(render_many([lambda: make_machine(1), partial(make_machine, 1)], workers=1))
+    assert not results[0].ok
+    assert results[1].ok
+
+
+def test_render_many_with_profile():
+    results = list(render_many([make_machine(2)], executor=ThreadPoolExecutor(1), profile="compact"))
+    assert results[0].json == make_machine(2).build().to_json(profile="compact")
+    results = list(render_many([make_machine(2)], executor=ThreadPoolExecutor(1), indent=None,
+                               separators=(',', ':')))
+    assert "\n" not in results[0].json and ", " not in results[0].json
+
+
+class BreakingExecutor(ThreadPoolExecutor):
+    """
+    Fails to take more work after its first submission, as a process pool does once a worker dies
+    """
+
+    def __init__(self) -> None:
+        super().__init__(1)
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        if self.submitted > 1:
+            raise BrokenProcessPool("a worker died")
+        return super().submit(*args, **kwargs)
+
+
+def test_broken_pool_is_reported_per_machine():
+    for ordered in (True, False):
+        results = list(render_many([make_machine(1) for _ in range(3)], ordered=ordered,
+                                   executor=BreakingExecutor()))
+        assert sorted(r.index for r in results) == [0, 1, 2]
+        assert [r.ok for r in sorted(results, key=lambda r: r.index)] == [True, False, False]
+        assert all("a worker died" in r.error for r in results if not r.ok)
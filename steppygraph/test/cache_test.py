@@ -0,0 +1,89 @@
+from steppygraph.cache import DefinitionCache
+from steppygraph.hashing import machine_hash
+from steppygraph.machine import StateMachine, Branch, Parallel
+from steppygraph.states import Task, Resource, ResourceType, Pass, Retrier, Catcher, ErrorType
+
+
+def make_machine(region: str = 'eu-west-1', retries: int = 3) -> StateMachine:
+    s = StateMachine(region=region, account='123456789012')
+    handler = Pass("handler")
+    t = Task("t", resource=Resource("fn", type=ResourceType.LAMBDA), retry=[Retrier(max_attempts=retries)])
+    t.Catch = [Catcher([ErrorType.ALL], next=handler)]
+    s.next(t)
+    b = Branch()
+    b.next(Pass("inner"))
+    s.next(Parallel("p", branches=[b]))
+    s.add_state(handler)
+    return s
+
+
+def test_hash_is_stable_and_structural():
+    m = make_machine()
+    h = machine_hash(m)
+    assert machine_hash(make_machine()) == h
+    m.build()
+    assert machine_hash(m) == h
+    assert machine_hash(make_machine(region='us-east-1')) != h
+    assert machine_hash(make_machine(retries=1)) != h
+
+
+def test_hash_follows_changes():
+    m = make_machine()
+    h = machine_hash(m)
+    m.get_states()[0].Comment = "changed"
+    assert machine_hash(m) != h
+
+    m = make_machine()
+    h = machine_hash(m)
+    m.get_states()[1].Branches[0].get_states()[0].Comment = "changed in branch"
+    assert machine_hash(m) != h
+
+
+def test_cache_hit_skips_build(tmp_path):
+    cache = DefinitionCache(str(tmp_path))
+    text = cache.render(make_machine())
+    m = make_machine()
+    assert cache.render(m) == text
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert m.States == {}
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    first = make_machine(retries=1)
+    cache = DefinitionCache(str(tmp_path))
+    size = len(cache.render(first).encode())
+    cache = DefinitionCache(str(tmp_path), max_bytes=size * 2 + size // 2)
+    cache.render(make_machine(retries=2))
+    cache.render(make_machine(retries=3))
+    assert cache.get(cache.key(first)) is None
+    assert cache.get(cache.key(make_machine(retries=3))) is not None
+    assert cache.size() <= cache.max_bytes
+
+
+def test_cache_misses_after_in_place_changes(tmp_path):
+    cache = DefinitionCache(str(tmp_path))
+    m = make_machine()
+    text = cache.render(m)
+    m.get_states()[0].Retry[0].MaxAttempts = 9
+    changed = cache.render(m)
+    assert changed != text
+    assert '"MaxAttempts": 9' in changed
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    m = StateMachine(region='eu-west-1', account='123456789012')
+    job = Task("job", resource=Resource("submit", type=ResourceType.BATCH))
+    job.Parameters = {"JobQueue": "default", "JobName": "n"}
+    m.next(job)
+    cache.render(m)
+    job.Parameters['JobQueue'] = 'other'
+    assert '"JobQueue": "other"' in cache.render(m)
+
+
+def test_cache_keys_include_output_options(tmp_path):
+    cache = DefinitionCache(str(tmp_path))
+    pretty = cache.render(make_machine(), profile="pretty")
+    compact = cache.render(make_machine(), profile="compact")
+    assert pretty != compact
+    assert "\n" not in compact
+    assert cache.render(make_machine(), sort_keys=False, indent=None, separators=(',', ':')) == compact
+    assert cache.key(make_machine(), indent=None) != cache.key(make_machine(), indent=None, separators=(',', ':'))
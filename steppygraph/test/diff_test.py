@@ -0,0 +1,54 @@
+from steppygraph.diff import diff
+from steppygraph.machine import StateMachine, Branch, Parallel
+from steppygraph.states import Task, Resource, ResourceType, Pass, Choice, ChoiceCase, Comparison, \
+    ComparisonType, Catcher, ErrorType
+
+
+def make_machine(timeout: int = 60, inner: str = "inner") -> StateMachine:
+    s = StateMachine(region='eu-west-1', account='123456789012')
+    handler = Pass("handler")
+    t = Task("t", resource=Resource("fn", type=ResourceType.LAMBDA), timeout_seconds=timeout)
+    t.Catch = [Catcher([ErrorType.ALL], next=handler)]
+    s.next(t)
+    b = Branch()
+    b.next(Pass(inner))
+    s.next(Parallel("p", branches=[b, Branch()]))
+    s.next(Choice("c", [ChoiceCase("$.x", Comparison(ComparisonType.NUMERIC_EQ, 1), next=handler)], default=handler))
+    s.add_state(handler)
+    return s
+
+
+def test_identical_machines():
+    a = make_machine()
+    assert not diff(a, make_machine())
+    a.build()
+    assert not diff(a, make_machine())
+
+
+def test_modified_fields_and_transitions():
+    a, b = make_machine(), make_machine(timeout=30)
+    other = Pass("other")
+    b.add_state(other)
+    b.get_states()[0].Catch = [Catcher([ErrorType.ALL], next=other)]
+    d = diff(a, b)
+    assert d.added == [("other",)]
+    assert d.removed == []
+    [change] = [c for c in d.modified if c.path == ("t",)]
+    assert change.fields["TimeoutSeconds"] == (60, 30)
+    assert change.transitions == {"Catch": (["handler"], ["other"])}
+    # handler stops being the last state and so loses End
+    assert [c.path for c in d.modified] == [("t",), ("handler",)]
+
+
+def test_changes_inside_branches():
+    a, b = make_machine(), make_machine(inner="renamed")
+    d = diff(a, b)
+    assert d.removed == [("p", 0, "inner")]
+    assert d.added == [("p", 0, "renamed")]
+    assert d.fields == {("p", 0): {"StartAt": ("inner", "renamed")}}
+    assert d.modified == []
+
+    b = make_machine()
+    b.get_states()[1].Branches[1].next(Pass("extra"))
+    d = diff(a, b)
+    assert d.added == [("p", 1, "extra")]
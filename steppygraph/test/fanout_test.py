@@ -0,0 +1,133 @@
+import json
+import warnings
+
+import pytest
+
+from steppygraph.fanout import FanOut, param
+from steppygraph.hashing import machine_hash
+from steppygraph.local import LocalRunner
+from steppygraph.machine import StateMachine, Branch, Parallel
+from steppygraph.serialize import to_serializable
+from steppygraph.states import Task, Resource, ResourceType, Pass, WorkflowType
+from steppygraph.validate import validate
+
+ROWS = [{"shard": i, "fn": f"fn-{i}"} for i in range(3)]
+
+
+def branch(shard, fn) -> Branch:
+    b = Branch(region="eu-west-1", account="1")
+    t = Task(f"process-{shard}", resource=Resource(fn, type=ResourceType.LAMBDA))
+    t.Parameters = {"shard": shard, "static": {"a": [1, 2]}}
+    b.next(t)
+    b.next(Pass(f"done-{shard}"))
+    return b
+
+
+def machine(parallel) -> StateMachine:
+    s = StateMachine()
+    s.next(parallel)
+    s.next(Pass("after"))
+    return s
+
+
+def fan_out() -> FanOut:
+    return FanOut("fan", branch(param("shard"), param("fn")), ROWS)
+
+
+def test_renders_like_explicit_branches():
+    expected = machine(Parallel("fan", [branch(r["shard"], r["fn"]) for r in ROWS])).build()
+    s = machine(fan_out()).build()
+    assert s.to_json() == expected.to_json()
+    assert s.to_json('compact') == expected.to_json('compact')
+    assert ''.join(s.iter_json()) == expected.to_json()
+    assert s.size() == len(json.dumps(s, default=to_serializable, separators=(',', ':')))
+
+
+def test_branches_load_for_running_and_validation():
+    s = machine(fan_out())
+    out = LocalRunner(s, {f"fn-{i}": (lambda i: lambda doc: doc["shard"] * 10 + i)(i) for i in range(3)}).run_sync()
+    assert out.output == [0, 11, 22]
+    assert validate(s.build()) == []
+    assert [b.get_states()[0].name() for b in s.get_states()[0].Branches] == ["process-0", "process-1", "process-2"]
+
+
+def test_prototype_changes_reach_every_branch():
+    f = fan_out()
+    s = machine(f)
+    s.to_json()
+    before = machine_hash(s)
+    f.Branches.prototype.get_states()[1].Comment = "changed"
+    assert machine_hash(s) != before
+    assert s.build().to_json().count('"Comment": "changed"') == 3
+
+
+def test_missing_parameter():
+    s = machine(FanOut("fan", branch(param("shard"), param("fn")), [{"shard": 1}]))
+    with pytest.raises(ValueError):
+        s.build().to_json()
+
+
+def test_whole_markers_in_text_fields_become_strings():
+    prototype = Branch(region="eu-west-1", account="1")
+    p = Pass(param("shard"))
+    p.Parameters = {"shard": param("shard")}
+    prototype.next(p)
+    s = machine(FanOut("fan", prototype, [{"shard": 1}, {"shard": 2}]))
+    branches = json.loads(s.build().to_json())["States"]["fan"]["Branches"]
+    assert [b["StartAt"] for b in branches] == ["1", "2"]
+    assert branches[0]["States"]["1"]["Parameters"] == {"shard": 1}
+
+
+def test_loaded_branches_are_kept_until_the_prototype_changes():
+    f = fan_out()
+    first = list(f.Branches)
+    assert all(a is b for a, b in zip(first, f.Branches))
+    assert f.Branches[-1] is first[2]
+    f.Branches.prototype.get_states()[1].Comment = "changed"
+    assert f.Branches[0] is not first[0]
+    assert f.Branches[0].get_states()[1].Comment == "changed"
+
+
+def test_branches_with_optional_fields_validate_and_run():
+    prototype = Branch(region="eu-west-1", account="1")
+    prepare = Pass("prepare")
+    prepare.Parameters = {"shard": param("shard"), "static.$": "$.static"}
+    prepare.ResultPath = "$.job"
+    prototype.next(prepare)
+    t = Task("process", resource=Resource(param("fn"), type=ResourceType.LAMBDA), timeout_seconds=30)
+    t.InputPath = "$.job"
+    t.ResultPath = "$.result"
+    t.OutputPath = "$.result"
+    prototype.next(t)
+    s = machine(FanOut("fan", prototype, ROWS))
+    assert validate(s.build()) == []
+    assert [b.get_states()[1].TimeoutSeconds for b in s.get_states()[0].Branches] == [30, 30, 30]
+    handlers = {f"fn-{i}": (lambda i: lambda doc: doc["shard"] * 10 + i + doc["static"])(i) for i in range(3)}
+    assert LocalRunner(s, handlers).run_sync({"static": 100}).output == [100, 111, 122]
+
+
+def test_express_branches_keep_express_timeouts():
+    prototype = Branch(region="eu-west-1", account="1")
+    prototype.next(Task("process", resource=Resource(param("fn"), type=ResourceType.LAMBDA)))
+    s = StateMachine(workflow_type=WorkflowType.EXPRESS)
+    s.next(FanOut("fan", prototype, ROWS[:2]))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        s.build()
+    branches = s.get_states()[0].Branches
+    assert [b.get_states()[0].TimeoutSeconds for b in branches] == [300, 300]
+    assert all(b.workflow_type == WorkflowType.EXPRESS for b in branches)
+
+
+def test_values_in_strings_read_as_json():
+    prototype = Branch()
+    p = Pass(f"p-{param('flag')}-{param('none')}-{param('n')}")
+    p.Comment = param("flag")
+    prototype.next(p)
+    s = machine(FanOut("fan", prototype, [{"flag": True, "none": None, "n": 1.5}]))
+    branch, = json.loads(s.build().to_json())["States"]["fan"]["Branches"]
+    assert branch["StartAt"] == "p-true-null-1.5"
+    assert branch["States"]["p-true-null-1.5"]["Comment"] == "true"
+    s = machine(FanOut("fan", prototype, [{"flag": [1], "none": None, "n": 1}]))
+    with pytest.raises(ValueError, match="'flag'"):
+        s.build().to_json()
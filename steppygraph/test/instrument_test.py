@@ -0,0 +1,83 @@
+from steppygraph import instrument, serialize
+from steppygraph.instrument import Hook
+from steppygraph.machine import StateMachine, Branch, Parallel
+from steppygraph.states import Task, Resource, ResourceType, Pass
+
+
+def machine() -> StateMachine:
+    s = StateMachine(region="eu-west-1", account="1")
+    s.next(Task("t", resource=Resource("fn", type=ResourceType.LAMBDA)))
+    b = Branch()
+    b.next(Pass("inner"))
+    s.next(Parallel("p", [b]))
+    s.next(Pass("done"))
+    return s
+
+
+class Recorder(Hook):
+    def __init__(self):
+        self.calls = []
+
+    def begin(self, operation, target):
+        self.calls.append(('begin', operation))
+
+    def end(self, operation, target, seconds):
+        self.calls.append(('end', operation))
+
+
+def test_counts_per_operation_and_state_type():
+    instrument.reset()
+    with instrument.enabled():
+        machine().build().to_json()
+    stats = instrument.snapshot()
+    assert stats[('StateMachine.next', None)].count == 4
+    assert stats[('StateMachine.next', 'Pass')].count == 2
+    assert stats[('StateMachine.add_state', 'Task')].count == 1
+    assert stats[('State.build', 'Parallel')].count >= 1
+    assert stats[('to_serializable', 'Resource')].count == 1
+    assert stats[('serialize', 'StateMachine')].count == 1 and stats[('serialize', 'Branch')].count == 1
+    assert stats[('serialize', 'Task')].count == 1 and stats[('serialize', 'Pass')].count == 2
+    assert stats[('serialize', 'Task')].seconds > 0
+    assert stats[('StateMachine.to_json', None)].seconds > 0
+    instrument.reset()
+    assert instrument.snapshot() == {}
+
+
+def test_compact_output_is_timed_per_state_type():
+    instrument.reset()
+    s = machine().build()
+    with instrument.enabled():
+        s.to_json("compact")
+    stats = instrument.snapshot()
+    assert stats[('serialize', 'Task')].count == 1 and stats[('serialize', 'Parallel')].count == 1
+    assert stats[('serialize', None)].seconds >= stats[('serialize', 'StateMachine')].seconds > 0
+    instrument.reset()
+
+
+def test_hooks_nest_and_disable_restores_methods():
+    originals = (StateMachine.next, StateMachine.build, Parallel.build, Pass.build, serialize._encode_obj,
+                 serialize._object_writer)
+    hook = Recorder()
+    instrument.add_hook(hook)
+    try:
+        with instrument.enabled():
+            assert instrument.is_enabled()
+            assert StateMachine.next is not originals[0]
+            s = StateMachine()
+            s.next(Pass("a"))
+            hook.calls.clear()
+            s.next(Pass("b"))
+    finally:
+        instrument.remove_hook(hook)
+    assert (StateMachine.next, StateMachine.build, Parallel.build, Pass.build, serialize._encode_obj,
+            serialize._object_writer) == originals
+    assert not instrument.is_enabled()
+    assert hook.calls == [('begin', 'StateMachine.next'),
+                          ('begin', 'StateMachine.last_orphan'), ('end', 'StateMachine.last_orphan'),
+                          ('begin', 'StateMachine.add_state'),
+                          ('begin', 'StateMachine.set_resource_attrs'), ('end', 'StateMachine.set_resource_attrs'),
+                          ('end', 'StateMachine.add_state'),
+                          ('end', 'StateMachine.next')]
+    instrument.reset()
+    machine().build()
+    assert instrument.snapshot() == {}
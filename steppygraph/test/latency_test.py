@@ -0,0 +1,88 @@
+import math
+
+from steppygraph.latency import analyze
+from steppygraph.machine import StateMachine, Branch, Parallel, Map
+from steppygraph.states import Task, Resource, ResourceType, Pass, Wait, Choice, ChoiceCase, Comparison, \
+    ComparisonType, Retrier, Catcher, ErrorType
+
+
+def task(name: str, timeout: int = 10, **kwargs) -> Task:
+    return Task(name, resource=Resource(name, type=ResourceType.LAMBDA), timeout_seconds=timeout, **kwargs)
+
+
+def test_retries_and_waits_add_up():
+    s = StateMachine()
+    s.next(task("t", retry=[Retrier(max_attempts=2, interval_seconds=1, backoff_rate=2.0)]))
+    s.next(Wait("w", seconds=5))
+    a = analyze(s.build())
+    assert (a.best, a.worst) == (5, 3 * 10 + 1 + 2 + 5)
+    assert [(st.path, st.worst) for st in a.critical_path] == [(('t',), 33), (('w',), 5)]
+    assert analyze(s, durations={"t": (1, 2)}).worst == 3 * 2 + 3 + 5
+
+
+def test_choice_parallel_and_catch():
+    s = StateMachine()
+    slow, fast = Wait("slow", seconds=100), Pass("fast")
+    fallback = Wait("fallback", seconds=50)
+    fast_branch, slow_branch = Branch(), Branch()
+    fast_branch.next(Wait("w3", seconds=3))
+    slow_branch.next(Wait("w7", seconds=7))
+    s.next(Parallel("p", [fast_branch, slow_branch]))
+    s.next(Choice("route", [ChoiceCase("$.x", Comparison(ComparisonType.BOOLEAN_EQ, True), next=slow)],
+                  default=fast))
+    s.add_state(slow)
+    slow.set_next("work")
+    s.add_state(fast)
+    fast.set_next("work")
+    work = task("work", catch=[Catcher([ErrorType.ALL], next=fallback)])
+    work.End = True
+    s.add_state(work)
+    s.add_state(fallback)
+    a = analyze(s.build())
+    assert a.best == 7
+    assert a.worst == 7 + 100 + 10 + 50
+    assert [st.path for st in a.critical_path] == [('p',), ('p', 1, 'w7'), ('route',), ('slow',), ('work',),
+                                                   ('fallback',)]
+    assert [st.path for st in a.dominant(2)] == [('slow',), ('fallback',)]
+
+
+def test_loops_need_a_bound():
+    s = StateMachine()
+    t = task("poll")
+    s.next(t)
+    s.next(Wait("pause", seconds=30))
+    s.next(Choice("done?", [ChoiceCase("$.done", Comparison(ComparisonType.BOOLEAN_EQ, False), next=t)],
+                  default=Pass("finish")))
+    s.next(Pass("finish"))
+    assert analyze(s.build()).worst == math.inf
+    a = analyze(s, max_iterations=4)
+    assert a.best == 30
+    assert a.worst == 4 * (10 + 30)
+    assert [st.path for st in a.critical_path] == [('poll',), ('pause',), ('done?',), ('finish',)]
+
+
+def test_map_runs_in_waves():
+    each = Branch()
+    each.next(Wait("w", seconds=4))
+    s = StateMachine()
+    s.next(Map("m", each, max_concurrency=3, retry=[Retrier(max_attempts=1, interval_seconds=1)]))
+    a = analyze(s.build(), items={"m": 10})
+    assert (a.best, a.worst) == (4 * 4, 2 * 4 * 4 + 1)
+    assert [st.path for st in a.critical_path] == [("m",), ("m", 0, "w")]
+    assert analyze(s).worst == 2 * 4 + 1
+
+
+def test_waits_on_paths_and_timestamps():
+    s = StateMachine()
+    s.next(task("t"))
+    pause = Wait("pause", seconds=None)
+    pause.SecondsPath = "$.delay"
+    s.next(pause)
+    until = Wait("until", seconds=None)
+    until.Timestamp = "2030-01-01T00:00:00Z"
+    s.next(until)
+    a = analyze(s.build())
+    assert (a.best, a.worst) == (0, math.inf)
+    a = analyze(s, durations={"pause": (5, 60), "until": (0, 3600)})
+    assert (a.best, a.worst) == (5, 10 + 60 + 3600)
+    assert [st.path for st in a.dominant(1)] == [('until',)]
@@ -0,0 +1,97 @@
+import io
+import json
+
+import pytest
+
+from steppygraph.loader import loads, load, LoadError
+from steppygraph.machine import StateMachine, Parallel
+from steppygraph.states import BatchJob, EcsTask, Task, ResourceType, ErrorType
+from steppygraph.test.serialize_test import kitchen_sink
+
+
+def test_round_trip():
+    text = kitchen_sink().to_json()
+    m = StateMachine.from_json(text)
+    assert m.build().to_json() == text
+    assert StateMachine.load(io.StringIO(text)).build().to_json() == text
+
+
+def test_loads_objects():
+    m = loads(kitchen_sink().to_json())
+    states = {s.name(): s for s in m.get_states()}
+    assert m.get_states()[0].name() == "lambda"
+    assert isinstance(states["batch"], BatchJob)
+    assert isinstance(states["ecs"], EcsTask)
+    res = states["lambda"].Resource
+    assert (res.resource_type, res.name, res.region, res.aws_ac) == (ResourceType.LAMBDA, "fn", "eu-west-1", "1234")
+    catcher = states["lambda"].Catch[0]
+    assert catcher.ErrorEquals == [ErrorType.ALL]
+    assert catcher._next is states["handler"]
+    assert isinstance(states["parallel"], Parallel)
+    assert [b.count_states() for b in states["parallel"].Branches] == [2, 0]
+
+
+def test_keeps_integration_pattern():
+    text = """{"StartAt": "a", "States": {
+        "a": {"Type": "Task", "Resource": "arn:aws:states:eu-west-1:1:ecs:runTask", "Next": "b"},
+        "b": {"Type": "Task", "Resource": "arn:aws:states:eu-west-1:1:ecs:runTask.sync", "End": true}}}"""
+    m = loads(text)
+    assert [s.Resource.sync for s in m.build().get_states()] == [False, True]
+    assert [str(s.Resource) for s in m.get_states()] == \
+        ["arn:aws:states:eu-west-1:1:ecs:runTask", "arn:aws:states:eu-west-1:1:ecs:runTask.sync"]
+
+
+def test_keeps_resource_region_per_task():
+    text = """{"StartAt": "a", "States": {
+        "a": {"Type": "Task", "Resource": "arn:aws:lambda:eu-west-1:1:function:a", "Next": "b"},
+        "b": {"Type": "Task", "Resource": "arn:aws:lambda:us-east-1:2:function:b", "End": true}}}"""
+    m = loads(text)
+    assert [str(s.Resource) for s in m.build().get_states()] == \
+        ["arn:aws:lambda:eu-west-1:1:function:a", "arn:aws:lambda:us-east-1:2:function:b"]
+    assert m.States["a"].TimeoutSeconds is None
+
+
+@pytest.mark.parametrize("state", [
+    '{"Type": "Task", "Resource": "arn:aws:states:::sns:publish", "End": true}',
+    '{"Type": "Choice", "Choices": [{"And": []}], "Default": "a"}',
+    '{"Type": "Map", "Iterator": {"StartAt": "b", "States": {"b": {"Type": "Pass", "End": true}}}, '
+    '"ItemSelector": {}, "End": true}',
+])
+def test_rejects_what_cannot_be_represented(state):
+    with pytest.raises(LoadError):
+        load(io.StringIO('{"StartAt": "a", "States": {"a": %s}}' % state))
+
+
+@pytest.mark.parametrize("state", [
+    '{"Type": "Pass", "Parameters": {"x.$": "$.y"}, "End": true}',
+    '{"Type": "Parallel", "Branches": [{"StartAt": "b", "States": {"b": {"Type": "Pass", "End": true}}}], '
+    '"Parameters": {"x.$": "$.y"}, "ResultPath": "$.out", '
+    '"Retry": [{"ErrorEquals": ["States.ALL"], "MaxAttempts": 2}], "End": true}',
+    '{"Type": "Wait", "SecondsPath": "$.s", "End": true}',
+    '{"Type": "Wait", "Timestamp": "2026-01-01T00:00:00Z", "End": true}',
+    '{"Type": "Wait", "TimestampPath": "$.t", "End": true}',
+])
+def test_round_trips_optional_fields(state):
+    text = '{"StartAt": "a", "States": {"a": %s}}' % state
+    m = loads(text)
+    assert json.loads(m.build().to_json()) == json.loads(text)
+    assert StateMachine.from_json(m.to_json()).build().to_json() == m.to_json()
+
+
+def test_round_trips_parallel_next():
+    text = StateMachine.from_json("""{"StartAt": "p", "States": {
+        "p": {"Type": "Parallel", "Branches": [{"StartAt": "b", "States": {"b": {"Type": "Pass", "End": true}}}],
+              "Next": "done"},
+        "done": {"Type": "Pass", "End": true}}}""").build().to_json()
+    assert '"Next": "done"' in text
+    assert StateMachine.from_json(text).build().to_json() == text
+
+
+def test_rejects_machines_without_an_end():
+    text = """{"StartAt": "a", "States": {
+        "a": {"Type": "Pass", "Next": "loop"},
+        "loop": {"Type": "Choice", "Choices": [{"Variable": "$.x", "BooleanEquals": true, "Next": "a"}],
+                 "Default": "a"}}}"""
+    with pytest.raises(LoadError, match="'loop'"):
+        loads(text)
+    assert loads('{"StartAt": "a", "States": {"a": {"Type": "Pass", "End": true}}}').build().States["a"].End
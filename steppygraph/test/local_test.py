@@ -0,0 +1,208 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from steppygraph.local import LocalRunner, VirtualClock, ExecutionFailed, TaskError
+from steppygraph.machine import StateMachine, Branch, Parallel, Map
+from steppygraph.states import Task, Resource, ResourceType, Pass, Wait, Choice, ChoiceCase, Comparison, \
+    ComparisonType, Succeed, Fail, Retrier, Catcher, ErrorType
+
+
+def lambda_task(name: str, **kwargs) -> Task:
+    return Task(name, resource=Resource(name, type=ResourceType.LAMBDA), **kwargs)
+
+
+def test_runs_tasks_with_paths():
+    s = StateMachine()
+    t = lambda_task("double")
+    t.InputPath = "$.n"
+    t.ResultPath = "$.doubled"
+    s.next(t)
+    s.next(Pass("static", result={"ok": True}, result_path="$.extra"))
+    ex = LocalRunner(s, {"double": lambda n: n * 2}).run_sync({"n": 21})
+    assert ex.output == {"n": 21, "doubled": 42, "extra": {"ok": True}}
+    assert ex.history == ["double", "static"]
+
+
+def test_choice_routes_to_matching_case():
+    s = StateMachine()
+    big, small = Pass("big", result="big"), Pass("small", result="small")
+    s.next(Choice("route", [ChoiceCase("$.n", Comparison(ComparisonType.NUMERIC_GT, 10), next=big)], default=small))
+    s.add_state(big)
+    s.add_state(small)
+    runner = LocalRunner(s, {})
+    assert runner.run_sync({"n": 11}).output == "big"
+    assert runner.run_sync({"n": 1}).output == "small"
+    assert runner.run_sync({}).output == "small"
+
+
+def test_retry_backoff_on_virtual_clock():
+    calls = []
+
+    def flaky(doc):
+        calls.append(doc)
+        if len(calls) < 3:
+            raise TaskError("Flaky")
+        return "done"
+
+    s = StateMachine()
+    s.next(lambda_task("flaky", retry=[Retrier(max_attempts=3, interval_seconds=10, backoff_rate=2.0)]))
+    s.next(Wait("pause", seconds=100))
+    clock = VirtualClock()
+    ex = LocalRunner(s, {"flaky": flaky}, clock=clock).run_sync()
+    assert ex.output == "done"
+    assert len(calls) == 3
+    assert ex.elapsed == 10 + 20 + 100
+
+
+def test_catch_routes_error_output():
+    s = StateMachine()
+    handler = Pass("handler")
+    s.next(lambda_task("boom", catch=[Catcher([ErrorType.ALL], next=handler)]))
+    s.next(Succeed("ok"))
+    s.add_state(handler)
+
+    def boom(doc):
+        raise KeyError("missing")
+
+    ex = LocalRunner(s, {"boom": boom}).run_sync()
+    assert ex.output["Error"] == "KeyError"
+    assert ex.history == ["boom", "handler"]
+
+
+def test_fail_state_raises():
+    s = StateMachine()
+    s.next(Fail("nope", cause="because", error="Custom"))
+    with pytest.raises(ExecutionFailed) as e:
+        LocalRunner(s, {}).run_sync()
+    assert e.value.error == "Custom"
+
+
+def test_parallel_branches_run_concurrently():
+    async def slow(doc):
+        await asyncio.sleep(0.05)
+        return doc + 1
+
+    a, b = Branch(), Branch()
+    a.next(lambda_task("slow"))
+    b.next(Wait("virtual", seconds=30))
+    b.next(Task("sync", resource=Resource("sync", type=ResourceType.ACTIVITY)))
+    s = StateMachine()
+    s.next(Parallel("both", branches=[a, b]))
+    clock = VirtualClock()
+    with ThreadPoolExecutor(2) as pool:
+        ex = LocalRunner(s, {"slow": slow, "sync": lambda d: d * 10}, clock=clock, executor=pool).run_sync(1)
+    assert ex.output == [2, 10]
+    assert ex.elapsed == 30
+
+
+def test_map_runs_items_with_bounded_concurrency():
+    running = []
+    peak = []
+
+    async def square(doc):
+        running.append(doc)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(doc)
+        return doc["v"] ** 2
+
+    each = Branch()
+    each.next(lambda_task("square"))
+    each.next(Wait("pause", seconds=10))
+    s = StateMachine()
+    s.next(Map("squares", each, items_path="$.n", max_concurrency=2, result_path="$.squares",
+               parameters={"v.$": "$$.Map.Item.Value", "i.$": "$$.Map.Item.Index"}))
+    ex = LocalRunner(s, {"square": square}, clock=VirtualClock()).run_sync({"n": [1, 2, 3, 4, 5]})
+    assert ex.output == {"n": [1, 2, 3, 4, 5], "squares": [1, 4, 9, 16, 25]}
+    assert max(peak) == 2
+    # five items on two workers take three rounds of the iterator's wait
+    assert ex.elapsed == 30
+    assert ex.history.count("square") == 5
+
+
+def test_map_retries_and_catches_failed_iterations():
+    calls = []
+
+    def flaky(doc):
+        calls.append(doc)
+        raise TaskError("Broken")
+
+    each = Branch()
+    each.next(lambda_task("flaky"))
+    s = StateMachine()
+    handler = Pass("handler")
+    s.next(Map("all", each, retry=[Retrier(max_attempts=1, interval_seconds=5)],
+               catch=[Catcher([ErrorType.ALL], next=handler)]))
+    s.add_state(handler)
+    ex = LocalRunner(s, {"flaky": flaky}, clock=VirtualClock()).run_sync([1])
+    assert ex.output == {"Error": "Broken", "Cause": ""}
+    assert calls == [1, 1]
+    assert ex.elapsed == 5
+
+
+def test_missing_handler_is_rejected_up_front():
+    s = StateMachine()
+    s.next(lambda_task("unknown"))
+    with pytest.raises(ValueError):
+        LocalRunner(s, {})
+
+
+def test_parameters_and_missing_paths():
+    s = StateMachine()
+    t = lambda_task("greet")
+    t.Parameters = {"who.$": "$.name", "greeting": "hi"}
+    t.ResultPath = "$.out"
+    s.next(t)
+    runner = LocalRunner(s, {"greet": lambda p: f"{p['greeting']} {p['who']}"})
+    assert runner.run_sync({"name": "bob"}).output == {"name": "bob", "out": "hi bob"}
+    with pytest.raises(ExecutionFailed) as e:
+        runner.run_sync({})
+    assert e.value.error == 'States.Runtime'
+
+
+def test_parallel_retries_failed_branches():
+    calls = []
+
+    def flaky(doc):
+        calls.append(doc)
+        if len(calls) < 3:
+            raise TaskError("Flaky")
+        return "ok"
+
+    b = Branch()
+    b.next(lambda_task("flaky"))
+    s = StateMachine()
+    p = Parallel("both", branches=[b])
+    p.Retry = [Retrier(max_attempts=2, interval_seconds=5, backoff_rate=2.0, error_equals=["Flaky"])]
+    p.ResultPath = "$.results"
+    s.next(p)
+    ex = LocalRunner(s, {"flaky": flaky}, clock=VirtualClock()).run_sync({"n": 1})
+    assert ex.output == {"n": 1, "results": ["ok"]}
+    assert len(calls) == 3
+    assert ex.elapsed == 5 + 10
+
+
+def test_wait_paths_and_timestamps():
+    s = StateMachine()
+    w = Wait("by-path", seconds=None)
+    w.SecondsPath = "$.delay"
+    s.next(w)
+    w = Wait("until", seconds=None)
+    w.TimestampPath = "$.at"
+    s.next(w)
+    w = Wait("fixed", seconds=None)
+    w.Timestamp = "1970-01-01T00:01:40Z"
+    s.next(w)
+    runner = LocalRunner(s, {}, clock=VirtualClock())
+    ex = runner.run_sync({"delay": 20, "at": "1970-01-01T00:01:00Z"})
+    assert ex.elapsed == 100
+    with pytest.raises(ExecutionFailed, match="not a timestamp"):
+        runner.run_sync({"delay": 20, "at": "soon"})
+    with pytest.raises(ExecutionFailed, match="SecondsPath"):
+        runner.run_sync({"delay": "20", "at": "1970-01-01T00:01:00Z"})
+    s = StateMachine()
+    s.next(Wait("nothing", seconds=None))
+    with pytest.raises(ExecutionFailed, match="no Seconds"):
+        LocalRunner(s, {}, clock=VirtualClock()).run_sync()
@@ -1,9 +1,11 @@
+import io
 import json
 import sys
 from pathlib import PurePath
 
-from steppygraph.machine import StateMachine
-from steppygraph.states import Task, Resource, ResourceType, Wait, Pass, Succeed, Fail, ErrorType, Catcher
+from steppygraph.machine import StateMachine, Branch, Map, DuplicateStateError
+from steppygraph.states import Task, Resource, ResourceType, Wait, Pass, Succeed, Fail, ErrorType, Catcher, Retrier
+from steppygraph.serialize import iter_json, to_serializable
 from steppygraph.test.testutils import read_json_test_case
 
 
@@ -92,3 +94,134 @@ def test_end_not_set_in_succeed_state():
 
 def snake_to_camel(name: str) -> str:
     return ''.join(map(str.capitalize, name.split('_')))
+
+
+def test_duplicate_state_raises():
+    s = StateMachine()
+    s.next(Pass("Boo"))
+    try:
+        s.add_state(Wait("Boo"))
+        assert False, "expected DuplicateStateError"
+    except DuplicateStateError as e:
+        assert "Boo" in str(e)
+    assert s.count_states() == 1
+    assert s.idx('Boo') == 0
+
+
+def test_reindex_after_rename():
+    s = StateMachine()
+    s.next(Pass("Boo"))
+    s.next(Pass("Baz"))
+    s.get_states()[1]._name = "Bar"
+    s.reindex()
+    assert s.idx('Bar') == 1
+    assert s.idx('Baz') is None
+
+
+def test_last_orphan_skips_states_with_next_set():
+    s = StateMachine()
+    s.next(Pass("One"))
+    s.next(Pass("Two"))
+    s.add_state(Pass("Three"))
+    assert s.last_orphan() == 1
+    s.get_states()[1].set_next("Three")
+    assert s.last_orphan() is None
+    s.next(Pass("Four"))
+    assert s.get_states()[1].get_next() == "Three"
+    assert s.last_orphan() == 3
+
+
+def test_last_orphan_matches_scan_when_interleaving():
+    s = StateMachine()
+    for i in range(50):
+        if i % 3 == 0:
+            s.add_state(Wait(f"w{i}"))
+        else:
+            s.next(Pass(f"p{i}"))
+        expected = None
+        for index in range(len(s.get_states()) - 1, -1, -1):
+            st = s.get_states()[index]
+            if st._autoconnect and st.get_next() is None:
+                expected = index
+                break
+        assert s.last_orphan() == expected
+
+
+def _lambda_machine(comment: str = 'Foo') -> StateMachine:
+    s = StateMachine(region='eu-west-1', account='1234')
+    s.next(Task(resource=Resource("some", type=ResourceType.LAMBDA), name="Kermit", comment=comment))
+    s.next(Wait("Baz", seconds=3))
+    s.next(Pass("Boo"))
+    return s
+
+
+def test_rebuild_after_change_matches_full_build():
+    s = _lambda_machine()
+    s.build()
+    first = s.to_json()
+    s.get_states()[0].Comment = 'Bar'
+    s.next(Succeed("Done"))
+    s.build()
+    expected = _lambda_machine(comment='Bar')
+    expected.build()
+    expected.next(Succeed("Done"))
+    expected.build()
+    assert s.to_json() == expected.to_json()
+    assert s.to_json() != first
+
+
+def test_build_only_rebuilds_changed_states():
+    s = _lambda_machine()
+    s.build()
+    assert not any(st._dirty for st in s.get_states())
+    wait = s.get_states()[1]
+    wait.Seconds = 10
+    assert wait._dirty and wait._fragment is None
+    assert s._changed == {id(wait): wait}
+    s.build()
+    assert not wait._dirty
+    assert json.loads(s.to_json())['States']['Baz']['Seconds'] == 10
+
+
+def test_dump_matches_to_json():
+    s = _lambda_machine()
+    s.next(Succeed("Done"))
+    s.build()
+    out = io.StringIO()
+    s.dump(out)
+    assert out.getvalue() == s.to_json()
+
+
+def test_iter_json_yields_chunks():
+    s = StateMachine()
+    for i in range(200):
+        s.next(Pass(f"p{i}"))
+    s.build()
+    chunks = list(iter_json(s, chunk_size=512))
+    assert len(chunks) > 1
+    assert ''.join(chunks) == s.to_json()
+    assert ''.join(s.iter_json(sort_keys=False, indent=None)) == json.dumps(s, default=to_serializable)
+
+
+def test_map_state():
+    each = Branch()
+    each.next(Task("resize", resource=Resource("resize", type=ResourceType.LAMBDA)))
+    s = StateMachine()
+    s.next(Map("images", each, items_path="$.images", max_concurrency=10, result_path="$.resized",
+               retry=[Retrier(error_equals=[ErrorType.TASK_FAILED])]))
+    s.next(Succeed("done"))
+    d = json.loads(s.build().to_json())["States"]["images"]
+    assert d["Type"] == "Map"
+    assert d["Next"] == "done"
+    assert (d["ItemsPath"], d["MaxConcurrency"], d["ResultPath"]) == ("$.images", 10, "$.resized")
+    assert d["Iterator"]["StartAt"] == "resize"
+    assert d["Iterator"]["States"]["resize"]["End"] is True
+    assert "TimeoutSeconds" not in d["Iterator"]
+    assert d["Retry"][0]["ErrorEquals"] == ["States.TaskFailed"]
+
+    # changes inside the iterator show up in the next build of the machine
+    before = s.size()
+    each.next(Pass("tag"))
+    assert json.loads(s.build().to_json())["States"]["images"]["Iterator"]["States"]["tag"]["End"] is True
+    assert s.size() == len(s.to_json("compact").encode())
+    assert s.size() > before
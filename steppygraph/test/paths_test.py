@@ -0,0 +1,95 @@
+import pytest
+
+from steppygraph.machine import StateMachine
+from steppygraph.paths import compile_path, InvalidPathError, PathMatchError, effective_input, with_result, \
+    effective_output, resolve_parameters
+from steppygraph.states import Task, Resource, ResourceType, Pass, Choice, ChoiceCase, Comparison, ComparisonType
+
+
+def test_get_and_find():
+    doc = {"a": {"b": [10, {"c": "x"}]}, "weird key": 1}
+    assert compile_path("$").get(doc) is doc
+    assert compile_path("$.a.b[0]").get(doc) == 10
+    assert compile_path("$.a.b[1].c").get(doc) == "x"
+    assert compile_path("$['weird key']").get(doc) == 1
+    assert compile_path("$[ 'weird key' ]").get(doc) == 1
+    assert compile_path("$['a]b']").get({"a]b": 2}) == 2
+    assert compile_path("$.a.b[*]").get(doc) == [10, {"c": "x"}]
+    assert compile_path("$.a.missing").find(doc, "default") == "default"
+    assert compile_path("$.a.b[1].c[0]").find(doc) is None
+    with pytest.raises(PathMatchError):
+        compile_path("$.a.missing").get(doc)
+
+
+def test_compiled_paths_are_cached():
+    assert compile_path("$.cached.path") is compile_path("$.cached.path")
+
+
+@pytest.mark.parametrize("path", ["a.b", "$..a", "$.a[?(@.b)]", "$.a[1:2]", "$.", "$.a[0", "$a",
+                                  "$['a'", "$['a' x]", "$['a"])
+def test_rejects_bad_paths(path):
+    with pytest.raises(InvalidPathError):
+        compile_path(path)
+
+
+def test_set_copies_on_write():
+    doc = {"a": {"b": 1}, "l": [1, 2]}
+    out = compile_path("$.a.c.d").set(doc, 5)
+    assert out == {"a": {"b": 1, "c": {"d": 5}}, "l": [1, 2]}
+    assert doc == {"a": {"b": 1}, "l": [1, 2]}
+    assert compile_path("$.l[1]").set(doc, 3)["l"] == [1, 3]
+    with pytest.raises(PathMatchError):
+        compile_path("$.a.b.c").set(doc, 1)
+    with pytest.raises(InvalidPathError):
+        compile_path("$.l[*]").set(doc, 1)
+
+
+def test_state_data_flow():
+    t = Task("t", resource=Resource("t", type=ResourceType.LAMBDA))
+    t.InputPath = "$.job"
+    t.ResultPath = "$.job.result"
+    t.OutputPath = "$.job"
+    doc = {"job": {"id": 7, "name": "a"}}
+    params = {"Id.$": "$.id", "Static": [1, {"Name.$": "$.name"}], "Execution.$": "$$.Execution.Id"}
+    assert effective_input(t, doc, params, context={"Execution": {"Id": "e-1"}}) == \
+        {"Id": 7, "Static": [1, {"Name": "a"}], "Execution": "e-1"}
+    assert effective_output(t, with_result(t, doc, "ok")) == {"id": 7, "name": "a", "result": "ok"}
+    assert resolve_parameters({"f.$": "States.Format('x')"}, {}) == {"f.$": "States.Format('x')"}
+
+
+def test_build_rejects_bad_paths():
+    s = StateMachine()
+    p = Pass("p")
+    p.OutputPath = "$..x"
+    s.next(p)
+    with pytest.raises(InvalidPathError, match="State 'p' OutputPath"):
+        s.build()
+
+    s = StateMachine()
+    target = Pass("target")
+    s.next(Choice("c", [ChoiceCase("$.a[*]", Comparison(ComparisonType.NUMERIC_EQ, 1), next=target)],
+                  default=target))
+    s.add_state(target)
+    with pytest.raises(InvalidPathError, match="Choices"):
+        s.build()
+
+
+def test_build_rejects_paths_changed_after_build():
+    s = StateMachine()
+    t = Task("t", resource=Resource("t", type=ResourceType.LAMBDA))
+    s.next(t)
+    s.build()
+    t.Parameters = {"Input.$": "input"}
+    with pytest.raises(InvalidPathError, match="Parameters"):
+        s.build()
+
+
+def test_build_rejects_unclosed_quoted_selector():
+    s = StateMachine()
+    p = Pass("p")
+    p.InputPath = "$[ 'x' "
+    s.next(p)
+    with pytest.raises(InvalidPathError):
+        s.build()
+    p.InputPath = "$[ 'x' ]"
+    assert s.build().States["p"].InputPath == "$[ 'x' ]"
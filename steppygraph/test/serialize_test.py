@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from steppygraph.machine import StateMachine, Branch, Parallel, Map
+from steppygraph.serialize import dumps, encode, iter_json, plan_for, to_serializable, get_backend, set_backend, \
+    COMPACT_SEPARATORS
+from steppygraph.states import Task, Resource, ResourceType, Retrier, Catcher, ErrorType, BatchJob, ContainerOverrides, \
+    EcsTask, Pass, Wait, Fail, Succeed, Choice, ChoiceCase, Comparison, ComparisonType
+
+
+def kitchen_sink() -> StateMachine:
+    s = StateMachine(region='eu-west-1', account='1234')
+    handler = Task("handler", resource=Resource("handle", type=ResourceType.ACTIVITY))
+    s.next(Task("lambda", resource=Resource("fn", type=ResourceType.LAMBDA), comment="über",
+                retry=[Retrier()], catch=[Catcher([ErrorType.ALL], next=handler)]))
+    s.next(BatchJob("batch", "def", "queue", parameters="$.p",
+                    container_overrides=ContainerOverrides(command="run", memory=512)))
+    s.next(EcsTask("ecs", "cluster", "def", "FARGATE"))
+    s.next(Pass("pass", result={"a": [1, 2.5, None, True], "b": {}}, result_path="$.r"))
+    s.next(Wait("wait", seconds=1))
+    each = Branch()
+    each.next(Task("item", resource=Resource("each", type=ResourceType.LAMBDA)))
+    s.next(Map("map", each, items_path="$.items", max_concurrency=2, parameters={"v.$": "$$.Map.Item.Value"},
+               result_path="$.out", retry=[Retrier()], catch=[Catcher([ErrorType.ALL], next=handler)]))
+    inner = Branch()
+    inner.next(Pass("inner"))
+    inner.next(Fail("failed", cause="c", error="e"))
+    s.next(Parallel("parallel", [inner, Branch()], catch=[Catcher([ErrorType.TIMEOUT], next=handler)]))
+    s.next(Choice("choice", [ChoiceCase("$.v", Comparison(ComparisonType.NUMERIC_GT, 3), next=handler)],
+                  default=handler))
+    s.add_state(handler)
+    s.next(Succeed("done"))
+    return s.build()
+
+
+def test_dumps_matches_json_dumps():
+    s = kitchen_sink()
+    for sort_keys in (True, False):
+        for indent in (None, 0, 2, 4, '\t'):
+            expected = json.dumps(s, default=to_serializable, sort_keys=sort_keys, indent=indent)
+            assert dumps(s, sort_keys=sort_keys, indent=indent) == expected
+            assert ''.join(iter_json(s, sort_keys=sort_keys, indent=indent, chunk_size=16)) == expected
+
+
+def test_encode_gives_plain_values():
+    s = kitchen_sink()
+    assert encode(s) == json.loads(s.to_json())
+
+
+def test_plan_is_compiled_once_per_class():
+    assert plan_for(Task) is plan_for(Task)
+    assert plan_for(Task).fields[-1] == 'Next'
+    assert plan_for(Resource) is None
+
+
+def test_profiles():
+    s = kitchen_sink()
+    assert s.to_json() == s.to_json('pretty') == json.dumps(s, default=to_serializable, sort_keys=True, indent=4)
+    assert s.to_json('compact') == json.dumps(s, default=to_serializable, separators=(',', ':'))
+    assert s.to_json('canonical') == json.dumps(s, default=to_serializable, sort_keys=True, separators=(',', ':'))
+    assert s.to_json('compact').isascii()
+    with pytest.raises(ValueError):
+        s.to_json('tiny')
+
+
+@pytest.mark.parametrize("backend", ["json", "orjson"])
+def test_backends_match_json_module(backend):
+    if backend == "orjson":
+        pytest.importorskip("orjson")
+    previous = get_backend()
+    set_backend(backend)
+    try:
+        for doc in ({"b": 1.5, "a": [1, True, "x"]}, {"f": 1e16}, {"f": 1e-05}, {"n": None}, {"s": "\x7f\u00fc"},
+                    {"i": 2 ** 70}, {1: "int key"}, {"nan": float("nan")}, kitchen_sink()):
+            for sort_keys in (True, False):
+                expected = json.dumps(doc, default=to_serializable, sort_keys=sort_keys, separators=(',', ':'))
+                assert dumps(doc, sort_keys=sort_keys, indent=None, separators=COMPACT_SEPARATORS) == expected
+    finally:
+        set_backend(previous)
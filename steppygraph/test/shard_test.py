@@ -0,0 +1,107 @@
+import pytest
+
+from steppygraph.local import LocalRunner
+from steppygraph.machine import StateMachine, Branch, Parallel, Map
+from steppygraph.shard import shard, ShardError
+from steppygraph.states import Task, Resource, ResourceType, Pass, Choice, ChoiceCase, Comparison, ComparisonType, \
+    StartExecution, WorkflowType
+from steppygraph.validate import validate
+
+
+def looping_machine() -> StateMachine:
+    s = StateMachine(region='eu-west-1', account='123', name='big')
+    s.next(Pass("init", result=0, result_path="$.n"))
+    inc = Task("inc", resource=Resource("increment", type=ResourceType.LAMBDA))
+    inc.InputPath = "$.n"
+    inc.ResultPath = "$.n"
+    s.next(inc)
+    s.next(Choice("loop", [ChoiceCase("$.n", Comparison(ComparisonType.NUMERIC_LT, 3), next=inc)],
+                  default=Pass("pad0")))
+    for i in range(6):
+        s.next(Pass(f"pad{i}", result={"i": i, "pad": "x" * 80}, result_path="$.pad"))
+    skip = Pass("skip", result="skipped", result_path="$.tail")
+    s.next(Choice("branch", [ChoiceCase("$.flag", Comparison(ComparisonType.BOOLEAN_EQ, True), next=skip)],
+                  default=Pass("tail0")))
+    s.next(Pass("tail0", result="ran", result_path="$.tail"))
+    s.next(skip)
+    return s
+
+
+def run(machines, doc):
+    runners = {}
+
+    async def start_execution(params):
+        ex = await runners[params["StateMachineArn"].rsplit(':', 1)[1]].run(params["Input"])
+        return {"Output": ex.output}
+
+    handlers = {"increment": lambda n: n + 1, str(Resource("", type=ResourceType.EXECUTION, region='eu-west-1',
+                                                           aws_ac='123')): start_execution}
+    for m in machines:
+        runners[m.name()] = LocalRunner(m, handlers)
+    return runners[machines[0].name()].run_sync(doc).output
+
+
+def test_sharded_machines_fit_and_behave_the_same():
+    s = looping_machine()
+    before = s.build().to_json()
+    machines = shard(s, max_bytes=700)
+    assert len(machines) > 2
+    assert machines[0].name() == "big"
+    assert sorted(m.name() for m in machines[1:]) == sorted(f"big-{i}" for i in range(1, len(machines)))
+    for m in machines:
+        assert m.size() <= 700
+        assert [d for d in validate(m.build()) if d.code != "busy-loop"] == []
+    assert s.build().to_json() == before
+
+    for flag in (True, False):
+        assert run(machines, {"flag": flag}) == run([s], {"flag": flag})
+
+    # the loop and the choice skipping tail0 are never cut
+    homes = {st.name(): m.name() for m in machines[1:] for st in m.get_states()}
+    assert homes["inc"] == homes["loop"]
+    assert homes["branch"] == homes["tail0"]
+
+
+def test_root_runs_children_synchronously():
+    machines = shard(looping_machine(), max_states=6)
+    root = machines[0]
+    assert all(isinstance(st, StartExecution) for st in root.get_states())
+    assert root.get_states()[0].Parameters["StateMachineArn"] == \
+        f"arn:aws:states:eu-west-1:123:stateMachine:{machines[1].name()}"
+    assert all(m.count_states() <= 6 for m in machines)
+    assert StateMachine.from_json(root.build().to_json()).build().to_json() == root.to_json()
+
+
+def test_fitting_machine_is_returned_as_is():
+    s = looping_machine()
+    assert shard(s) == [s]
+
+
+def test_uncuttable_run_over_budget():
+    with pytest.raises(ShardError):
+        shard(looping_machine(), max_bytes=300)
+
+
+def test_express_machines_cannot_be_split():
+    s = looping_machine()
+    s.workflow_type = WorkflowType.EXPRESS
+    assert shard(s) == [s]
+    with pytest.raises(ShardError, match="Express"):
+        shard(s, max_states=8)
+
+
+def test_copies_nested_machines():
+    s = looping_machine()
+    b, each = Branch(), Branch()
+    b.next(Pass("in-branch"))
+    each.next(Pass("in-map"))
+    s.next(Parallel("par", branches=[b]))
+    s.next(Map("map", each))
+    before = s.build().to_json()
+    machines = shard(s, max_states=6)
+    assert (b._parents, each._parents) == ((s.States["par"],), (s.States["map"],))
+    copies = {st.name(): st for m in machines[1:] for st in m.get_states()}
+    assert copies["par"].Branches[0] is not b and copies["map"].Iterator is not each
+    b.get_states()[0].Comment = "changed"
+    assert "changed" not in "".join(m.build().to_json() for m in machines)
+    assert "changed" in s.build().to_json() != before
@@ -0,0 +1,118 @@
+import pytest
+
+from steppygraph.machine import StateMachine, Branch, Parallel, Map
+from steppygraph.states import Task, Resource, ResourceType, Pass, Wait, Choice, ChoiceCase, Comparison, \
+    ComparisonType, Retrier, Catcher, ErrorType, Fail
+
+np = pytest.importorskip("numpy")
+
+from steppygraph.simulate import simulate, StateModel, fixed, uniform  # noqa: E402
+
+
+def task(name: str, timeout: int = 10, **kwargs) -> Task:
+    return Task(name, resource=Resource(name, type=ResourceType.LAMBDA), timeout_seconds=timeout, **kwargs)
+
+
+def test_deterministic_machine():
+    s = StateMachine()
+    s.next(task("t"))
+    s.next(Wait("w", seconds=5))
+    branch_a, branch_b = Branch(), Branch()
+    branch_a.next(Wait("w3", seconds=3))
+    branch_b.next(Pass("p1"))
+    branch_b.next(Pass("p2"))
+    s.next(Parallel("p", [branch_a, branch_b]))
+    sim = simulate(s, {"t": StateModel(duration=fixed(2))}, runs=100, seed=1)
+    assert (sim.transitions == 3 + 1 + 2).all()
+    assert (sim.duration == 2 + 5 + 3).all()
+    assert not sim.failed.any()
+    assert sim.cost[0] == pytest.approx(6 * 0.000025)
+    assert sim.visits == {"t": 100, "w": 100, "p": 100, "w3": 100, "p1": 100, "p2": 100}
+    assert sim.percentiles([50]) == {50: 10.0}
+
+
+def test_choice_split():
+    s = StateMachine()
+    a, b = Pass("a"), Wait("b", seconds=10)
+    a.End = True
+    s.next(Choice("route", [ChoiceCase("$.x", Comparison(ComparisonType.BOOLEAN_EQ, True), next=a)], default=b))
+    s.add_state(a)
+    s.add_state(b)
+    sim = simulate(s, {"route": StateModel(choices={"a": 0.8, "b": 0.2})}, runs=100000, seed=2)
+    assert sim.visits["a"] + sim.visits["b"] == 100000
+    assert sim.visits["b"] / 100000 == pytest.approx(0.2, abs=0.01)
+    assert sim.duration.mean() == pytest.approx(2, abs=0.1)
+    assert (sim.transitions == 2).all()
+
+
+def test_retries_and_catch():
+    s = StateMachine()
+    fallback = Fail("fallback")
+    retry = Retrier(max_attempts=2, interval_seconds=1, backoff_rate=2.0, error_equals=[ErrorType.TASK_FAILED])
+    s.next(task("t", retry=[retry], catch=[Catcher([ErrorType.ALL], next=fallback)]))
+    s.next(Pass("done"))
+    s.add_state(fallback)
+    sim = simulate(s, {"t": StateModel(failure=0.5)}, runs=200000, seed=3)
+    # the task succeeds on its first, second or third attempt, or fails into the catcher
+    assert sim.failed.mean() == pytest.approx(0.125, abs=0.01)
+    assert sim.visits["fallback"] / 200000 == pytest.approx(0.125, abs=0.01)
+    assert set(np.unique(sim.duration)) == {0, 1, 3}
+    assert sim.transitions.mean() == pytest.approx(1 + 0.5 + 0.25 + 1, abs=0.02)
+
+
+def test_timeouts_are_not_task_failures():
+    s = StateMachine()
+    retry = Retrier(max_attempts=3, error_equals=[ErrorType.TASK_FAILED])
+    s.next(task("t", timeout=5, retry=[retry]))
+    sim = simulate(s, {"t": StateModel(duration=uniform(0, 10))}, runs=10000, seed=4)
+    assert sim.failed.mean() == pytest.approx(0.5, abs=0.03)
+    assert sim.duration.max() <= 5
+    assert (sim.transitions == 1).all()
+
+
+def test_loops_stop_at_max_transitions():
+    s = StateMachine()
+    again = Pass("again")
+    s.next(again)
+    s.next(Choice("loop", [ChoiceCase("$.x", Comparison(ComparisonType.BOOLEAN_EQ, True), next=again)],
+                  default=Pass("out")))
+    s.add_state(Pass("out"))
+    sim = simulate(s, {"loop": StateModel(choices={"again": 1.0})}, runs=10, max_transitions=50)
+    assert sim.failed.all()
+    assert (sim.transitions == 50).all()
+
+
+def test_map_iterations():
+    each = Branch()
+    each.next(task("t"))
+    each.next(Pass("p"))
+    s = StateMachine()
+    s.next(Map("m", each, max_concurrency=2))
+    models = {"m": StateModel(items=5), "t": StateModel(duration=uniform(1, 2))}
+    sim = simulate(s, models, runs=1000, seed=5)
+    assert (sim.transitions == 1 + 5 * 2).all()
+    assert sim.visits == {"m": 1000, "t": 5000, "p": 5000}
+    # three waves of at most two items, each between one and two seconds
+    assert ((sim.duration >= 3) & (sim.duration <= 6)).all()
+
+
+def test_parallel_branches_fail_with_their_own_error():
+    flaky, steady = Branch(), Branch()
+    flaky.next(task("t"))
+    steady.next(Wait("w", seconds=3))
+    s = StateMachine()
+    handled = Pass("handled")
+    handled.End = True
+    retry = Retrier(max_attempts=1, interval_seconds=2, backoff_rate=1.0, error_equals=["Custom"])
+    p = Parallel("p", [flaky, steady], catch=[Catcher(["Custom"], next=handled)])
+    p.Retry = [retry]
+    s.next(p)
+    s.next(Pass("done"))
+    s.add_state(handled)
+    sim = simulate(s, {"t": StateModel(failure=0.5, error="Custom")}, runs=100000, seed=6)
+    assert not sim.failed.any()
+    # both attempts fail a quarter of the time, into the catcher on the branch's error
+    assert sim.visits["handled"] / 100000 == pytest.approx(0.25, abs=0.01)
+    assert sim.visits["p"] == 100000
+    assert sim.visits["t"] / 100000 == pytest.approx(1.5, abs=0.01)
+    assert set(np.unique(sim.duration)) == {3, 3 + 2 + 3}
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from steppygraph.machine import StateMachine, Branch, Parallel
+from steppygraph.serialize import to_serializable
+from steppygraph.size import size_report, DefinitionSizeError
+from steppygraph.states import Pass, Task, Resource, ResourceType
+from steppygraph.test.serialize_test import kitchen_sink
+
+
+def compact_size(machine: StateMachine) -> int:
+    return len(json.dumps(machine.build(), default=to_serializable, separators=(',', ':')))
+
+
+def test_size_matches_compact_json():
+    s = kitchen_sink()
+    assert s.size() == compact_size(s)
+
+    s = StateMachine()
+    assert s.size() == len('{"TimeoutSeconds":600,"States":{}}')
+    s.next(Pass("a"))
+    b = Branch()
+    b.next(Pass("inner"))
+    s.next(Parallel("p", branches=[b]))
+    size = s.size()
+    assert size == compact_size(s)
+
+
+def test_running_total_follows_changes():
+    s = StateMachine()
+    b = Branch()
+    b.next(Pass("inner"))
+    s.next(Pass("a"))
+    s.next(Parallel("p", branches=[b]))
+    s.size()
+    s.get_states()[0].Comment = "a comment"
+    assert s.size() == compact_size(s)
+    b.get_states()[0].Result = {"big": "x" * 100}
+    assert s.size() == compact_size(s)
+    s.next(Pass("c"))
+    b.next(Pass("inner2"))
+    assert s.size() == compact_size(s)
+
+
+def test_report_and_budget():
+    s = StateMachine()
+    t = Task("t", resource=Resource("fn", type=ResourceType.LAMBDA))
+    t.Parameters = {"blob": "x" * 500}
+    s.next(t)
+    s.next(Pass("small"))
+    top = size_report(s, top=2)
+    assert [(c.kind, c.path) for c in top] == [('state', ('t',)), ('parameters', ('t',))]
+
+    s.size_budget = s.size() + 60
+    s.next(Pass("fits"))
+    before = s.build().to_json()
+    with pytest.raises(DefinitionSizeError):
+        s.next(Pass("does-not-fit"))
+    assert [st.name() for st in s.get_states()] == ["t", "small", "fits"]
+    assert s.size() == compact_size(s)
+    # the rejected state is not wired in, the last state can still be connected
+    assert s.build().to_json() == before
+    assert s.get_states()[-1].get_next() is None
+    s.size_budget = None
+    s.next(Pass("later"))
+    assert s.build().States["fits"].Next == "later"
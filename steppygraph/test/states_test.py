@@ -1,8 +1,13 @@
+import copy
+import io
+import pickle
 import json
 
-from steppygraph.machine import Branch, Parallel
+import pytest
+
+from steppygraph.machine import Branch, Parallel, StateMachine
 from steppygraph.states import Choice, ChoiceCase, Comparison, ComparisonType, Task, StateType, to_serializable, \
-    Pass, Catcher, ErrorType, State, BatchJob, EcsTask
+    Pass, Catcher, ErrorType, State, BatchJob, EcsTask, Wait, Retrier
 from steppygraph.states import Resource, ResourceType
 from steppygraph.test.testutils import read_json_test_case, write_json_test_case
 
@@ -107,3 +112,91 @@ def test_setting_catcher_on_task_works():
     )
     assert read_json_test_case("catcher_in_the_task") == json.dumps(
         t, default=to_serializable)
+
+
+def test_parallel_dump_matches_to_json():
+    branch = Branch()
+    branch.next(Pass("inner"))
+    p = Parallel("Fan", branches=[branch])
+    p.build()
+    out = io.StringIO()
+    p.dump(out)
+    assert out.getvalue() == p.to_json()
+
+
+def test_states_are_slotted():
+    t = Task("foo", resource=Resource("fooRes", type=ResourceType.LAMBDA))
+    assert not hasattr(t, '__dict__')
+    assert not hasattr(t.Resource, '__dict__')
+    assert t._extra is None
+    assert t.Retry is None and t.Comment is None
+
+
+def test_optional_fields_are_stored_compactly():
+    p = Pass("foo")
+    p.Comment = "hello"
+    p.ResultPath = "$.r"
+    assert p.Comment == "hello"
+    assert p._extra == {"Comment": "hello", "ResultPath": "$.r"}
+    p.Comment = None
+    assert p._extra == {"ResultPath": "$.r"}
+    assert json.loads(p.to_json()) == {"ResultPath": "$.r", "Type": "Pass"}
+
+
+def test_copy_and_pickle_keep_fields():
+    t = Task("foo", resource=Resource("fooRes", type=ResourceType.LAMBDA), comment="c")
+    c = copy.copy(t)
+    c.Comment = "d"
+    assert t.Comment == "c"
+    assert c.name() == "foo"
+    restored = pickle.loads(pickle.dumps(t))
+    assert restored.to_json() == t.to_json()
+
+
+def test_optional_asl_fields_can_be_set():
+    b = Branch()
+    b.next(Pass("inner"))
+    p = Parallel("par", branches=[b])
+    p.ResultPath = "$.results"
+    p.Parameters = {"x.$": "$.x"}
+    p.Retry = [Retrier()]
+    assert {"ResultPath", "Parameters", "Retry"} <= set(json.loads(p.to_json()))
+    s = Pass("pass")
+    s.Parameters = {"a": 1}
+    assert json.loads(s.to_json())["Parameters"] == {"a": 1}
+    w = Wait("wait", seconds=None)
+    w.Timestamp = "2026-01-01T00:00:00Z"
+    assert json.loads(w.to_json()) == {"Type": "Wait", "Timestamp": "2026-01-01T00:00:00Z"}
+
+
+def test_printable_lists_all_fields():
+    s = StateMachine()
+    s.next(Pass("a"))
+    s.next(Wait("b", seconds=3))
+    text = s.printable()
+    assert "{'Type': 'Pass'" not in text
+    assert "'_name': 'a'" in text and "'_next': 'b'" in text and "'Next': 'b'" in text
+    assert "'Comment': None" in text and "'Seconds': 3" in text
+
+
+def test_undeclared_fields_are_kept_and_rendered():
+    s = StateMachine()
+    t = Task("foo", resource=Resource("fooRes", type=ResourceType.LAMBDA))
+    s.next(t)
+    s.build()
+    t.Credentials = {"RoleArn": "arn:aws:iam::1:role/r"}
+    t.Arguments = "x"
+    assert t.Credentials == {"RoleArn": "arn:aws:iam::1:role/r"}
+    assert not hasattr(t, '__dict__')
+    rendered = json.loads(s.to_json())["States"]["foo"]
+    assert rendered["Credentials"] == {"RoleArn": "arn:aws:iam::1:role/r"} and rendered["Arguments"] == "x"
+    # undeclared fields follow the declared ones unless keys are sorted
+    assert s.to_json("compact").endswith('"Arguments":"x"}},"StartAt":"foo"}')
+    assert ''.join(s.iter_json()) == s.to_json()
+    assert pickle.loads(pickle.dumps(t)).Credentials == t.Credentials
+    del t.Arguments
+    t.Credentials = None
+    assert t._extra is None or "Credentials" not in t._extra
+    assert "Credentials" not in s.to_json()
+    with pytest.raises(AttributeError):
+        t._private = 1
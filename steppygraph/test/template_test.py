@@ -0,0 +1,38 @@
+from steppygraph.machine import StateMachine, Branch, Parallel
+from steppygraph.states import Task, Resource, ResourceType, BatchJob, Pass
+from steppygraph.template import compile_template
+
+
+def machine(region: str = '', account: str = '') -> StateMachine:
+    s = StateMachine(region=region, account=account)
+    s.next(Task("fn", resource=Resource("fn", type=ResourceType.LAMBDA)))
+    inner = Branch(region=region, account=account)
+    inner.next(Task("activity", resource=Resource("act", type=ResourceType.ACTIVITY)))
+    s.next(Parallel("p", branches=[inner]))
+    s.next(BatchJob("batch", "def", "queue"))
+    s.next(Pass("done", result={"text": "arn:aws:lambda:::function:fn"}))
+    return s
+
+
+def test_template_renders_like_a_machine_per_region():
+    for profile in ('pretty', 'compact'):
+        template = compile_template(machine(), profile)
+        variants = [("eu-west-1", "1111"), ("us-east-1", "2222"), ("", "")]
+        rendered = template.render_all(variants)
+        for region, account in variants:
+            assert rendered[(region, account)] == machine(region, account).build().to_json(profile)
+
+
+def test_shared_resources_are_not_changed():
+    shared = Resource("fn", type=ResourceType.LAMBDA)
+    eu, us = StateMachine(region="eu-west-1", account="1"), StateMachine(region="us-east-1", account="2")
+    eu.next(Task("a", resource=shared))
+    us.next(Task("a", resource=shared))
+    assert eu.get_states()[0].Resource.region == "eu-west-1"
+    assert us.get_states()[0].Resource.region == "us-east-1"
+    assert (shared.region, shared.aws_ac) == ('', '')
+
+    s = machine("eu-west-1", "1")
+    before = s.build().to_json()
+    compile_template(s).render("us-east-1", "2")
+    assert s.to_json() == before
@@ -0,0 +1,164 @@
+import warnings
+
+import pytest
+
+from steppygraph.machine import StateMachine, Branch, Parallel, Map
+from steppygraph.states import Task, Resource, ResourceType, Pass, Wait, Choice, ChoiceCase, Comparison, \
+    ComparisonType, Catcher, ErrorType, Succeed, BatchJob, StartExecution, WorkflowType
+from steppygraph.validate import validate, check, ValidationError, ValidationWarning
+
+
+def codes(machine: StateMachine):
+    return sorted((d.code, d.path) for d in validate(machine))
+
+
+def test_valid_machine():
+    s = StateMachine()
+    handler = Pass("handler")
+    t = Task("t", resource=Resource("fn", type=ResourceType.LAMBDA), catch=[Catcher([ErrorType.ALL], next=handler)])
+    s.next(t)
+    b = Branch()
+    b.next(Pass("inner"))
+    s.next(Parallel("p", branches=[b]))
+    s.next(Succeed("done"))
+    s.add_state(handler)
+    assert validate(s.build()) == []
+
+
+def test_missing_targets_and_unreachable():
+    s = StateMachine()
+    s.next(Pass("a"))
+    s.add_state(Choice("c", [ChoiceCase("$.x", Comparison(ComparisonType.NUMERIC_EQ, 1), next=Pass("nowhere"))],
+                       default=Pass("gone")))
+    s.add_state(Succeed("end"))
+    s.get_states()[0].set_next("missing")
+    assert codes(s.build()) == [
+        ('missing-target', ('a',)),
+        ('missing-target', ('c',)),
+        ('missing-target', ('c',)),
+        ('no-exit', ('a',)),
+        ('unreachable', ('c',)),
+        ('unreachable', ('end',)),
+    ]
+
+
+def test_loops_and_branches():
+    s = StateMachine()
+    s.next(Pass("a"))
+    s.next(Pass("b"))
+    s.get_states()[1].set_next("a")
+    s.add_state(Succeed("never"))
+    inner = Branch()
+    inner.add_state(Pass("x"))
+    inner.add_state(Pass("y"))
+    s.add_state(Parallel("p", branches=[inner]))
+    found = codes(s.build())
+    assert ('busy-loop', ('a',)) in found
+    assert ('no-exit', ('a',)) in found and ('no-exit', ('b',)) in found
+    assert ('unreachable', ('p', 0, 'y')) in found
+    assert ('no-transition', ('p', 0, 'x')) in found
+
+    s = StateMachine()
+    s.next(Wait("w", seconds=1))
+    s.next(Choice("c", [ChoiceCase("$.done", Comparison(ComparisonType.BOOLEAN_EQ, False),
+                                   next=s.get_states()[0])], default=Succeed("ok")))
+    s.add_state(Succeed("ok"))
+    assert validate(s.build()) == []
+
+
+def test_validate_on_build():
+    s = StateMachine()
+    s.validate_on_build = True
+    s.next(Pass("a"))
+    s.add_state(Pass("orphan"))
+    with pytest.raises(ValidationError) as e:
+        s.build()
+    assert [d.code for d in e.value.diagnostics] == ['no-transition', 'unreachable']
+    check(StateMachine().next(Pass("only")).build())
+
+
+def test_express_machines():
+    s = StateMachine(workflow_type=WorkflowType.EXPRESS)
+    assert s.TimeoutSeconds == 300
+    s.next(Task("fn", resource=Resource("fn", type=ResourceType.LAMBDA), timeout_seconds=10))
+    s.next(BatchJob("batch", "def", "queue", timeout_seconds=10))
+    each = Branch()
+    each.next(StartExecution("child", "arn:aws:states:::stateMachine:child", timeout_seconds=10))
+    s.next(Map("map", each))
+    s.next(Wait("wait", seconds=60))
+    text = s.build().to_json()
+    assert ':batch:submitJob"' in text and ':states:startExecution"' in text and '.sync' not in text
+    assert validate(s) == []
+
+    # switching back to standard waits for jobs again, in branches too
+    s.workflow_type = WorkflowType.STANDARD
+    text = s.build().to_json()
+    assert ':batch:submitJob.sync"' in text and ':states:startExecution.sync:2"' in text
+    s.workflow_type = WorkflowType.EXPRESS
+
+    s.next(Wait("long", seconds=250))
+    with pytest.warns(ValidationWarning, match="express-duration"):
+        s.build()
+    assert codes(s) == [('express-duration', ())]
+
+    s.add_state(Task("activity", resource=Resource("act", type=ResourceType.ACTIVITY)))
+    with pytest.raises(ValidationError) as e:
+        s.build()
+    assert [(d.code, d.path) for d in e.value.diagnostics] == [('express-integration', ('activity',))]
+
+
+def test_express_default_timeouts():
+    s = StateMachine(workflow_type=WorkflowType.EXPRESS)
+    s.next(Task("fn", resource=Resource("fn", type=ResourceType.LAMBDA)))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        s.build()
+    assert s.States["fn"].TimeoutSeconds == 300
+
+    s = StateMachine()
+    each = Branch()
+    each.next(Task("inner", resource=Resource("fn", type=ResourceType.LAMBDA)))
+    s.next(Task("fn", resource=Resource("fn", type=ResourceType.LAMBDA)))
+    s.next(Task("own", resource=Resource("fn", type=ResourceType.LAMBDA), timeout_seconds=120))
+    s.next(Map("map", each))
+    s.workflow_type = WorkflowType.EXPRESS
+    timeouts = [s.TimeoutSeconds, s.get_states()[0].TimeoutSeconds, s.get_states()[1].TimeoutSeconds,
+                each.get_states()[0].TimeoutSeconds]
+    assert timeouts == [300, 300, 120, 300]
+    s.workflow_type = WorkflowType.STANDARD
+    assert (s.TimeoutSeconds, s.get_states()[0].TimeoutSeconds, s.get_states()[1].TimeoutSeconds) == (600, 600, 120)
+
+
+def test_express_duration_names_slow_states():
+    s = StateMachine(workflow_type=WorkflowType.EXPRESS)
+    s.next(Pass("quick"))
+    s.next(Wait("slow", seconds=400))
+    s.next(Pass("done"))
+    d, = [d for d in validate(s) if d.code == 'express-duration']
+    assert d.message.endswith("mostly in slow")
+    with pytest.raises(ValidationError):
+        check(s, include_warnings=True)
+    check(s)
+
+
+def test_explicit_timeouts_are_kept():
+    s = StateMachine()
+    s.next(Task("fn", resource=Resource("fn", type=ResourceType.LAMBDA), timeout_seconds=300))
+    assert s.build().States["fn"].TimeoutSeconds == 300
+    s.workflow_type = WorkflowType.EXPRESS
+    s.workflow_type = WorkflowType.STANDARD
+    assert s.States["fn"].TimeoutSeconds == 300
+
+    s = StateMachine(workflow_type=WorkflowType.EXPRESS)
+    t = Task("fn", resource=Resource("fn", type=ResourceType.LAMBDA), timeout_seconds=600)
+    s.next(t)
+    assert t.TimeoutSeconds == 600
+    t = Task("later", resource=Resource("fn", type=ResourceType.LAMBDA))
+    t.TimeoutSeconds = 600
+    s.next(t)
+    assert t.TimeoutSeconds == 600
+
+    loaded = StateMachine.from_json('{"StartAt": "a", "States": {"a": {"Type": "Task", '
+                                    '"Resource": "arn:aws:lambda:eu-west-1:1:function:a", "TimeoutSeconds": 300, '
+                                    '"End": true}}}')
+    assert loaded.build().States["a"].TimeoutSeconds == 300
@@ -0,0 +1,253 @@
+"""
+Checks the graph of a machine for problems Step Functions would reject or which would hang executions:
+transitions to missing states, unreachable states, states with no way to finish and loops without a Wait.
+Express machines are also checked for integrations Express workflows cannot run and for Wait seconds and task
+timeouts adding up to more than an Express execution may last.
+
+The adjacency of each machine is indexed once and every check is a linear walk over it, so validating
+is cheap enough to run on every build, see StateMachine.validate_on_build.
+"""
+import warnings
+from typing import List, Tuple, Union
+
+from steppygraph.machine import StateMachine, TERMINAL_STATES, nested_machines
+from steppygraph.states import State, StateType, Task, ResourceType, WorkflowType, EXPRESS_MAX_DURATION
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# the names of the Parallel states and branch indexes leading to a state, then its own name
+StatePath = Tuple[Union[str, int], ...]
+
+_TERMINAL_TYPES = tuple(t.value for t in TERMINAL_STATES)
+
+
+class Diagnostic:
+    """
+    One problem found in a machine. code is stable and meant for filtering, message is for people.
+    """
+    __slots__ = ('severity', 'code', 'path', 'message')
+
+    def __init__(self, severity: str, code: str, path: StatePath, message: str) -> None:
+        self.severity = severity
+        self.code = code
+        self.path = path
+        self.message = message
+
+    def __repr__(self) -> str:
+        return f"Diagnostic({self.severity}, {self.code}, {self.path}, {self.message!r})"
+
+    def __str__(self) -> str:
+        where = '/'.join(str(p) for p in self.path) or '<machine>'
+        return f"{self.severity}: {where}: {self.message} [{self.code}]"
+
+
+class ValidationError(ValueError):
+
+    def __init__(self, diagnostics: List[Diagnostic]) -> None:
+        ValueError.__init__(self, '\n'.join(str(d) for d in diagnostics))
+        self.diagnostics = diagnostics
+
+
+class ValidationWarning(UserWarning):
+    """
+    Issued by the build of an Express machine for each warning about it, see check_express
+    """
+
+
+def _transitions(state: State) -> List[Tuple[str, str]]:
+    """
+    Returns (field, target name) for every transition out of a state
+    """
+    out = []
+    nxt = state._next or getattr(state, 'Next', None)
+    if nxt:
+        out.append(('Next', nxt))
+    for c in getattr(state, '_catch', None) or getattr(state, 'Catch', None) or []:
+        out.append(('Catch', c._next.name()))
+    for case in getattr(state, 'Choices', None) or []:
+        out.append(('Choices', case.Next))
+    default = getattr(state, 'Default', None)
+    if default:
+        out.append(('Default', default))
+    return out
+
+
+def _ends(state: State, last: bool) -> bool:
+    return state.Type in _TERMINAL_TYPES or state.End is True or last
+
+
+def _components(adj: List[List[int]]) -> List[List[int]]:
+    """
+    Tarjan's strongly connected components, iterative so deep graphs do not hit the recursion limit
+    """
+    n = len(adj)
+    index = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    stack: List[int] = []
+    result: List[List[int]] = []
+    counter = 0
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        work = [(root, 0)]
+        while work:
+            v, i = work[-1]
+            if i == 0:
+                index[v] = low[v] = counter
+                counter += 1
+                stack.append(v)
+                on_stack[v] = True
+            edges = adj[v]
+            while i < len(edges):
+                w = edges[i]
+                i += 1
+                if index[w] == -1:
+                    work[-1] = (v, i)
+                    work.append((w, 0))
+                    break
+                if on_stack[w]:
+                    low[v] = min(low[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        component.append(w)
+                        if w == v:
+                            break
+                    result.append(component)
+    return result
+
+
+def _walk(start: List[int], adj: List[List[int]], n: int) -> List[bool]:
+    seen = [False] * n
+    for s in start:
+        seen[s] = True
+    todo = list(start)
+    while todo:
+        v = todo.pop()
+        for w in adj[v]:
+            if not seen[w]:
+                seen[w] = True
+                todo.append(w)
+    return seen
+
+
+def _validate(machine: StateMachine, path: StatePath, out: List[Diagnostic]) -> None:
+    states = machine.get_states()
+    n = len(states)
+    if not n:
+        out.append(Diagnostic(ERROR, 'empty', path, "machine has no states"))
+        return
+
+    adj: List[List[int]] = [[] for _ in range(n)]
+    radj: List[List[int]] = [[] for _ in range(n)]
+    ends: List[int] = []
+    dangling = set()
+    for i, s in enumerate(states):
+        where = path + (s.name(),)
+        transitions = _transitions(s)
+        for field, target in transitions:
+            j = machine.idx(target)
+            if j is None:
+                out.append(Diagnostic(ERROR, 'missing-target', where, f"{field} names unknown state '{target}'"))
+                continue
+            adj[i].append(j)
+            radj[j].append(i)
+        if _ends(s, i == n - 1):
+            ends.append(i)
+        elif not transitions and s.Type != StateType.CHOICE.value:
+            dangling.add(i)
+            out.append(Diagnostic(ERROR, 'no-transition', where, "state has neither Next nor End"))
+        for b, branch in enumerate(nested_machines(s)):
+            _validate(branch, where + (b,), out)
+
+    reachable = _walk([0], adj, n)
+    finishes = _walk(ends, radj, n)
+    for i, s in enumerate(states):
+        if not reachable[i]:
+            out.append(Diagnostic(ERROR, 'unreachable', path + (s.name(),),
+                                  f"state cannot be reached from StartAt '{states[0].name()}'"))
+        elif not finishes[i] and i not in dangling:
+            out.append(Diagnostic(ERROR, 'no-exit', path + (s.name(),), "no path from this state ends the execution"))
+
+    for component in _components(adj):
+        if len(component) == 1 and component[0] not in adj[component[0]]:
+            continue
+        if any(states[i].Type == StateType.WAIT.value for i in component):
+            continue
+        names = sorted(states[i].name() for i in component)
+        out.append(Diagnostic(WARNING, 'busy-loop', path + (states[min(component)].name(),),
+                              f"loop through {names} has no Wait state"))
+
+
+def _express_states(machine: StateMachine, path: StatePath, out: List[Diagnostic]) -> None:
+    for s in machine.get_states():
+        where = path + (s.name(),)
+        if isinstance(s, Task) and s.Resource is not None:
+            res = s.Resource
+            if res.resource_type == ResourceType.ACTIVITY:
+                out.append(Diagnostic(ERROR, 'express-integration', where, "Express workflows cannot run activities"))
+            elif res.resource_type != ResourceType.LAMBDA and res.sync:
+                out.append(Diagnostic(ERROR, 'express-integration', where,
+                                      f"Express workflows cannot wait for '{res}' to finish"))
+        for b, branch in enumerate(nested_machines(s)):
+            _express_states(branch, where + (b,), out)
+
+
+def _express(machine: StateMachine, out: List[Diagnostic]) -> None:
+    from steppygraph.latency import analyze
+    _express_states(machine, (), out)
+    timeout = getattr(machine, 'TimeoutSeconds', None)
+    if timeout is not None and timeout > EXPRESS_MAX_DURATION:
+        out.append(Diagnostic(WARNING, 'express-duration', (),
+                              f"TimeoutSeconds {timeout} is over the {EXPRESS_MAX_DURATION} seconds "
+                              f"an Express execution may run"))
+    # each loop is counted once, a loop may well finish in time
+    a = analyze(machine, max_iterations=1)
+    if a.worst > EXPRESS_MAX_DURATION:
+        slowest = ', '.join('/'.join(str(p) for p in step.path) for step in a.dominant(3) if step.worst > 0)
+        out.append(Diagnostic(WARNING, 'express-duration', (),
+                              f"Wait seconds and task timeouts add up to {a.worst:g} seconds in the worst case, "
+                              f"over the {EXPRESS_MAX_DURATION} an Express execution may run, mostly in {slowest}"))
+
+
+def validate(machine: StateMachine) -> List[Diagnostic]:
+    """
+    Returns every problem found in the machine and its branches, errors and warnings alike
+    """
+    out: List[Diagnostic] = []
+    _validate(machine, (), out)
+    if machine.workflow_type == WorkflowType.EXPRESS:
+        _express(machine, out)
+    return out
+
+
+def check(machine: StateMachine, include_warnings: bool = False) -> None:
+    """
+    Raises ValidationError listing the errors found in the machine, and the warnings too if include_warnings is True
+    """
+    problems = [d for d in validate(machine) if include_warnings or d.severity == ERROR]
+    if problems:
+        raise ValidationError(problems)
+
+
+def check_express(machine: StateMachine) -> None:
+    """
+    Raises ValidationError listing what an Express machine runs that Express workflows do not support,
+    and issues a ValidationWarning for each warning, such as durations over the Express limit
+    """
+    out: List[Diagnostic] = []
+    _express(machine, out)
+    errors = [d for d in out if d.severity == ERROR]
+    if errors:
+        raise ValidationError(errors)
+    for d in out:
+        warnings.warn(str(d), ValidationWarning, stacklevel=3)